@@ -2,11 +2,25 @@
 # Copyright 2021 umtdg
 # See LICENSE file for licensing details.
 
+import hashlib
+import inspect
+import json
 import logging
+import os
+import time
+
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union
+)
 
 from ops.charm import (
     CharmBase,
-    ActionEvent
+    ActionEvent,
+    RelationEvent
 )
 from ops.main import main
 from ops.framework import StoredState
@@ -14,6 +28,7 @@ from ops.model import (
     ActiveStatus,
     ModelError,
     BlockedStatus,
+    Relation,
     MaintenanceStatus
 )
 from ops.pebble import PathError
@@ -21,13 +36,46 @@ from ops.pebble import PathError
 from coredns import (
     CoreDNSCorefile,
     CoreDNSZone,
+    CoreDNSTemplateZone,
+    CoreDNSPlugin,
     PLUGIN_LOG,
     PLUGIN_ERRORS,
     PLUGIN_CACHE,
     PLUGIN_FORWARD_CLOUDFLARE
 )
-from dnszonefile import CoreDNSZoneFile
+from charmconfig import (
+    ConfigError,
+    cache_plugin,
+    forward_plugin,
+    go_runtime_environment,
+    kubernetes_config_properties,
+    multisocket_plugin
+)
+from goruntime import (
+    CgroupLimits,
+    read_cgroup_limits
+)
+from kubernetesplugin import apply_kubernetes_properties
+from serialization import (
+    SerializationError,
+    encode_corefile,
+    decode_corefile,
+    encode_corefile_delta,
+    decode_corefile_delta,
+    decode_zonefile,
+    encode_hoststable,
+    decode_hoststable,
+    encode_script,
+    decode_script
+)
+from hoststable import HostsTable
+from pushpipeline import (
+    DIGEST_SUFFIX,
+    PushPipeline,
+    PushResult
+)
 from parser import (
+    Operation,
     Parser,
     PARSER_COMMANDS,
     ValidationError,
@@ -37,9 +85,29 @@ from parser import (
 
 logger = logging.getLogger(__name__)
 
+COREFILE_PATH = "/Corefile"
+# Zone of the default Corefile, the only zone whose plugins follow 'cache-*'
+# and 'forward-*' config options
+DEFAULT_ZONE = ".:53"
+# Maximum number of files pushed to the workload at once
+PUSH_WORKERS = 4
+
+# Processes compiling scripts included by script-file
+SCRIPT_WORKERS = min(4, os.cpu_count() or 1)
+# Number of operations applied between checks of 'script-time-budget'
+SCRIPT_CHUNK_SIZE = 1024
+# Source of the parser, compiled scripts are cached only for the same parser
+PARSER_SOURCE = inspect.getfile(Parser)
+
 ACTION_RESULT_NO_REPLACE = {"result": "Not replacing, nothing changed"}
 ACTION_RESULT_REMOVE_NOT_FOUND = {"result": "Not found, nothing changed"}
 
+PEER_RELATION = "coredns-peers"
+PEER_KEY_DIGEST = "corefile-digest"
+PEER_KEY_COREFILE = "corefile"
+# Serialized hosts tables by their names, as JSON
+PEER_KEY_HOSTS = "hosts-tables"
+
 
 # TODO: Add functions to handle actions
 # TODO: Default Corefile
@@ -55,6 +123,12 @@ class CorednsK8SCharm(CharmBase):
         self.framework.observe(self.on.coredns_pebble_ready, self._on_coredns_pebble_ready)
 
         # Basic hooks
+        self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
+        self.framework.observe(
+            self.on[PEER_RELATION].relation_changed,
+            self._on_peer_relation_changed
+        )
 
         # Action hooks
         self.framework.observe(self.on.add_property_action, self._on_add_property)
@@ -63,68 +137,320 @@ class CorednsK8SCharm(CharmBase):
         self.framework.observe(self.on.remove_plugin_action, self._on_remove_plugin)
         self.framework.observe(self.on.add_zone_action, self._on_add_zone)
         self.framework.observe(self.on.remove_zone_action, self._on_remove_zone)
+        self.framework.observe(self.on.set_kubernetes_action, self._on_set_kubernetes)
+        self.framework.observe(self.on.set_autopath_action, self._on_set_autopath)
+        self.framework.observe(self.on.add_rewrite_action, self._on_add_rewrite)
+        self.framework.observe(self.on.remove_rewrite_action, self._on_remove_rewrite)
+        self.framework.observe(self.on.compile_rewrite_action, self._on_compile_rewrite)
+        self.framework.observe(self.on.add_snippet_action, self._on_add_snippet)
+        self.framework.observe(self.on.remove_snippet_action, self._on_remove_snippet)
+        self.framework.observe(self.on.import_snippet_action, self._on_import_snippet)
+        self.framework.observe(self.on.add_template_action, self._on_add_template)
+        self.framework.observe(self.on.remove_template_action, self._on_remove_template)
+        self.framework.observe(
+            self.on.add_zone_from_template_action,
+            self._on_add_zone_from_template
+        )
         self.framework.observe(self.on.print_corefile_action, self._on_print_corefile)
         self.framework.observe(self.on.print_zone_action, self._on_print_zone)
+        self.framework.observe(self.on.print_chain_action, self._on_print_chain)
+        self.framework.observe(self.on.route_name_action, self._on_route_name)
+        self.framework.observe(self.on.find_plugin_action, self._on_find_plugin)
+        self.framework.observe(self.on.set_hosts_action, self._on_set_hosts)
+        self.framework.observe(self.on.remove_hosts_action, self._on_remove_hosts)
+        self.framework.observe(self.on.print_hosts_action, self._on_print_hosts)
         # self.framework.observe(self.on.print_zonefile_action, self._on_print_zonefile)
         self.framework.observe(self.on.update_action, self._on_update)
+        self.framework.observe(self.on.rollback_action, self._on_rollback)
 
-        self._default_corefile = CoreDNSCorefile(
+        self._default_corefile = encode_corefile(CoreDNSCorefile(
             {
-                ".": CoreDNSZone(".", 53, {
-                    "forward": PLUGIN_FORWARD_CLOUDFLARE,
-                    "log": PLUGIN_LOG,
-                    "errors": PLUGIN_ERRORS,
-                    "cache": PLUGIN_CACHE
+                DEFAULT_ZONE: CoreDNSZone(".", 53, {
+                    "forward": self._forward_plugin(),
+                    "log": PLUGIN_LOG.copy(),
+                    "errors": PLUGIN_ERRORS.copy(),
+                    "cache": self._cache_plugin()
                 })
             }
-        ).to_dict()
+        ))
 
         self._stored.set_default(
             corefile=self._default_corefile,
             new_corefile=self._default_corefile,
-            zonefiles={}
+            zonefiles={},
+            hosts_tables={},
+            # Previously applied Corefiles, oldest first, each stored as its
+            # difference from the one applied after it
+            history=[],
+            peer_digest="",
+            peer_hosts_digest="",
+            # Operations compiled from script-file resource and its digest
+            script_digest="",
+            script="",
+            script_includes=[],
+            # Progress of script-file applied in chunks over multiple hooks
+            script_checkpoint={},
+            # Digests of the files last pushed to the workload and of its layer
+            pushed_digests={},
+            layer_digest="",
+            aggregate_server_blocks=False,
+            extract_snippets=False,
+            # Tokens of the 'multisocket' plugin added by the last render,
+            # empty if the plugin is not managed by the charm
+            multisocket=[]
         )
 
+    @staticmethod
+    def _load_corefile(data: Union[str, Dict]) -> CoreDNSCorefile:
+        # Units upgraded from older revisions store Corefiles as dictionaries
+        if isinstance(data, str):
+            return decode_corefile(data, lazy=True)
+        return CoreDNSCorefile.from_dict(data)
+
     @property
-    def corefile(self):
-        return CoreDNSCorefile.from_dict(self._stored.corefile)
+    def corefile(self) -> CoreDNSCorefile:
+        return self._load_corefile(self._stored.corefile)
+
+    @corefile.setter
+    def corefile(self, corefile: CoreDNSCorefile):
+        self._stored.corefile = encode_corefile(corefile)
 
     @property
-    def new_corefile(self):
-        return CoreDNSCorefile.from_dict(self._stored.new_corefile)
+    def new_corefile(self) -> CoreDNSCorefile:
+        return self._load_corefile(self._stored.new_corefile)
+
+    @new_corefile.setter
+    def new_corefile(self, corefile: CoreDNSCorefile):
+        self._stored.new_corefile = encode_corefile(corefile)
+
+    def _cache_plugin(self) -> CoreDNSPlugin:
+        try:
+            return cache_plugin(self.config)
+        except ConfigError as e:
+            logger.error("Invalid cache config: {}. Using default cache plugin".format(e.message))
+            return PLUGIN_CACHE.copy()
+
+    def _forward_plugin(self) -> CoreDNSPlugin:
+        try:
+            return forward_plugin(self.config)
+        except ConfigError as e:
+            logger.error("Invalid forward config: {}. Using default forward plugin".format(
+                e.message
+            ))
+            return PLUGIN_FORWARD_CLOUDFLARE.copy()
+
+    def _render_corefile(self, corefile: CoreDNSCorefile, container) -> str:
+        """Render corefile as it will be written to the workload
+
+        The 'multisocket' plugin managed by 'multisocket-sockets' is added
+        here, using the limits of the workload container, so stored Corefiles
+        and templates never contain it.
+        """
+
+        multisocket = self._multisocket_plugin(container)
+        self._stored.multisocket = [] if multisocket is None else (
+            [multisocket.name] + multisocket.args
+        )
+        if multisocket is not None:
+            corefile = self._with_multisocket(corefile, multisocket)
+
+        self._stored.aggregate_server_blocks = self.config.get("aggregate-server-blocks", False)
+        self._stored.extract_snippets = self.config.get("extract-snippets", False)
+        return corefile.to_caddy(
+            aggregate=self._stored.aggregate_server_blocks,
+            snippets=self._stored.extract_snippets
+        )
+
+    @staticmethod
+    def _script_digest(paths: List[str]) -> str:
+        """Return digest of a script, the scripts it includes and the parser"""
+
+        digest = hashlib.sha256()
+        for path in [PARSER_SOURCE] + paths:
+            try:
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                # Missing includes make the digest differ, compiling reports them
+                digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    def _script_resources(self) -> Dict[str, str]:
+        """Return paths of file resources that scripts can include"""
+
+        resources = {}
+        for name, resource in self.meta.resources.items():
+            if resource.type != "file":
+                continue
+            try:
+                resources[name] = str(self.model.resources.fetch(name))
+            except (ModelError, NameError):
+                continue
+
+        return resources
+
+    def _compile_script(self, filename: str) -> List[Operation]:
+        """Return operations of a script, compiled again only if it or any
+        script it includes changed"""
+
+        digest = self._script_digest([filename] + list(self._stored.script_includes))
+        if digest == self._stored.script_digest:
+            try:
+                return decode_script(self._stored.script)
+            except SerializationError as e:
+                logger.warning("Compiled script is corrupted, compiling again: "
+                               "{}".format(e.message))
+
+        includes: List[str] = []
+        operations = Parser.compile_file(
+            filename,
+            resources=self._script_resources(),
+            workers=SCRIPT_WORKERS,
+            includes=includes
+        )
+
+        self._stored.script_includes = includes
+        self._stored.script_digest = self._script_digest([filename] + includes)
+        self._stored.script = encode_script(operations)
+        return operations
+
+    def _corefile_digest(self) -> str:
+        """Return digest of the stored corefile"""
+
+        data = self._stored.corefile
+        if not isinstance(data, str):
+            data = encode_corefile(self.corefile)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _script_checkpoint(
+            self,
+            digest: str,
+            base: str
+    ) -> Tuple[int, Optional[CoreDNSCorefile]]:
+        """Return offset and partial corefile of an interrupted apply of the
+        script with given digest to the corefile with digest base, (0, None)
+        if there is none or it is invalid"""
+
+        checkpoint = self._stored.script_checkpoint
+        if not checkpoint or checkpoint["script"] != digest:
+            return 0, None
+
+        if checkpoint.get("base") != base:
+            # Corefile changed since the script started, i.e. by an action or a peer
+            logger.debug("Corefile changed since script checkpoint, applying script from start")
+            return 0, None
+
+        partial = checkpoint["corefile"]
+        if hashlib.sha256(partial.encode()).hexdigest() != checkpoint["digest"]:
+            logger.warning("Script checkpoint is corrupted, applying script from start")
+            return 0, None
+
+        try:
+            return checkpoint["offset"], decode_corefile(partial, lazy=True)
+        except SerializationError as e:
+            logger.warning("Script checkpoint is corrupted, applying script from start: "
+                           "{}".format(e.message))
+            return 0, None
+
+    def _save_script_checkpoint(
+            self,
+            digest: str,
+            base: str,
+            offset: int,
+            corefile: CoreDNSCorefile
+    ):
+        partial = encode_corefile(corefile)
+        self._stored.script_checkpoint = {
+            "script": digest,
+            "base": base,
+            "offset": offset,
+            "corefile": partial,
+            "digest": hashlib.sha256(partial.encode()).hexdigest()
+        }
+
+    def parse_actions_file(self) -> bool:
+        """Apply script-file resource to the current corefile
+
+        Operations are applied until 'script-time-budget' seconds pass. If
+        the script is not finished, progress is saved in a checkpoint and
+        the next call continues from it.
+
+        Returns:
+            Returns True if the whole script is applied
+        """
 
-    def parse_actions_file(self):
         logger.debug("Parsing actions file")
 
+        budget = self.config.get("script-time-budget", 0)
+        deadline = time.monotonic() + budget if budget > 0 else None
         corefile = self.corefile
 
         try:
             actions_file = self.model.resources.fetch("script-file")
-            Parser.exec(corefile, actions_file)
+            operations = self._compile_script(actions_file)
+
+            digest = self._stored.script_digest
+            base = self._corefile_digest()
+            offset, partial = self._script_checkpoint(digest, base)
+            if partial is not None:
+                logger.debug("Resuming script from operation {}".format(offset))
+                corefile = partial
+
+            while offset < len(operations):
+                chunk = operations[offset:offset + SCRIPT_CHUNK_SIZE]
+                Parser.apply(corefile, chunk)
+                offset += len(chunk)
+
+                if deadline is not None and offset < len(operations) and (
+                        time.monotonic() >= deadline
+                ):
+                    self._save_script_checkpoint(digest, base, offset, corefile)
+                    self.unit.status = MaintenanceStatus(
+                        "Applying script-file: {}/{} operations".format(offset, len(operations))
+                    )
+                    return False
         except ModelError:
             logger.debug("Resource 'script-file' not found. Using default Corefile")
 
-            corefile = CoreDNSCorefile.from_dict(self._default_corefile)
+            corefile = decode_corefile(self._default_corefile)
         except RequiredError as e:
             logger.error("An error occurred while reading actions file: "
                          " {}. Using default Corefile".format(e.message))
 
-            corefile = CoreDNSCorefile.from_dict(self._default_corefile)
+            corefile = decode_corefile(self._default_corefile)
+        except (RuntimeError, ValidationError, ValueError) as e:
+            # Compiling or applying failed, i.e. a command on an unknown zone
+            logger.error("An error occurred while reading actions file: "
+                         " {}. Using default Corefile".format(e))
+
+            corefile = decode_corefile(self._default_corefile)
 
-        self._stored.corefile = corefile.to_dict()
+        self._stored.script_checkpoint = {}
+        self._replace_corefile(corefile)
         self._stored.new_corefile = self._stored.corefile
+        return True
 
     def _on_coredns_pebble_ready(self, event):
         # Get a reference the container attribute on the PebbleReadyEvent
         container = event.workload
 
         self.unit.status = MaintenanceStatus("Parsing actions file")
-        self.parse_actions_file()
+        if not self.parse_actions_file():
+            # /Corefile is pushed only once the whole script is applied
+            event.defer()
+            return
+
+        pipeline = self._pipeline(container)
+        pipeline.add(COREFILE_PATH, self._render_corefile(self.corefile, container), reload=True)
+        for name in self._stored.hosts_tables:
+            pipeline.add(HostsTable.path(name), self._hosts_table(name).to_hosts(), make_dirs=True)
 
+        changed = False
         try:
             logger.debug("Creating /Corefile")
 
-            container.push("/Corefile", self.corefile.to_caddy())
+            changed = PushPipeline.reload_required(self._run_pipeline(pipeline))
         except PathError as e:
             logger.fatal("Error: Failed to create /Corefile: {}".format(e.message))
 
@@ -132,9 +458,26 @@ class CorednsK8SCharm(CharmBase):
                 f"Failed to create /Corefile"
             )
 
-        logger.debug("Adding pebble layer")
+        if self._add_layer(container):
+            changed = True
+
+        if not self._service_running(container):
+            logger.debug("Auto starting services in container")
+            container.autostart()
+        elif changed:
+            logger.debug("Restarting service: coredns")
+            container.stop("coredns")
+            container.autostart()
+        else:
+            logger.debug("Corefile and layer not changed, not restarting coredns")
+
+        self._publish_corefile()
+
+        self.unit.status = ActiveStatus("Pebble ready")
 
-        pebble_layer = {
+    @staticmethod
+    def _pebble_layer(environment: Dict[str, str]) -> Dict:
+        return {
             "summary": "coredns layer",
             "description": "pebble config layer for coredns",
             "services": {
@@ -143,16 +486,433 @@ class CorednsK8SCharm(CharmBase):
                     "summary": "coredns",
                     "command": "/coredns -conf /Corefile",
                     "startup": "enabled",
+                    "environment": environment
                 }
             },
         }
-        container.add_layer("coredns", pebble_layer, combine=True)
 
-        logger.debug("Auto starting services in container")
+    @staticmethod
+    def _cgroup_limits(container) -> CgroupLimits:
+        """Return limits of the workload container"""
 
-        container.autostart()
+        def read(path: str) -> Optional[str]:
+            try:
+                return container.pull(path).read()
+            except PathError:
+                return None
 
-        self.unit.status = ActiveStatus("Pebble ready")
+        return read_cgroup_limits(read)
+
+    def _go_environment(self, container) -> Dict[str, str]:
+        """Return Go runtime environment from the limits of the workload
+        container and 'go-*' config options"""
+
+        limits = self._cgroup_limits(container)
+        try:
+            return go_runtime_environment(self.config, limits)
+        except ConfigError as e:
+            logger.error("Invalid Go runtime config, using container limits: {}".format(e.message))
+            return go_runtime_environment({}, limits)
+
+    def _add_layer(self, container) -> bool:
+        """Add pebble layer unless the plan already has the same one
+
+        Returns:
+            Returns True if layer is added
+        """
+
+        layer = self._pebble_layer(self._go_environment(container))
+        digest = hashlib.sha256(json.dumps(layer, sort_keys=True).encode()).hexdigest()
+
+        service = container.get_plan().services.get("coredns")
+        expected = layer["services"]["coredns"]
+        if digest == self._stored.layer_digest and service is not None and (
+                service.command == expected["command"]
+        ) and dict(service.environment) == expected["environment"]:
+            logger.debug("Pebble layer not changed")
+            return False
+
+        logger.debug("Adding pebble layer with environment {}".format(expected["environment"]))
+        container.add_layer("coredns", layer, combine=True)
+        self._stored.layer_digest = digest
+        return True
+
+    @staticmethod
+    def _service_running(container) -> bool:
+        try:
+            return container.get_service("coredns").is_running()
+        except ModelError:
+            return False
+
+    def _pipeline(self, container) -> PushPipeline:
+        return PushPipeline(container, self._stored.pushed_digests, workers=PUSH_WORKERS)
+
+    @staticmethod
+    def _run_pipeline(pipeline: PushPipeline) -> List[PushResult]:
+        start = time.monotonic()
+        results = pipeline.run()
+        for result in results:
+            logger.debug("Pushed {}".format(result.report()))
+        logger.debug("Pushed {} of {} files in {:.1f}ms".format(
+            sum(result.pushed for result in results),
+            len(results),
+            (time.monotonic() - start) * 1000
+        ))
+        return results
+
+    @property
+    def peer_relation(self) -> Optional[Relation]:
+        return self.model.get_relation(PEER_RELATION)
+
+    def _publish_corefile(self):
+        """Publish digest and serialized current Corefile to peers if leader"""
+
+        relation = self.peer_relation
+        if relation is None or not self.unit.is_leader():
+            return
+
+        self._publish_hosts()
+
+        corefile = self.corefile
+        digest = corefile.digest()
+        app_data = relation.data[self.app]
+        if app_data.get(PEER_KEY_DIGEST) == digest:
+            return
+
+        logger.debug("Publishing Corefile {} to peers".format(digest))
+
+        app_data[PEER_KEY_COREFILE] = encode_corefile(corefile)
+        app_data[PEER_KEY_DIGEST] = digest
+
+    def _publish_hosts(self):
+        """Publish serialized hosts tables to peers if leader"""
+
+        relation = self.peer_relation
+        if relation is None or not self.unit.is_leader():
+            return
+
+        tables = json.dumps(dict(self._stored.hosts_tables), sort_keys=True)
+        app_data = relation.data[self.app]
+        if app_data.get(PEER_KEY_HOSTS) != tables:
+            logger.debug("Publishing {} hosts tables to peers".format(
+                len(self._stored.hosts_tables)
+            ))
+            app_data[PEER_KEY_HOSTS] = tables
+
+    def _remove_hosts_file(self, container, name: str):
+        path = HostsTable.path(name)
+        container.remove_path(path)
+        container.remove_path(path + DIGEST_SUFFIX)
+        self._stored.pushed_digests.pop(path, None)
+
+    def _sync_hosts_tables(self, container, tables: Dict[str, str]):
+        """Make hosts tables of the unit the same as tables published by the leader
+
+        Raises:
+            ValueError: When a table name is invalid
+            SerializationError: When a table cannot be decoded
+            PathError: When a hosts file cannot be pushed or removed
+        """
+
+        decoded = {name: decode_hoststable(data) for name, data in tables.items()}
+
+        pipeline = self._pipeline(container)
+        for name, table in decoded.items():
+            pipeline.add(HostsTable.path(name), table.to_hosts(), make_dirs=True)
+        self._run_pipeline(pipeline)
+
+        for name in list(self._stored.hosts_tables):
+            if name not in tables:
+                self._remove_hosts_file(container, name)
+                del self._stored.hosts_tables[name]
+        for name, data in tables.items():
+            self._stored.hosts_tables[name] = data
+
+    def _on_leader_elected(self, _):
+        self._publish_corefile()
+
+    def _on_peer_relation_changed(self, event: RelationEvent):
+        if self.unit.is_leader():
+            return
+
+        app_data = event.relation.data[self.app]
+        hosts = app_data.get(PEER_KEY_HOSTS, "")
+        hosts_digest = hashlib.sha256(hosts.encode()).hexdigest() if hosts else ""
+        hosts_changed = hosts_digest != self._stored.peer_hosts_digest
+
+        digest = app_data.get(PEER_KEY_DIGEST, "")
+        corefile = None
+        if digest and digest != self._stored.peer_digest:
+            try:
+                corefile = decode_corefile(app_data[PEER_KEY_COREFILE])
+            except SerializationError as e:
+                logger.error("Failed to decode Corefile from leader: {}".format(e.message))
+
+        if not hosts_changed and corefile is None:
+            return
+
+        container = self.unit.get_container("coredns")
+        if not container.can_connect():
+            event.defer()
+            return
+
+        # Hosts files are pushed first, since the Corefile may refer to them
+        if hosts_changed:
+            logger.debug("Applying hosts tables from leader")
+            try:
+                self._sync_hosts_tables(container, json.loads(hosts) if hosts else {})
+                self._stored.peer_hosts_digest = hosts_digest
+            except (ValueError, SerializationError, PathError) as e:
+                logger.error("Failed to apply hosts tables from leader: {}".format(e))
+
+        if corefile is None:
+            return
+
+        logger.debug("Applying Corefile {} from leader".format(digest))
+
+        if corefile != self.corefile:
+            self._apply_corefile(container, corefile)
+        self._stored.new_corefile = self._stored.corefile
+        self._stored.peer_digest = digest
+
+    @staticmethod
+    def _patch_plugins(
+            corefile: CoreDNSCorefile,
+            plugins: List[CoreDNSPlugin],
+            kubernetes: Optional[Dict[str, Optional[List[str]]]] = None
+    ) -> bool:
+        """Replace given plugins in the default zone if it already uses them,
+        and apply kubernetes properties to every zone and snippet
+
+        Other zones keep their own plugins, i.e. a 'forward' to the resolvers
+        of a split DNS zone. Templates and the zones that still follow them
+        are never patched, since their plugins come from per-zone variables.
+
+        Args:
+            corefile: Corefile to patch
+            plugins: Plugins that will replace the plugins with the same name
+                in the default zone
+            kubernetes: Properties to apply to existing kubernetes plugins
+
+        Returns:
+            Returns True if any zone is changed
+        """
+
+        keys = [
+            key for key, zone in corefile.objects.items()
+            if not isinstance(zone, CoreDNSTemplateZone) or zone.materialized()
+        ]
+        keys += [snippet.name_string for snippet in corefile.snippets.values()]
+
+        changed = False
+        for key in keys:
+            # Blocks are changed only if required, since corefile may share them
+            block = corefile.block(key, edit=False)
+            patched = [
+                plugin for plugin in plugins
+                if key == DEFAULT_ZONE and plugin.name in block.objects and (
+                    block.objects[plugin.name] != plugin
+                )
+            ]
+
+            kubernetes_plugin = None
+            if kubernetes and "kubernetes" in block.objects:
+                kubernetes_plugin = block.objects["kubernetes"].copy()
+                if not apply_kubernetes_properties(kubernetes_plugin, kubernetes):
+                    kubernetes_plugin = None
+
+            if kubernetes_plugin is not None:
+                patched.append(kubernetes_plugin)
+            if patched:
+                block = corefile.block(key)
+                for plugin in patched:
+                    block.add_object(plugin)
+                changed = True
+
+        return changed
+
+    def _multisocket_plugin(self, container) -> Optional[CoreDNSPlugin]:
+        """Return 'multisocket' plugin for the limits of the workload container,
+        None if it is not managed by the charm"""
+
+        try:
+            return multisocket_plugin(self.config, self._go_environment(container))
+        except ConfigError as e:
+            logger.error("Invalid multisocket config, not adding multisocket: {}".format(
+                e.message
+            ))
+            return None
+
+    @staticmethod
+    def _with_multisocket(corefile: CoreDNSCorefile, plugin: CoreDNSPlugin) -> CoreDNSCorefile:
+        """Return a snapshot of corefile where plugin is the only 'multisocket'
+        plugin of every zone
+
+        Zones following a template get their own plugins in the snapshot
+        only. Snippets lose their 'multisocket' plugins, since zones importing
+        them would get two. Blocks that already match are shared with corefile.
+        """
+
+        corefile = corefile.snapshot()
+        keys = list(corefile.objects)
+        snippets = [snippet.name_string for snippet in corefile.snippets.values()]
+
+        for key in keys + snippets:
+            block = corefile.block(key, edit=False)
+            instances = block.instances("multisocket")
+            expected = [] if key in snippets else [plugin]
+            if [block.objects[instance] for instance in instances] == expected:
+                continue
+
+            block = corefile.block(key)
+            for instance in instances:
+                block.remove_object(instance)
+            if expected:
+                block.add_object(plugin)
+
+        return corefile
+
+    def _on_config_changed(self, _):
+        container = self.unit.get_container("coredns")
+        connected = container.can_connect()
+        try:
+            plugins = [cache_plugin(self.config), forward_plugin(self.config)]
+            kubernetes = kubernetes_config_properties(self.config)
+            # Limits are read only if the container is reachable
+            environment = go_runtime_environment(
+                self.config,
+                self._cgroup_limits(container) if connected else None
+            )
+            multisocket = multisocket_plugin(self.config, environment)
+        except ConfigError as e:
+            self.unit.status = BlockedStatus(f"Invalid config: {e.message}")
+            return
+
+        corefile = self.corefile
+        if self._stored.new_corefile == self._stored.corefile:
+            # Zones that are not patched are shared by both
+            new_corefile = corefile.snapshot()
+        else:
+            new_corefile = self.new_corefile
+        new_changed = self._patch_plugins(new_corefile, plugins, kubernetes)
+        changed = self._patch_plugins(corefile, plugins, kubernetes)
+
+        for zone in list(corefile.objects.values()) + list(new_corefile.objects.values()):
+            reason = zone.validate_autopath()
+            if reason is not None:
+                self.unit.status = BlockedStatus(f"Invalid config for zone {zone.key}: {reason}")
+                return
+
+        # Rendering adds the same 'multisocket' plugin to every zone if managed
+        reason = None if multisocket is not None else (
+            corefile.validate_multisocket() or new_corefile.validate_multisocket()
+        )
+        if reason is not None:
+            self.unit.status = BlockedStatus(f"Invalid config: {reason}")
+            return
+
+        if new_changed:
+            self.new_corefile = new_corefile
+
+        aggregate = self.config.get("aggregate-server-blocks", False)
+        snippets = self.config.get("extract-snippets", False)
+        multisocket_tokens = [] if multisocket is None else [multisocket.name] + multisocket.args
+        render_changed = (aggregate, snippets) != (
+            self._stored.aggregate_server_blocks,
+            self._stored.extract_snippets
+        ) or (connected and multisocket_tokens != list(self._stored.multisocket))
+        # A new layer is used by the restart applying the Corefile, if any
+        layer_changed = connected and self._add_layer(container)
+
+        restarted = False
+        if changed or render_changed:
+            if connected:
+                restarted = self._apply_corefile(container, corefile)
+            else:
+                self._replace_corefile(corefile)
+
+        if layer_changed and not restarted:
+            logger.debug("Replanning services for the new pebble layer")
+            container.replan()
+
+    def _apply_corefile(
+            self,
+            container,
+            corefile: CoreDNSCorefile,
+            record: bool = True
+    ) -> bool:
+        """Store corefile as the current Corefile, push it and restart CoreDNS
+
+        Args:
+            container: Workload container
+            corefile: Corefile to apply
+            record: Whether to add the replaced Corefile to the history
+
+        Returns:
+            Returns True if CoreDNS is restarted
+        """
+
+        self.unit.status = MaintenanceStatus("Updating Corefile")
+
+        # Update stored Corefile and update on disk
+        self._replace_corefile(corefile, record=record)
+        changed = True
+        pipeline = self._pipeline(container)
+        pipeline.add(COREFILE_PATH, self._render_corefile(corefile, container), reload=True)
+        try:
+            changed = PushPipeline.reload_required(self._run_pipeline(pipeline))
+        except PathError as e:
+            self.unit.status = BlockedStatus(
+                "Failed to create /Corefile: Kind: {}, Message: {}".format(
+                    e.kind,
+                    e.message
+                )
+            )
+
+        if changed:
+            logger.debug("Restarting service: coredns")
+            container.stop("coredns")
+            container.autostart()
+        else:
+            logger.debug("Rendered Corefile not changed, not restarting coredns")
+
+        self._publish_corefile()
+
+        self.unit.status = ActiveStatus("Ready")
+        return changed
+
+    def _replace_corefile(self, corefile: CoreDNSCorefile, record: bool = True):
+        """Store corefile as the current Corefile
+
+        History entries are deltas from the Corefile applied after them, so
+        every replacement of the current Corefile goes through here.
+
+        Args:
+            corefile: New current Corefile
+            record: Whether to add the replaced Corefile to the history
+        """
+
+        data = encode_corefile(corefile)
+        if data == self._stored.corefile:
+            return
+
+        if record:
+            self._record_history(corefile)
+        self._stored.corefile = data
+
+    def _record_history(self, corefile: CoreDNSCorefile):
+        """Add current Corefile to the history before corefile replaces it
+
+        Only 'history-size' versions are kept, 0 disables the history.
+        """
+
+        size = self.config.get("history-size", 0)
+        if size <= 0:
+            self._stored.history = []
+            return
+
+        entry = encode_corefile_delta(self.corefile, corefile)
+        self._stored.history = (list(self._stored.history) + [entry])[-size:]
 
     def _check_current(
             self,
@@ -200,20 +960,187 @@ class CorednsK8SCharm(CharmBase):
             zone=zone
         )
 
-        if zone not in corefile.objects:
+        keys = corefile.find_zones(zone)
+        if not keys:
+            event.fail(f"Could not found zone {zone}")
+        else:
+            for key in keys:
+                print(corefile.objects[key].to_caddy())
+
+    def _on_print_chain(self, event: ActionEvent):
+        zone = event.params["zone"]
+
+        corefile = self._check_current(
+            event,
+            fmt="Printing plugin chain of zone '{zone}' from {current} corefile",
+            zone=zone
+        )
+
+        keys = corefile.find_zones(zone)
+        if not keys:
             event.fail(f"Could not found zone {zone}")
         else:
-            print(corefile.objects[zone].to_caddy())
+            event.set_results({
+                "chain": "\n".join(
+                    "{}: {}".format(
+                        key,
+                        " ".join(plugin.name for plugin in corefile.chain(key))
+                    ) for key in keys
+                )
+            })
+
+    def _on_route_name(self, event: ActionEvent):
+        name: str = event.params["name"]
+        port: int = event.params["port"]
+
+        corefile = self._check_current(
+            event,
+            fmt="Finding zone serving '{name}' in {current} corefile",
+            name=name
+        )
+
+        key = corefile.route(name, port=port or None)
+        if key is None:
+            event.fail(f"No zone serves {name}")
+        else:
+            event.set_results({
+                "zone": key,
+                "overlapping": " ".join(corefile.overlapping(key))
+            })
+
+    def _on_find_plugin(self, event: ActionEvent):
+        corefile = self._check_current(
+            event,
+            fmt="Finding zones using '{name}' in {current} corefile",
+            name=event.params["name"]
+        )
+
+        params = dict(event.params)
+        params["args"] = params.get("args", "").split()
+
+        try:
+            event.set_results({"result": PARSER_COMMANDS["find_plugin"](corefile, params)})
+        except ValidationError as e:
+            event.fail(e.message)
 
     def _on_print_zonefile(self, event: ActionEvent):
         zonefile: str = event.params["zonefile"]
 
         event.log("Outputting zone file")
         if zonefile in self._stored.zonefiles:
-            print(CoreDNSZoneFile.from_dict(self._stored.zonefiles[zonefile]).to_caddy())
+            print(decode_zonefile(self._stored.zonefiles[zonefile]).to_caddy())
         else:
             event.fail(f"Zone file {zonefile} not found")
 
+    def _hosts_table(self, name: str) -> HostsTable:
+        if name in self._stored.hosts_tables:
+            return decode_hoststable(self._stored.hosts_tables[name])
+        return HostsTable()
+
+    def _push_hosts(self, container, name: str, table: HostsTable):
+        logger.debug("Pushing hosts table {}".format(name))
+
+        pipeline = self._pipeline(container)
+        pipeline.add(HostsTable.path(name), table.to_hosts(), make_dirs=True)
+        self._run_pipeline(pipeline)
+
+    def _save_hosts(self, event: ActionEvent, name: str, old: HostsTable, new: HostsTable):
+        """Push hosts table if it is changed, without touching the Corefile
+
+        CoreDNS reloads hosts files by itself, so no restart is required.
+        """
+
+        added, removed = old.diff(new)
+        if not added and not removed:
+            event.set_results({"result": "Hosts table not changed, nothing to do"})
+            return
+
+        container = self.unit.get_container("coredns")
+        if not container.can_connect():
+            event.fail("Cannot connect to coredns container")
+            return
+
+        try:
+            if new:
+                self._push_hosts(container, name, new)
+            else:
+                self._remove_hosts_file(container, name)
+        except PathError as e:
+            event.fail(f"Failed to update hosts table {name}: {e.message}")
+            return
+
+        if new:
+            self._stored.hosts_tables[name] = encode_hoststable(new)
+        else:
+            del self._stored.hosts_tables[name]
+        self._publish_hosts()
+
+        event.set_results({
+            "path": HostsTable.path(name),
+            "added": len(added),
+            "removed": len(removed),
+            "entries": len(new)
+        })
+
+    @staticmethod
+    def _validate_hosts_name(event: ActionEvent, name: str) -> bool:
+        try:
+            HostsTable.validate_name(name)
+        except ValueError as e:
+            event.fail(str(e))
+            return False
+        return True
+
+    def _on_set_hosts(self, event: ActionEvent):
+        name: str = event.params["table"]
+        if not self._validate_hosts_name(event, name):
+            return
+        event.log(f"Setting hosts table {name}")
+
+        try:
+            table = HostsTable.parse(event.params["entries"])
+        except ValueError as e:
+            event.fail(f"Invalid hosts entries: {e}")
+            return
+
+        old = self._hosts_table(name)
+        if not event.params["replace"]:
+            new = HostsTable(old.entries)
+            new.update(table)
+            table = new
+
+        self._save_hosts(event, name, old, table)
+
+    def _on_remove_hosts(self, event: ActionEvent):
+        name: str = event.params["table"]
+        if not self._validate_hosts_name(event, name):
+            return
+        event.log(f"Removing entries from hosts table {name}")
+
+        if name not in self._stored.hosts_tables:
+            event.set_results(ACTION_RESULT_REMOVE_NOT_FOUND)
+            return
+
+        old = self._hosts_table(name)
+        new = HostsTable()
+        if event.params["entries"].strip():
+            new = HostsTable(old.entries)
+            for line in event.params["entries"].splitlines():
+                line = line.split()
+                if line:
+                    new.remove(line[0], *line[1:])
+
+        self._save_hosts(event, name, old, new)
+
+    def _on_print_hosts(self, event: ActionEvent):
+        name: str = event.params["table"]
+
+        event.log(f"Outputting hosts table {name}")
+        if name in self._stored.hosts_tables:
+            print(self._hosts_table(name).to_hosts())
+        else:
+            event.fail(f"Hosts table {name} not found")
+
     def _add_remove_action(
             self,
             func: str,
@@ -231,7 +1158,7 @@ class CorednsK8SCharm(CharmBase):
 
             event.set_results({"result": result})
 
-            self._stored.new_corefile = corefile.to_dict()
+            self.new_corefile = corefile
         except ValidationError as e:
             event.fail(e.message)
 
@@ -277,34 +1204,123 @@ class CorednsK8SCharm(CharmBase):
             "Removing zone"
         )
 
+    def _on_set_kubernetes(self, event: ActionEvent):
+        self._add_remove_action(
+            "set_kubernetes",
+            event,
+            "Setting kubernetes plugin properties"
+        )
+
+    def _on_set_autopath(self, event: ActionEvent):
+        self._add_remove_action(
+            "set_autopath",
+            event,
+            "Setting autopath"
+        )
+
+    def _on_add_rewrite(self, event: ActionEvent):
+        self._add_remove_action(
+            "add_rewrite",
+            event,
+            "Adding rewrite rule"
+        )
+
+    def _on_remove_rewrite(self, event: ActionEvent):
+        self._add_remove_action(
+            "remove_rewrite",
+            event,
+            "Removing rewrite rule"
+        )
+
+    def _on_compile_rewrite(self, event: ActionEvent):
+        self._add_remove_action(
+            "compile_rewrite",
+            event,
+            "Compiling rewrite rules"
+        )
+
+    def _on_add_snippet(self, event: ActionEvent):
+        self._add_remove_action(
+            "add_snippet",
+            event,
+            "Adding snippet"
+        )
+
+    def _on_remove_snippet(self, event: ActionEvent):
+        self._add_remove_action(
+            "remove_snippet",
+            event,
+            "Removing snippet"
+        )
+
+    def _on_import_snippet(self, event: ActionEvent):
+        self._add_remove_action(
+            "import_snippet",
+            event,
+            "Importing snippet"
+        )
+
+    def _on_add_template(self, event: ActionEvent):
+        self._add_remove_action(
+            "add_template",
+            event,
+            "Adding template"
+        )
+
+    def _on_remove_template(self, event: ActionEvent):
+        self._add_remove_action(
+            "remove_template",
+            event,
+            "Removing template"
+        )
+
+    def _on_add_zone_from_template(self, event: ActionEvent):
+        self._add_remove_action(
+            "add_zone_from_template",
+            event,
+            "Adding zone from template"
+        )
+
     def _on_update(self, event: ActionEvent):
         new_corefile = self.new_corefile
+        # Rendering adds the same 'multisocket' plugin to every zone if managed
+        reason = None if self.config.get("multisocket-sockets", 0) else (
+            new_corefile.validate_multisocket()
+        )
 
-        if self.corefile == new_corefile:
+        if self.peer_relation is not None and not self.unit.is_leader():
+            event.fail("Corefile is managed by the leader unit, run update on the leader")
+        elif self.corefile == new_corefile:
             event.set_results({"result": "Corefile not changed, nothing to do"})
+        elif reason is not None:
+            event.fail(f"Invalid Corefile: {reason}")
         else:
-            self.unit.status = MaintenanceStatus("Updating Corefile")
-
-            container = self.unit.get_container("coredns")
+            added, removed, changed = self.corefile.diff(new_corefile)
+            event.log(f"Zones added: {added}, removed: {removed}, changed: {changed}")
+            event.log("Restarting container: coredns")
+            self._apply_corefile(self.unit.get_container("coredns"), new_corefile)
+
+    def _on_rollback(self, event: ActionEvent):
+        steps: int = event.params["steps"]
+        history = list(self._stored.history)
+
+        if self.peer_relation is not None and not self.unit.is_leader():
+            event.fail("Corefile is managed by the leader unit, run rollback on the leader")
+            return
+        if steps < 1 or steps > len(history):
+            event.fail(f"Steps must be between 1 and {len(history)}, the size of the history")
+            return
 
-            # Update stored Corefile and update on disk
-            self._stored.corefile = new_corefile.to_dict()
-            try:
-                container.push("/Corefile", new_corefile.to_caddy())
-            except PathError as e:
-                self.unit.status = BlockedStatus(
-                    "Failed to create /Corefile: Kind: {}, Message: {}".format(
-                        e.kind,
-                        e.message
-                    )
-                )
-
-            event.log("Stopping container: coredns")
-            container.stop("coredns")
-            event.log("Starting container: coredns")
-            container.autostart()
+        corefile = self.corefile
+        for entry in reversed(history[-steps:]):
+            corefile = decode_corefile_delta(entry, corefile)
 
-            self.unit.status = ActiveStatus("Ready")
+        event.log(f"Rolling back {steps} versions")
+        self._stored.history = history[:-steps]
+        self._apply_corefile(self.unit.get_container("coredns"), corefile, record=False)
+        # Changes made after the rolled back version are discarded
+        self._stored.new_corefile = self._stored.corefile
+        event.set_results({"result": f"Rolled back {steps} versions"})
 
 
 if __name__ == "__main__":
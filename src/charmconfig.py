@@ -0,0 +1,303 @@
+"""Build CoreDNS plugins from charm config options"""
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional
+)
+
+from coredns import (
+    CoreDNSPlugin,
+    PLUGIN_FORWARD_CLOUDFLARE
+)
+from goruntime import (
+    CgroupLimits,
+    go_environment
+)
+from kubernetesplugin import kubernetes_properties
+
+# Default maximum TTLs used by CoreDNS when 'success' or 'denial' is given
+# without an explicit TTL
+CACHE_DEFAULT_SUCCESS_TTL = 3600
+CACHE_DEFAULT_DENIAL_TTL = 1800
+CACHE_DEFAULT_CAPACITY = 9984
+CACHE_DEFAULT_PREFETCH_DURATION = "1m"
+
+FORWARD_POLICIES = ["random", "round_robin", "sequential"]
+FORWARD_TLS_SCHEME = "tls://"
+
+# Largest socket count accepted by 'multisocket' plugin
+MULTISOCKET_MAX_SOCKETS = 1024
+
+
+class ConfigError(Exception):
+    def __init__(self, message: str = ""):
+        super(ConfigError, self).__init__(message)
+        self.message = message
+
+
+def _non_negative(config: Mapping[str, Any], key: str) -> int:
+    value = int(config.get(key, 0) or 0)
+    if value < 0:
+        raise ConfigError(f"'{key}' cannot be negative")
+
+    return value
+
+
+def _cache_bucket_args(
+        config: Mapping[str, Any],
+        bucket: str,
+        default_ttl: int
+) -> List[str]:
+    """Return arguments of 'success' or 'denial' cache property
+
+    Args:
+        config: Charm config
+        bucket: Either 'success' or 'denial'
+        default_ttl: TTL used when only minimum TTL is given
+
+    Returns:
+        Arguments of the property, empty list if nothing is configured
+    """
+
+    capacity = _non_negative(config, f"cache-{bucket}-capacity")
+    ttl = _non_negative(config, f"cache-{bucket}-ttl")
+    min_ttl = _non_negative(config, f"cache-{bucket}-min-ttl")
+
+    if not (capacity or ttl or min_ttl):
+        return []
+
+    if ttl and min_ttl > ttl:
+        raise ConfigError(f"'cache-{bucket}-min-ttl' cannot be greater than 'cache-{bucket}-ttl'")
+
+    args = [str(capacity or CACHE_DEFAULT_CAPACITY)]
+    if ttl or min_ttl:
+        args.append(str(ttl or default_ttl))
+    if min_ttl:
+        args.append(str(min_ttl))
+
+    return args
+
+
+def cache_plugin(config: Mapping[str, Any]) -> CoreDNSPlugin:
+    """Create 'cache' plugin using 'cache-*' config options
+
+    Options set to their zero value are omitted so CoreDNS defaults are used.
+
+    Args:
+        config: Charm config
+
+    Returns:
+        Returns a CoreDNSPlugin named 'cache'
+
+    Raises:
+        ConfigError: When a config option has an invalid value
+    """
+
+    ttl = _non_negative(config, "cache-ttl")
+    plugin = CoreDNSPlugin("cache", *([str(ttl)] if ttl else []))
+
+    for bucket, default_ttl in (
+            ("success", CACHE_DEFAULT_SUCCESS_TTL),
+            ("denial", CACHE_DEFAULT_DENIAL_TTL)
+    ):
+        args = _cache_bucket_args(config, bucket, default_ttl)
+        if args:
+            plugin.add_property(bucket, *args)
+
+    prefetch_amount = _non_negative(config, "cache-prefetch-amount")
+    if prefetch_amount:
+        args = [str(prefetch_amount)]
+        duration = config.get("cache-prefetch-duration", "")
+        percentage = _non_negative(config, "cache-prefetch-percentage")
+        if percentage > 100:
+            raise ConfigError("'cache-prefetch-percentage' cannot be greater than 100")
+
+        if duration or percentage:
+            args.append(duration or CACHE_DEFAULT_PREFETCH_DURATION)
+        if percentage:
+            args.append(f"{percentage}%")
+
+        plugin.add_property("prefetch", *args)
+
+    if config.get("cache-serve-stale", False):
+        duration = config.get("cache-serve-stale-duration", "")
+        plugin.add_property("serve_stale", *([duration] if duration else []))
+
+    return plugin
+
+
+def forward_plugin(config: Mapping[str, Any]) -> CoreDNSPlugin:
+    """Create 'forward' plugin using 'forward-*' config options
+
+    If 'forward-upstreams' is empty, Cloudflare resolvers are used.
+
+    Args:
+        config: Charm config
+
+    Returns:
+        Returns a CoreDNSPlugin named 'forward'
+
+    Raises:
+        ConfigError: When a config option has an invalid value
+    """
+
+    upstreams = config.get("forward-upstreams", "").split()
+    if not upstreams:
+        return PLUGIN_FORWARD_CLOUDFLARE.copy()
+
+    tls_upstreams = [upstream.startswith(FORWARD_TLS_SCHEME) for upstream in upstreams]
+    if any(tls_upstreams) and not all(tls_upstreams):
+        raise ConfigError("'forward-upstreams' cannot mix TLS and plain upstreams")
+
+    plugin = CoreDNSPlugin("forward", config.get("forward-from", "") or ".", *upstreams)
+
+    policy = config.get("forward-policy", "")
+    if policy:
+        if policy not in FORWARD_POLICIES:
+            raise ConfigError(f"'forward-policy' must be one of {FORWARD_POLICIES}")
+        plugin.add_property("policy", policy)
+
+    max_concurrent = _non_negative(config, "forward-max-concurrent")
+    if max_concurrent:
+        plugin.add_property("max_concurrent", str(max_concurrent))
+
+    max_fails = _non_negative(config, "forward-max-fails")
+    if max_fails:
+        plugin.add_property("max_fails", str(max_fails))
+
+    for key in ("health_check", "expire"):
+        duration = config.get("forward-{}".format(key.replace('_', '-')), "")
+        if duration:
+            plugin.add_property(key, duration)
+
+    force_tcp = config.get("forward-force-tcp", False)
+    prefer_udp = config.get("forward-prefer-udp", False)
+    if force_tcp and prefer_udp:
+        raise ConfigError("'forward-force-tcp' and 'forward-prefer-udp' cannot be used together")
+    if force_tcp:
+        plugin.add_property("force_tcp")
+    if prefer_udp:
+        plugin.add_property("prefer_udp")
+
+    tls_servername = config.get("forward-tls-servername", "")
+    if tls_servername:
+        if not all(tls_upstreams):
+            raise ConfigError("'forward-tls-servername' requires TLS upstreams")
+        plugin.add_property("tls_servername", tls_servername)
+
+    return plugin
+
+
+def kubernetes_config_properties(config: Mapping[str, Any]) -> Dict[str, Optional[List[str]]]:
+    """Return 'kubernetes' plugin properties managed by 'kubernetes-*' config options
+
+    Empty strings, negative TTL and false booleans leave corresponding
+    properties unmanaged.
+
+    Args:
+        config: Charm config
+
+    Returns:
+        Returns properties as returned by kubernetes_properties
+
+    Raises:
+        ConfigError: When a config option has an invalid value
+    """
+
+    namespaces = config.get("kubernetes-namespaces", "").split()
+    ttl = int(config.get("kubernetes-ttl", -1))
+
+    try:
+        return kubernetes_properties(
+            pods=config.get("kubernetes-pods", "") or None,
+            namespaces=namespaces or None,
+            labels=config.get("kubernetes-labels", "") or None,
+            ttl=ttl if ttl >= 0 else None,
+            endpoint_pod_names=config.get("kubernetes-endpoint-pod-names", False) or None,
+            noendpoints=config.get("kubernetes-noendpoints", False) or None,
+            profile=config.get("kubernetes-profile", "") or None
+        )
+    except ValueError as e:
+        raise ConfigError(f"Invalid kubernetes config: {e}")
+
+
+def go_runtime_environment(
+        config: Mapping[str, Any],
+        limits: Optional[CgroupLimits]
+) -> Dict[str, str]:
+    """Return Go runtime environment of CoreDNS using 'go-*' config options
+
+    Args:
+        config: Charm config
+        limits: Limits of the workload container, None if they cannot be read
+            yet. Then only the options are checked, and no variable is derived
+            from limits
+
+    Returns:
+        Returns environment as returned by go_environment
+
+    Raises:
+        ConfigError: When a config option has an invalid value
+    """
+
+    percent = int(config.get("go-memory-limit-percent", 90))
+    if not 1 <= percent <= 100:
+        raise ConfigError("'go-memory-limit-percent' must be between 1 and 100")
+
+    gogc = int(config.get("go-gc", 100))
+    if gogc < -1:
+        raise ConfigError("'go-gc' must be -1 (off) or greater")
+
+    environment = go_environment(
+        limits or CgroupLimits(),
+        max_procs=_non_negative(config, "go-max-procs"),
+        memory_limit=_non_negative(config, "go-memory-limit"),
+        memory_limit_percent=percent,
+        gogc=gogc
+    )
+    if limits is not None and environment["GOGC"] == "off" and "GOMEMLIMIT" not in environment:
+        # Without GOMEMLIMIT the heap would grow until CoreDNS is killed
+        raise ConfigError(
+            "'go-gc' -1 requires 'go-memory-limit' or a memory limit of the container"
+        )
+
+    return environment
+
+
+def multisocket_plugin(
+        config: Mapping[str, Any],
+        environment: Mapping[str, str]
+) -> Optional[CoreDNSPlugin]:
+    """Create 'multisocket' plugin using 'multisocket-sockets' config option
+
+    Args:
+        config: Charm config
+        environment: Go runtime environment of CoreDNS, as returned by
+            go_runtime_environment. With -1 the socket count is its GOMAXPROCS
+
+    Returns:
+        Returns a CoreDNSPlugin named 'multisocket', None if the option is 0
+        and the plugin is not managed by the charm
+
+    Raises:
+        ConfigError: When a config option has an invalid value
+    """
+
+    sockets = int(config.get("multisocket-sockets", 0))
+    if sockets == 0:
+        return None
+    if sockets < -1 or sockets > MULTISOCKET_MAX_SOCKETS:
+        raise ConfigError(
+            f"'multisocket-sockets' must be -1 (auto) or between 0 and {MULTISOCKET_MAX_SOCKETS}"
+        )
+
+    if sockets == -1:
+        # Without a count CoreDNS opens GOMAXPROCS sockets, which is the host
+        # CPU count when the container has no CPU quota
+        procs = environment.get("GOMAXPROCS")
+        return CoreDNSPlugin("multisocket", *([procs] if procs else []))
+
+    return CoreDNSPlugin("multisocket", str(sockets))
@@ -4,8 +4,25 @@ __all__ = [
     "CoreDNSObject",
     "CoreDNSPluginProperty",
     "CoreDNSPlugin",
+    "CoreDNSRewritePlugin",
+    "CoreDNSBlock",
+    "CoreDNSSnippet",
     "CoreDNSZone",
+    "CoreDNSZoneTemplate",
+    "CoreDNSTemplateZone",
     "CoreDNSCorefile",
+    "SCHEME_DNS",
+    "SCHEME_TLS",
+    "SCHEME_HTTPS",
+    "SCHEME_GRPC",
+    "SCHEMES",
+    "SCHEME_PORTS",
+    "SCHEMES_REQUIRE_TLS",
+    "PLUGIN_ORDER",
+    "INSTANCE_SEPARATOR",
+    "PLUGIN_IMPORT",
+    "SNIPPET_AUTO_PREFIX",
+    "TEMPLATE_BUILTIN_VARIABLES",
     "PLUGIN_CACHE",
     "PLUGIN_LOG",
     "PLUGIN_ERRORS",
@@ -16,21 +33,151 @@ __all__ = [
     "ZoneDictType"
 ]
 
+import copy
+import hashlib
+import re
+
 from typing import (
+    Iterable,
     List,
+    MutableMapping,
     Optional,
     Dict,
     Generic,
+    Set,
+    Tuple,
     TypeVar,
     Union
 )
 
+from pluginindex import PluginIndex
+from zoneindex import ZoneIndex
+
 _OT = TypeVar("_OT")
+
+SCHEME_DNS = "dns"
+SCHEME_TLS = "tls"
+SCHEME_HTTPS = "https"
+SCHEME_GRPC = "grpc"
+SCHEMES = [SCHEME_DNS, SCHEME_TLS, SCHEME_HTTPS, SCHEME_GRPC]
+# Default ports of each scheme
+SCHEME_PORTS = {
+    SCHEME_DNS: 53,
+    SCHEME_TLS: 853,
+    SCHEME_HTTPS: 443,
+    SCHEME_GRPC: 443
+}
+# Schemes that cannot be served without 'tls' plugin
+SCHEMES_REQUIRE_TLS = [SCHEME_TLS, SCHEME_HTTPS]
+
+# Execution order of plugins, same as 'plugin.cfg' of CoreDNS
+PLUGIN_ORDER = [
+    "root", "metadata", "geoip", "cancel", "tls", "timeouts", "multisocket", "reload",
+    "nsid", "bufsize", "bind", "debug", "trace", "ready", "health", "pprof", "prometheus",
+    "errors", "log", "dnstap", "local", "dns64", "acl", "any", "chaos", "loadbalance",
+    "tsig", "cache", "rewrite", "header", "dnssec", "autopath", "minimal", "template",
+    "transfer", "hosts", "route53", "azure", "clouddns", "k8s_external", "kubernetes",
+    "file", "auto", "secondary", "etcd", "loop", "forward", "grpc", "erratic", "whoami",
+    "on", "sign", "view"
+]
+PLUGIN_ORDER_INDEX = {name: i for i, name in enumerate(PLUGIN_ORDER)}
+
+# Resolv conf argument of autopath plugin to use kubernetes search paths
+AUTOPATH_KUBERNETES = "@kubernetes"
+
+# Separates name and instance id in keys of repeated objects (i.e. 'forward:2')
+INSTANCE_SEPARATOR = ":"
+
+# Directive that includes a snippet, and prefix of automatically extracted snippets
+PLUGIN_IMPORT = "import"
+SNIPPET_AUTO_PREFIX = "chain-"
+
+# Placeholders in arguments of template plugins, i.e. '${upstream}'
+TEMPLATE_VARIABLE_REGEX = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_]*)\}")
+# Variables every template zone defines
+TEMPLATE_BUILTIN_VARIABLES = ["zone", "port"]
 PropertyDictType = Dict[str, Union[str, List[str]]]
 PluginDictType = Dict[str, Union[str, List[str], Dict[str, PropertyDictType]]]
 ZoneDictType = Dict[str, Union[str, int, Dict[str, PluginDictType]]]
 
 
+def chain_order(plugins: Iterable["CoreDNSPlugin"]) -> List["CoreDNSPlugin"]:
+    """Sort plugins by PLUGIN_ORDER, unknown plugins last in given order
+
+    Imports are not plugins and are placed first.
+    """
+
+    return sorted(
+        plugins,
+        key=lambda plugin: -1 if plugin.name == PLUGIN_IMPORT else PLUGIN_ORDER_INDEX.get(
+            plugin.name, len(PLUGIN_ORDER)
+        )
+    )
+
+
+def _owned(objects: MutableMapping[str, "CoreDNSObject"], key: str, owner: Optional[object]):
+    """Return objects[key], replaced by a copy owned by owner if another owns it"""
+
+    obj = objects[key]
+    if obj._owner is not owner:
+        obj = obj.copy()
+        obj._owner = owner
+        objects[key] = obj
+
+    return obj
+
+
+class _Objects(dict):
+    """Dict counting its changes, so indexes notice objects changed directly"""
+
+    def __init__(self, *args, **kwargs):
+        super(_Objects, self).__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super(_Objects, self).__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super(_Objects, self).__delitem__(key)
+        self.version += 1
+
+    def pop(self, key, *default):
+        if key in self:
+            self.version += 1
+        return super(_Objects, self).pop(key, *default)
+
+    def popitem(self):
+        self.version += 1
+        return super(_Objects, self).popitem()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.version += 1
+        return super(_Objects, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super(_Objects, self).update(*args, **kwargs)
+        self.version += 1
+
+    def clear(self):
+        super(_Objects, self).clear()
+        self.version += 1
+
+    def copy(self) -> "_Objects":
+        return _Objects(self)
+
+
+def _versioned(objects: MutableMapping[str, _OT]) -> MutableMapping[str, _OT]:
+    """Return objects if they count their changes, a counting copy otherwise"""
+
+    return objects if hasattr(objects, "version") else _Objects(objects)
+
+
+def _version(objects: MutableMapping) -> Optional[int]:
+    return getattr(objects, "version", None)
+
+
 class CoreDNSObject(Generic[_OT]):
     """Base class for other CoreDNS classes"""
 
@@ -63,17 +210,49 @@ class CoreDNSObject(Generic[_OT]):
         self.name_string: str = name
         self.args: List[str] = list(args)
         self.objects: Dict[str, _OT] = objects
+        # Id of the object among objects with the same name, None for the first one
+        self.instance: Optional[str] = None
+
+        self._index: Dict[str, List[str]] = {}
+        self._index_objects: Optional[Dict[str, _OT]] = None
+        self._index_version: Optional[int] = None
+
+        # Token of the corefile version allowed to change the object in place,
+        # see CoreDNSCorefile.snapshot
+        self._owner: Optional[object] = None
+
+    @property
+    def key(self) -> str:
+        """Key of the object in its owner's objects"""
+
+        if self.instance is None:
+            return self.name
+        return f"{self.name}{INSTANCE_SEPARATOR}{self.instance}"
+
+    @staticmethod
+    def instance_of(key: str, name: str) -> Optional[str]:
+        """Return instance id in key of an object named name"""
 
-    def to_caddy(self) -> str:
-        """Return object and its objects in Caddy format"""
+        prefix = name + INSTANCE_SEPARATOR
+        return key[len(prefix):] if key.startswith(prefix) else None
 
-        result = '\t' * self.depth + self.name_string
+    def to_caddy(self, name_string: Optional[str] = None) -> str:
+        """Return object and its objects in Caddy format
+
+        Args:
+            name_string: Printed instead of object's own name_string if given
+        """
+
+        if name_string is None:
+            name_string = self.name_string
+
+        result = '\t' * self.depth + name_string
         for arg in self.args:
             result += f" {arg}"
 
         if self.objects:
             result += " {\n"
-            for obj in self.objects.values():
+            for obj in self.ordered_objects():
                 result += f"{obj.to_caddy()}\n"
             result += '\t' * self.depth + "}"
 
@@ -108,6 +287,20 @@ class CoreDNSObject(Generic[_OT]):
 
         return True
 
+    def structure(self) -> Tuple:
+        """Return a hashable representation of object in rendering order"""
+
+        return (
+            self.name_string,
+            tuple(self.args),
+            tuple(obj.structure() for obj in self.ordered_objects())
+        )
+
+    def ordered_objects(self) -> List[_OT]:
+        """Return objects in the order they are rendered"""
+
+        return list(self.objects.values())
+
     def to_dict(self) -> Dict[str, Union[Dict[str, Dict], List[str], str, int]]:
         result = {
             "depth": self.depth,
@@ -116,41 +309,155 @@ class CoreDNSObject(Generic[_OT]):
             "args": self.args,
             "objects": {}
         }
+        if self.instance is not None:
+            result["instance"] = self.instance
         for key in self.objects:
             result["objects"][key] = self.objects[key].to_dict()
 
         return result
 
-    def add_object(self, obj: _OT, replace: bool = True) -> Optional[_OT]:
+    def copy(self) -> "CoreDNSObject":
+        """Return a shallow copy that shares its objects with this object
+
+        Adding or removing objects of the copy does not change this object.
+        """
+
+        clone = copy.copy(self)
+        clone.args = list(self.args)
+        clone._copy_objects()
+        clone._index = {}
+        clone._index_objects = None
+        clone._index_version = None
+        clone._owner = None
+        return clone
+
+    def _copy_objects(self):
+        self.objects = self.objects.copy()
+
+    def edit(self, key: str) -> _OT:
+        """Return object with given key to be changed in place
+
+        An object shared with a snapshot is replaced by a copy first, so only
+        the objects on the path to a change are copied.
+
+        Raises:
+            KeyError: When object does not exist
+        """
+
+        current = self._index_current()
+        obj = _owned(self.objects, key, self._owner)
+        if current:
+            # A copy under the same key has the same name
+            self._index_version = _version(self.objects)
+        return obj
+
+    @property
+    def objects(self) -> Dict[str, _OT]:
+        return self._objects
+
+    @objects.setter
+    def objects(self, objects: Dict[str, _OT]):
+        self._objects = _versioned(objects)
+
+    def instances(self, name: str) -> List[str]:
+        """Return keys of the objects named name in insertion order
+
+        The index is updated by add_object and remove_object, and built again
+        only if objects are changed directly.
+        """
+
+        if not self._index_current():
+            self._index = {}
+            for key, obj in self.objects.items():
+                self._index.setdefault(obj.name, []).append(key)
+            self._index_objects = self.objects
+            self._index_version = _version(self.objects)
+
+        return self._index.get(name, [])
+
+    def _index_current(self) -> bool:
+        objects = self.objects
+        return self._index_objects is objects and self._index_version == _version(objects)
+
+    def next_instance(self, name: str) -> str:
+        """Return an unused instance id for a new object named name"""
+
+        ids = [CoreDNSObject.instance_of(key, name) for key in self.instances(name)]
+        return str(max((int(i) for i in ids if i and i.isdigit()), default=1) + 1)
+
+    def diff(self, other: "CoreDNSObject") -> Tuple[List[str], List[str], List[str]]:
+        """Compare objects with objects of other by their keys
+
+        Repeated objects are matched by their instance ids, so removing one
+        instance does not change the others.
+
+        Returns:
+            Returns (added, removed, changed) keys, where added keys exist only
+            in other and removed keys exist only in this object
+        """
+
+        added = [key for key in other.objects if key not in self.objects]
+        removed = [key for key in self.objects if key not in other.objects]
+        changed = [
+            key for key in self.objects
+            if key in other.objects and self.objects[key] != other.objects[key]
+        ]
+
+        return added, removed, changed
+
+    def add_object(
+            self,
+            obj: _OT,
+            replace: bool = True,
+            multiple: bool = False
+    ) -> Optional[_OT]:
         """Add an object of CoreDNSObject or one of it's subclasses
 
         Args:
             obj: Instance of the object to be added
             replace: Whether to replace existing object or not
+            multiple: Whether to add obj as a new instance if an object with
+                the same name exists
 
         Returns:
             Returns newly added _OT object. If object already exists and
             replace is False, returns None
         """
 
-        if obj.name in self.objects:
-            if not replace:
-                return None
+        if multiple and self.instances(obj.name):
+            obj.instance = self.next_instance(obj.name)
+
+        new = obj.key not in self.objects
+        if not new and not replace:
+            return None
 
-        self.objects[obj.name] = obj
-        return self.objects[obj.name]
+        current = self._index_current()
+        self.objects[obj.key] = obj
+        if current:
+            # A replaced object has the same name, as the name is part of the key
+            if new:
+                self._index.setdefault(obj.name, []).append(obj.key)
+            self._index_version = _version(self.objects)
+
+        return obj
 
     def remove_object(self, name: str) -> Optional[_OT]:
         """Remove an object
 
         Args:
-            name: Name of the object to be removed
+            name: Key of the object to be removed
 
         Returns:
             Returns removed object if exists, returns None otherwise
         """
 
-        return self.objects.pop(name, None)
+        current = self._index_current()
+        removed = self.objects.pop(name, None)
+        if removed is not None and current:
+            self._index[removed.name].remove(name)
+            self._index_version = _version(self.objects)
+
+        return removed
 
 
 class CoreDNSPluginProperty(CoreDNSObject):
@@ -172,10 +479,12 @@ class CoreDNSPluginProperty(CoreDNSObject):
 
     @staticmethod
     def from_dict(d: PropertyDictType) -> "CoreDNSPluginProperty":
-        return CoreDNSPluginProperty(
+        prop = CoreDNSPluginProperty(
             d["name"],
             *d["args"]
         )
+        prop.instance = d.get("instance")
+        return prop
 
 
 class CoreDNSPlugin(CoreDNSObject[CoreDNSPluginProperty]):
@@ -197,21 +506,34 @@ class CoreDNSPlugin(CoreDNSObject[CoreDNSPluginProperty]):
 
         super(CoreDNSPlugin, self).__init__(1, name, *args, objects=properties)
 
+    @staticmethod
+    def create(
+            name: str,
+            *args: str,
+            properties: Optional[Dict[str, CoreDNSPluginProperty]] = None
+    ) -> "CoreDNSPlugin":
+        """Create a plugin using the class registered for name in PLUGIN_CLASSES"""
+
+        return PLUGIN_CLASSES.get(name, CoreDNSPlugin)(name, *args, properties=properties)
+
     @staticmethod
     def from_dict(d: PluginDictType) -> "CoreDNSObject":
-        return CoreDNSPlugin(
+        plugin = CoreDNSPlugin.create(
             d["name"],
             *d["args"],
             properties={
                 key: CoreDNSPluginProperty.from_dict(d["objects"][key]) for key in d["objects"]
             }
         )
+        plugin.instance = d.get("instance")
+        return plugin
 
     def add_property(
             self,
             name: str,
             *args: str,
-            replace: bool = True
+            replace: bool = True,
+            multiple: bool = False
     ) -> Optional[CoreDNSPluginProperty]:
         """Add new property
 
@@ -219,23 +541,266 @@ class CoreDNSPlugin(CoreDNSObject[CoreDNSPluginProperty]):
             name: Name of the property
             *args: Arguments required by the property
             replace: Whether to replace existing property or not
+            multiple: Whether to add another instance of the property if it exists
 
         Returns:
             Returns newly added CoreDNSPluginProperty object. If property
             already exists and replace is False, returns None
         """
 
-        return self.add_object(CoreDNSPluginProperty(name, *args), replace=replace)
+        return self.add_object(
+            CoreDNSPluginProperty(name, *args),
+            replace=replace,
+            multiple=multiple
+        )
+
+
+class CoreDNSRewritePlugin(CoreDNSPlugin):
+    """Class for ordered 'rewrite' rules of a zone
+
+    CoreDNS accepts 'rewrite' multiple times in a server block and evaluates
+    the rules in order. Each rule is kept as a property keyed by its id and
+    rendered as a separate 'rewrite' line.
+    """
+
+    def __init__(
+            self,
+            name: str = "rewrite",
+            *args: str,
+            properties: Optional[Dict[str, CoreDNSPluginProperty]] = None
+    ):
+        """Creates a rewrite plugin
+
+        Args:
+            name: Name of the plugin, always 'rewrite'
+            *args: If given, added as the first rule
+            properties: Rules keyed by their ids
+        """
+
+        super(CoreDNSRewritePlugin, self).__init__(name, properties=properties)
+
+        if args:
+            self.add_rule(*args)
+
+    def next_id(self) -> str:
+        # Rules of a block form 'rewrite { ... }' are keyed by their names
+        return str(max((int(key) for key in self.objects if key.isdigit()), default=0) + 1)
+
+    @staticmethod
+    def rule_tokens(key: str, rule: CoreDNSPluginProperty) -> List[str]:
+        """Return tokens of the 'rewrite' line of a rule
+
+        Rules keyed by an id hold all tokens as arguments. Properties of a
+        block form 'rewrite { name exact a b }' keep the first token as
+        their name, and are rendered as 'rewrite name exact a b'.
+        """
+
+        if key.isdigit():
+            return list(rule.args)
+        return [rule.name] + list(rule.args)
+
+    def add_rule(self, *tokens: str, before: Optional[str] = None) -> CoreDNSPluginProperty:
+        """Add a rule to the end, or before an existing rule
+
+        Args:
+            *tokens: Arguments of the 'rewrite' line
+            before: Id of the rule that new rule will precede
+
+        Returns:
+            Returns newly added rule, its name is its id
+
+        Raises:
+            KeyError: When rule before does not exist
+        """
+
+        rule = CoreDNSPluginProperty(self.next_id(), *tokens)
+        if before is None:
+            self.objects[rule.key] = rule
+            return rule
+
+        if before not in self.objects:
+            raise KeyError(before)
+
+        objects = {}
+        for key, obj in self.objects.items():
+            if key == before:
+                objects[rule.key] = rule
+            objects[key] = obj
+        self.objects = objects
 
+        return rule
 
-class CoreDNSZone(CoreDNSObject[CoreDNSPlugin]):
+    def rules(self) -> List[List[str]]:
+        """Return tokens of the rules in evaluation order"""
+
+        return [CoreDNSRewritePlugin.rule_tokens(key, rule) for key, rule in self.objects.items()]
+
+    def set_rules(self, rules: List[List[str]]):
+        """Replace all rules, ids are assigned again starting from 1"""
+
+        self.objects = {}
+        for tokens in rules:
+            self.add_rule(*tokens)
+
+    def to_caddy(self, name_string: Optional[str] = None) -> str:
+        return "\n".join(
+            '\t' * self.depth + " ".join([self.name] + tokens)
+            for tokens in self.rules()
+        )
+
+    def structure(self) -> Tuple:
+        # Rule ids do not change rendered Corefile
+        return (self.name, tuple(tuple(rule) for rule in self.rules()))
+
+
+class CoreDNSBlock(CoreDNSObject[CoreDNSPlugin]):
+    """Base class for objects that contain plugins, zones and snippets"""
+
+    def chain(self) -> List[CoreDNSPlugin]:
+        """Return plugins in the order CoreDNS executes them
+
+        CoreDNS orders plugins by PLUGIN_ORDER regardless of their order in
+        Corefile. Plugins not in PLUGIN_ORDER are placed at the end in
+        insertion order.
+        """
+
+        return chain_order(self.objects.values())
+
+    def ordered_objects(self) -> List[CoreDNSPlugin]:
+        return self.chain()
+
+    def validate_autopath(self) -> Optional[str]:
+        """Check dependencies of 'autopath' plugin if zone uses it
+
+        Returns:
+            Returns the reason if autopath cannot work, None otherwise
+        """
+
+        autopath = self.objects.get("autopath")
+        if autopath is None:
+            return None
+
+        if AUTOPATH_KUBERNETES not in autopath.args:
+            return None
+
+        kubernetes = self.objects.get("kubernetes")
+        if kubernetes is None:
+            return "autopath requires kubernetes plugin"
+
+        pods = kubernetes.objects.get("pods")
+        if pods is None or pods.args != ["verified"]:
+            return "autopath requires 'pods verified' in kubernetes plugin"
+
+        return None
+
+    def set_autopath(self, enabled: bool, *zones: str) -> Optional[CoreDNSPlugin]:
+        """Enable or disable 'autopath' plugin using kubernetes search paths
+
+        Enabling also sets 'pods verified' in kubernetes plugin since autopath
+        needs to find namespace of the client pod. Position of the plugin in
+        the chain is fixed by PLUGIN_ORDER.
+
+        Args:
+            enabled: Whether to enable autopath or not
+            *zones: Zones autopath applies to, zone of the server block if empty
+
+        Returns:
+            Returns autopath plugin if enabled, None otherwise
+
+        Raises:
+            ValueError: When enabling autopath without kubernetes plugin
+        """
+
+        if not enabled:
+            self.remove_object("autopath")
+            return None
+
+        if "kubernetes" not in self.objects:
+            raise ValueError("autopath requires kubernetes plugin")
+
+        self.edit("kubernetes").add_property("pods", "verified")
+        return self.add_plugin("autopath", *zones, AUTOPATH_KUBERNETES, replace=True)
+
+    def imports(self) -> List[str]:
+        """Return names of the snippets imported by the block"""
+
+        return [
+            self.objects[key].args[0] for key in self.instances(PLUGIN_IMPORT)
+            if self.objects[key].args
+        ]
+
+    def add_plugin(
+            self,
+            name: str,
+            *args: str,
+            properties: Optional[Dict[str, CoreDNSPluginProperty]] = None,
+            replace: bool = None,
+            multiple: bool = False
+    ) -> Optional[CoreDNSPlugin]:
+        """Add new plugin
+
+        Args:
+            name: Name of the plugin
+            *args: Args required by the plugin
+            properties: Properties of the plugin
+            replace: Whether to replace existing plugin or not
+            multiple: Whether to add another instance of the plugin if it exists
+
+        Returns:
+            Returns newly added CoreDNSPlugin object. If plugin already
+            exists and replace is False, returns None
+        """
+
+        new_plugin = CoreDNSPlugin.create(name, *args, properties=properties)
+        return self.add_object(new_plugin, replace=replace, multiple=multiple)
+
+
+class CoreDNSSnippet(CoreDNSBlock):
+    """Class for snippets, plugins defined once and imported by zones
+
+    Rendered as '(name) { ... }' and referenced with 'import name' in zones.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            plugins: Optional[Dict[str, CoreDNSPlugin]] = None
+    ):
+        """Creates a snippet object
+
+        Args:
+            name: Name of the snippet, used by 'import'
+            plugins: Plugins defined by the snippet
+        """
+
+        super(CoreDNSSnippet, self).__init__(0, name, objects=plugins)
+        self.name_string = f"({name})"
+
+    def to_caddy(self, name_string: Optional[str] = None) -> str:
+        if self.objects:
+            return super(CoreDNSSnippet, self).to_caddy(name_string)
+
+        return (name_string or self.name_string) + " {\n}"
+
+    @staticmethod
+    def from_dict(d: PluginDictType) -> "CoreDNSSnippet":
+        return CoreDNSSnippet(
+            d["name"],
+            plugins={
+                key: CoreDNSPlugin.from_dict(d["objects"][key]) for key in d["objects"]
+            }
+        )
+
+
+class CoreDNSZone(CoreDNSBlock):
     """Class for CoreDNS zones"""
 
     def __init__(
             self,
             name: str,
             port: int = 53,
-            plugins: Optional[Dict[str, CoreDNSPlugin]] = None
+            plugins: Optional[Dict[str, CoreDNSPlugin]] = None,
+            scheme: str = SCHEME_DNS
     ):
         """Creates a zone object
 
@@ -243,8 +808,9 @@ class CoreDNSZone(CoreDNSObject[CoreDNSPlugin]):
             name: Name of the zone
             port: Port
             plugins: Plugins required by the zone
+            scheme: Protocol of the server block, one of SCHEMES
         Raises:
-            ValueError: When port is negative
+            ValueError: When port is negative or scheme is unknown
         """
 
         super(CoreDNSZone, self).__init__(0, name, objects=plugins)
@@ -252,18 +818,57 @@ class CoreDNSZone(CoreDNSObject[CoreDNSPlugin]):
         if port < 0:
             raise ValueError("Port cannot be negative")
 
+        if scheme not in SCHEMES:
+            raise ValueError(f"Scheme must be one of {SCHEMES}")
+
         self.port = port
-        self.name_string = "{}:{}".format(self.name, self.port)
+        self.scheme = scheme
+        self.name_string = CoreDNSZone.address(self.name, self.port, self.scheme)
+
+    @property
+    def key(self) -> str:
+        return self.name_string
+
+    @staticmethod
+    def address(name: str, port: int, scheme: str = SCHEME_DNS) -> str:
+        """Return server address of a zone, which is also its key in Corefile"""
+
+        if scheme == SCHEME_DNS:
+            return "{}:{}".format(name, port)
+        return "{}://{}:{}".format(scheme, name, port)
+
+    @staticmethod
+    def parse_address(address: str) -> Tuple[str, str, Optional[int]]:
+        """Split a server address into scheme, name and port
+
+        Args:
+            address: Address in '[scheme://]name[:port]' format
+
+        Returns:
+            Returns (scheme, name, port). Port is None if address has no port
+        """
+
+        scheme = SCHEME_DNS
+        if "://" in address:
+            scheme, address = address.split("://", maxsplit=1)
+
+        name, sep, port = address.rpartition(':')
+        if sep and port.isdigit():
+            return scheme, name, int(port)
+
+        return scheme, address, None
 
     def __eq__(self, other: "CoreDNSZone"):
         if not super(CoreDNSZone, self).__eq__(other):
             return False
 
-        return self.port == other.port
+        return self.port == other.port and self.scheme == other.scheme
 
     def to_dict(self) -> Dict[str, Union[Dict[str, Dict], List[str], str, int]]:
         result = super(CoreDNSZone, self).to_dict()
         result["port"] = self.port
+        if self.scheme != SCHEME_DNS:
+            result["scheme"] = self.scheme
         return result
 
     @staticmethod
@@ -271,33 +876,193 @@ class CoreDNSZone(CoreDNSObject[CoreDNSPlugin]):
         return CoreDNSZone(
             d["name"],
             port=d["port"],
+            plugins={
+                key: CoreDNSPlugin.from_dict(d["objects"][key]) for key in d["objects"]
+            },
+            scheme=d.get("scheme", SCHEME_DNS)
+        )
+
+
+class CoreDNSZoneTemplate(CoreDNSBlock):
+    """Class for zone templates
+
+    A template is a list of plugins whose arguments may contain '${var}'
+    placeholders. Zones created from a template store only their variables.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            plugins: Optional[Dict[str, CoreDNSPlugin]] = None
+    ):
+        """Creates a template object
+
+        Args:
+            name: Name of the template
+            plugins: Plugins of the template, arguments may contain placeholders
+        """
+
+        super(CoreDNSZoneTemplate, self).__init__(0, name, objects=plugins)
+        self.name_string = f"<{name}>"
+
+    @staticmethod
+    def from_dict(d: PluginDictType) -> "CoreDNSZoneTemplate":
+        return CoreDNSZoneTemplate(
+            d["name"],
             plugins={
                 key: CoreDNSPlugin.from_dict(d["objects"][key]) for key in d["objects"]
             }
         )
 
-    def add_plugin(
+    def variables(self) -> List[str]:
+        """Return names of the placeholders used by the template"""
+
+        names = set()
+        for plugin in self.objects.values():
+            args = plugin.args + [arg for prop in plugin.objects.values() for arg in prop.args]
+            for arg in args:
+                names.update(TEMPLATE_VARIABLE_REGEX.findall(arg))
+
+        return sorted(names)
+
+    def expand(self, variables: Dict[str, str]) -> Dict[str, CoreDNSPlugin]:
+        """Return copies of the plugins with placeholders replaced
+
+        Args:
+            variables: Values of the placeholders
+
+        Raises:
+            ValueError: When a placeholder has no value
+        """
+
+        def substitute(args: List[str]) -> List[str]:
+            return [
+                TEMPLATE_VARIABLE_REGEX.sub(replace, arg) if '$' in arg else arg for arg in args
+            ]
+
+        def replace(match) -> str:
+            if match.group(1) not in variables:
+                raise ValueError(f"Missing template variable '{match.group(1)}'")
+            return variables[match.group(1)]
+
+        plugins = {}
+        for key, plugin in self.objects.items():
+            expanded = CoreDNSPlugin.create(plugin.name, *substitute(plugin.args))
+            expanded.instance = plugin.instance
+            for prop_key, prop in plugin.objects.items():
+                expanded_prop = CoreDNSPluginProperty(prop.name, *substitute(prop.args))
+                expanded_prop.instance = prop.instance
+                expanded.objects[prop_key] = expanded_prop
+            plugins[key] = expanded
+
+        return plugins
+
+
+class CoreDNSTemplateZone(CoreDNSZone):
+    """Class for zones created from a CoreDNSZoneTemplate
+
+    Plugins are expanded from the template whenever they are read, so changes
+    to the template apply to the zone. Adding or removing plugins, or getting
+    the zone from CoreDNSCorefile.block, copies the expanded plugins into the
+    zone, which then no longer follows the template.
+    """
+
+    def __init__(
             self,
             name: str,
-            *args: str,
-            properties: Optional[Dict[str, CoreDNSPluginProperty]] = None,
-            replace: bool = None
-    ) -> Optional[CoreDNSPlugin]:
-        """Add new plugin
+            template: CoreDNSZoneTemplate,
+            params: Dict[str, str],
+            port: int = 53,
+            scheme: str = SCHEME_DNS
+    ):
+        """Creates a zone from a template
 
         Args:
-            name: Name of the plugin
-            *args: Args required by the plugin
-            properties: Properties of the plugin
-            replace: Whether to replace existing plugin or not
+            name: Name of the zone, available to the template as '${zone}'
+            template: Template of the zone
+            params: Values of the template variables
+            port: Port, available to the template as '${port}'
+            scheme: Protocol of the server block, one of SCHEMES
 
-        Returns:
-            Returns newly added CoreDNSPlugin object. If plugin already
-            exists and replace is False, returns None
+        Raises:
+            ValueError: When a template variable has no value
         """
 
-        new_plugin = CoreDNSPlugin(name, *args, properties=properties)
-        return self.add_object(new_plugin, replace=replace)
+        super(CoreDNSTemplateZone, self).__init__(name, port, scheme=scheme)
+
+        self.template = template
+        self.params: Dict[str, str] = dict(params)
+        self._objects: Optional[Dict[str, CoreDNSPlugin]] = None
+
+        missing = [
+            variable for variable in template.variables()
+            if variable not in self.params and variable not in TEMPLATE_BUILTIN_VARIABLES
+        ]
+        if missing:
+            raise ValueError(f"Missing template variables {missing}")
+
+    @property
+    def objects(self) -> Dict[str, CoreDNSPlugin]:
+        if self._objects is not None:
+            return self._objects
+        return self.template.expand(self.variables())
+
+    @objects.setter
+    def objects(self, objects: Dict[str, CoreDNSPlugin]):
+        self._objects = _versioned(objects)
+
+    def copy(self) -> "CoreDNSTemplateZone":
+        clone = super(CoreDNSTemplateZone, self).copy()
+        clone.params = dict(self.params)
+        return clone
+
+    def _copy_objects(self):
+        # Reading objects would expand the template, and the copy must still follow it
+        if self._objects is not None:
+            self._objects = self._objects.copy()
+
+    def edit(self, key: str) -> CoreDNSPlugin:
+        self.materialize()
+        return super(CoreDNSTemplateZone, self).edit(key)
+
+    def variables(self) -> Dict[str, str]:
+        """Return template variables including the builtin ones"""
+
+        return dict(self.params, zone=self.name, port=str(self.port))
+
+    def materialized(self) -> bool:
+        """Whether the zone has its own copy of the plugins"""
+
+        return self._objects is not None
+
+    def materialize(self) -> Dict[str, CoreDNSPlugin]:
+        """Copy expanded plugins into the zone, and return them"""
+
+        if self._objects is None:
+            self._objects = _Objects(self.template.expand(self.variables()))
+        return self._objects
+
+    def to_dict(self) -> Dict[str, Union[Dict[str, Dict], List[str], str, int]]:
+        if self.materialized():
+            return super(CoreDNSTemplateZone, self).to_dict()
+
+        result = CoreDNSZone(self.name, self.port, scheme=self.scheme).to_dict()
+        result["template"] = self.template.name
+        result["params"] = dict(self.params)
+        return result
+
+    def add_object(
+            self,
+            obj: CoreDNSPlugin,
+            replace: bool = True,
+            multiple: bool = False
+    ) -> Optional[CoreDNSPlugin]:
+        self.materialize()
+        return super(CoreDNSTemplateZone, self).add_object(obj, replace=replace, multiple=multiple)
+
+    def remove_object(self, name: str) -> Optional[CoreDNSPlugin]:
+        self.materialize()
+        return super(CoreDNSTemplateZone, self).remove_object(name)
 
 
 class CoreDNSCorefile(CoreDNSObject[CoreDNSZone]):
@@ -305,57 +1070,799 @@ class CoreDNSCorefile(CoreDNSObject[CoreDNSZone]):
 
     def __init__(
             self,
-            zones: Dict[str, "CoreDNSZone"]
+            zones: Dict[str, "CoreDNSZone"],
+            snippets: Optional[Dict[str, CoreDNSSnippet]] = None,
+            templates: Optional[Dict[str, CoreDNSZoneTemplate]] = None
     ):
         """Creates a corefile object
 
         Args:
             zones: Zones that will be included in the Corefile
+            snippets: Snippets that zones can import, keyed by their names
+            templates: Templates that zones can be created from, keyed by their names
         """
         super(CoreDNSCorefile, self).__init__(0, "", objects=zones)
 
         if len(self.objects) == 0:
             raise ValueError("At least one zone required")
 
-    def to_caddy(self) -> str:
-        result = ""
+        self.snippets: Dict[str, CoreDNSSnippet] = snippets if snippets is not None else {}
+        self.templates: Dict[str, CoreDNSZoneTemplate] = (
+            templates if templates is not None else {}
+        )
+
+        # Built on first use, then updated by add_object and remove_object
+        self._zones: Optional[ZoneIndex] = None
+        self._zones_objects: Optional[Dict[str, CoreDNSZone]] = None
+        self._zones_version: Optional[int] = None
+        self._plugins: Optional[PluginIndex] = None
+        self._plugins_objects: Optional[Dict[str, CoreDNSZone]] = None
+        self._plugins_version: Optional[int] = None
+        # Keys of the zones returned by block since they were indexed
+        self._plugins_dirty: Set[str] = set()
+
+    def __eq__(self, other: "CoreDNSCorefile"):
+        if not super(CoreDNSCorefile, self).__eq__(other):
+            return False
+
+        return self.snippets == other.snippets and self.templates == other.templates
+
+    @staticmethod
+    def snippet_name(key: str) -> Optional[str]:
+        """Return snippet name if key is in '(name)' format, None otherwise"""
+
+        if len(key) > 2 and key.startswith('(') and key.endswith(')'):
+            return key[1:-1]
+        return None
+
+    @staticmethod
+    def template_name(key: str) -> Optional[str]:
+        """Return template name if key is in '<name>' format, None otherwise"""
+
+        if len(key) > 2 and key.startswith('<') and key.endswith('>'):
+            return key[1:-1]
+        return None
+
+    def snapshot(self) -> "CoreDNSCorefile":
+        """Return a copy sharing every zone, snippet and template with this corefile
+
+        Both corefiles get a new owner token, so a block returned by block
+        and objects returned by its edit are copied before they are changed.
+        Only the objects on the path to a change are copied, and changes to
+        one corefile never show in the other. Objects of either corefile must
+        not be changed without going through block and edit.
+        """
+
+        self._owner = object()
+        clone = self.copy()
+        clone.snippets = dict(self.snippets)
+        clone.templates = dict(self.templates)
+        clone._owner = object()
+        clone._zones = None
+        clone._plugins = None
+        clone._plugins_dirty = set()
+        return clone
+
+    def block(self, key: str, edit: bool = True) -> CoreDNSBlock:
+        """Return zone with given key, snippet if key is in '(name)' format,
+        or template if key is in '<name>' format
+
+        Args:
+            key: Key of the block
+            edit: Whether the block will be changed. Zones created from a
+                template get their own copy of the plugins, and blocks shared
+                with a snapshot are copied if True
+
+        Raises:
+            KeyError: When block does not exist
+        """
+
+        name = CoreDNSCorefile.snippet_name(key)
+        if name is not None:
+            return _owned(self.snippets, name, self._owner) if edit else self.snippets[name]
+
+        name = CoreDNSCorefile.template_name(key)
+        if name is not None:
+            template = self.templates[name]
+            if edit and template._owner is not self._owner:
+                self._rebind(template, _owned(self.templates, name, self._owner))
+            if edit:
+                # Zones following the template change with it
+                self._plugins = None
+            return self.templates[name]
+
+        if not edit:
+            return self.objects[key]
+
+        zone = self.edit(key)
+        if isinstance(zone, CoreDNSTemplateZone):
+            zone.materialize()
+        return zone
+
+    def edit(self, key: str) -> CoreDNSZone:
+        zones_current = self._zones_current()
+        plugins_current = self._plugins_current()
+
+        zone = super(CoreDNSCorefile, self).edit(key)
+        # A copy under the same key keeps the name, but may get new plugins
+        if zones_current:
+            self._zones_version = _version(self.objects)
+        if plugins_current:
+            self._plugins_version = _version(self.objects)
+        if self._plugins is not None:
+            self._plugins_dirty.add(key)
+        return zone
+
+    def _rebind(self, template: CoreDNSZoneTemplate, copied: CoreDNSZoneTemplate):
+        """Make zones following template follow its copy"""
+
+        for key in list(self.objects):
+            zone = self.objects[key]
+            if isinstance(zone, CoreDNSTemplateZone) and zone.template is template:
+                if not zone.materialized():
+                    self.edit(key).template = copied
+
+    def add_template(
+            self,
+            name: str,
+            plugins: Optional[Dict[str, CoreDNSPlugin]] = None,
+            replace: bool = True
+    ) -> Optional[CoreDNSZoneTemplate]:
+        """Add new template
+
+        Replacing a template does not change zones created from the old one,
+        they keep its expanded plugins as remove_template does.
+
+        Args:
+            name: Name of the template
+            plugins: Plugins of the template
+            replace: Whether to replace existing template or not
+
+        Returns:
+            Returns newly added CoreDNSZoneTemplate object. If already exists
+            and replace is False, returns None
+        """
+
+        if name in self.templates:
+            if not replace:
+                return None
+            self._materialize_followers(self.templates[name])
+
+        self.templates[name] = CoreDNSZoneTemplate(name, plugins)
+        return self.templates[name]
+
+    def remove_template(self, name: str) -> Optional[CoreDNSZoneTemplate]:
+        """Remove a template, zones created from it keep its expanded plugins
+
+        Returns:
+            Returns removed template if exists, returns None otherwise
+        """
+
+        template = self.templates.pop(name, None)
+        if template is None:
+            return None
+
+        self._materialize_followers(template)
+        return template
+
+    def _materialize_followers(self, template: CoreDNSZoneTemplate):
+        """Give zones following template their own copy of its expanded plugins
+
+        Serialized zones following a template refer to it by name, so they
+        must not follow it once the name refers to another template.
+        """
+
+        for key in list(self.objects):
+            zone = self.objects[key]
+            if isinstance(zone, CoreDNSTemplateZone) and zone.template is template:
+                self.block(key)
+
+    def add_zone_from_template(
+            self,
+            template: str,
+            name: str,
+            params: Dict[str, str],
+            port: int = 53,
+            replace: bool = True,
+            scheme: str = SCHEME_DNS
+    ) -> Optional[CoreDNSTemplateZone]:
+        """Add new zone created from a template
+
+        Args:
+            template: Name of the template
+            name: Name of the zone
+            params: Values of the template variables
+            port: Port that zone uses
+            replace: Whether to replace existing zone or not
+            scheme: Protocol of the server block, one of SCHEMES
+
+        Returns:
+            Returns newly added CoreDNSTemplateZone object. If already exists
+            and replace is False, returns None
+
+        Raises:
+            KeyError: When template does not exist
+            ValueError: When a template variable has no value
+        """
+
+        new_zone = CoreDNSTemplateZone(
+            name,
+            self.templates[template],
+            params,
+            port=port,
+            scheme=scheme
+        )
+        return self.add_object(new_zone, replace=replace)
+
+    def chain(self, key: str) -> List[CoreDNSPlugin]:
+        """Return plugins of a zone in execution order with snippets imported
+
+        Args:
+            key: Key of the zone, or snippet in '(name)' format
+
+        Returns:
+            Returns plugins of the zone and the snippets it imports, recursively
+        """
+
+        plugins: List[CoreDNSPlugin] = []
+        self._expand(self.block(key), plugins, set())
+        return chain_order(plugins)
+
+    def _expand(self, block: CoreDNSBlock, plugins: List[CoreDNSPlugin], visited: set):
+        for plugin in block.objects.values():
+            snippet = plugin.args[0] if plugin.name == PLUGIN_IMPORT and plugin.args else None
+            if snippet in self.snippets and snippet not in visited:
+                visited.add(snippet)
+                self._expand(self.snippets[snippet], plugins, visited)
+            elif snippet is None:
+                plugins.append(plugin)
+
+    def add_snippet(
+            self,
+            name: str,
+            plugins: Optional[Dict[str, CoreDNSPlugin]] = None,
+            replace: bool = True
+    ) -> Optional[CoreDNSSnippet]:
+        """Add new snippet
+
+        Args:
+            name: Name of the snippet
+            plugins: Plugins defined by the snippet
+            replace: Whether to replace existing snippet or not
+
+        Returns:
+            Returns newly added CoreDNSSnippet object. If already exists and
+            replace is False, returns None
+        """
+
+        if name in self.snippets and not replace:
+            return None
+
+        self.snippets[name] = CoreDNSSnippet(name, plugins)
+        return self.snippets[name]
+
+    def importers(self, name: str) -> List[str]:
+        """Return keys of the zones and '(name)' of the snippets importing snippet name"""
+
+        blocks = [(key, zone) for key, zone in self.objects.items()]
+        blocks += [(snippet.name_string, snippet) for snippet in self.snippets.values()]
+        return [key for key, block in blocks if name in block.imports()]
+
+    def remove_snippet(self, name: str, inline: bool = True) -> Optional[CoreDNSSnippet]:
+        """Remove a snippet
+
+        Args:
+            name: Name of the snippet
+            inline: Whether to copy plugins of the snippet into blocks importing
+                it. If False, imports are only removed
+
+        Returns:
+            Returns removed snippet if exists, returns None otherwise
+        """
+
+        snippet = self.snippets.pop(name, None)
+        if snippet is None:
+            return None
+
+        for key in self.importers(name):
+            block = self.block(key)
+            for import_key in list(block.instances(PLUGIN_IMPORT)):
+                if block.objects[import_key].args[:1] == [name]:
+                    block.remove_object(import_key)
+            if inline:
+                for plugin in snippet.objects.values():
+                    block.add_object(
+                        CoreDNSPlugin.from_dict(plugin.to_dict()),
+                        replace=False,
+                        multiple=True
+                    )
+
+        return snippet
+
+    def extract_snippets(
+            self,
+            zones: List[CoreDNSZone]
+    ) -> Tuple[List[CoreDNSSnippet], List[CoreDNSZone]]:
+        """Move plugins shared by multiple zones into snippets
+
+        Plugins are grouped by the exact set of zones using them, so each set
+        of zones gets a single snippet. A group is extracted only if it makes
+        the rendered Corefile smaller.
+
+        Args:
+            zones: Zones to render, not changed
+
+        Returns:
+            Returns extracted snippets, and zones importing them instead of
+            the extracted plugins
+        """
+
+        # Identical instances in a zone are told apart by their occurrence
+        users: Dict[Tuple, List[int]] = {}
+        plugins: Dict[Tuple, CoreDNSPlugin] = {}
+        for i, zone in enumerate(zones):
+            seen: Dict[Tuple, int] = {}
+            for plugin in zone.chain():
+                structure = plugin.structure()
+                occurrence = (structure, seen.get(structure, 0))
+                seen[structure] = occurrence[1] + 1
+                users.setdefault(occurrence, []).append(i)
+                plugins.setdefault(occurrence, plugin)
+
+        groups: Dict[Tuple[int, ...], List[Tuple]] = {}
+        for occurrence, indices in users.items():
+            if len(indices) > 1:
+                groups.setdefault(tuple(indices), []).append(occurrence)
+
+        snippets: List[CoreDNSSnippet] = []
+        extracted: Dict[int, Dict[Tuple, str]] = {}
+        number = 1
+        for indices, occurrences in groups.items():
+            body = sum(len(plugins[occurrence].to_caddy()) + 1 for occurrence in occurrences)
+
+            while f"{SNIPPET_AUTO_PREFIX}{number}" in self.snippets:
+                number += 1
+            name = f"{SNIPPET_AUTO_PREFIX}{number}"
+
+            import_line = len(f"\t{PLUGIN_IMPORT} {name}\n")
+            definition = len(f"({name}) {{\n}}\n\n")
+            if (len(indices) - 1) * body <= len(indices) * import_line + definition:
+                continue
+            number += 1
+
+            # Every occurrence comes from the first zone, so its keys are unique
+            snippets.append(CoreDNSSnippet(name, plugins={
+                plugins[occurrence].key: plugins[occurrence] for occurrence in occurrences
+            }))
+            for i in indices:
+                extracted.setdefault(i, {}).update(dict.fromkeys(occurrences, name))
+
+        result = []
+        for i, zone in enumerate(zones):
+            if i not in extracted:
+                result.append(zone)
+                continue
+
+            rendered = CoreDNSZone(zone.name, zone.port, plugins={}, scheme=zone.scheme)
+            seen = {}
+            imported = []
+            for key, plugin in zone.objects.items():
+                structure = plugin.structure()
+                occurrence = (structure, seen.get(structure, 0))
+                seen[structure] = occurrence[1] + 1
+
+                name = extracted[i].get(occurrence)
+                if name is None:
+                    rendered.objects[key] = plugin
+                elif name not in imported:
+                    imported.append(name)
+                    rendered.add_plugin(PLUGIN_IMPORT, name, multiple=True)
+
+            result.append(rendered)
+
+        return snippets, result
+
+    def server_blocks(self) -> List[List[CoreDNSZone]]:
+        """Group zones that can be served by a single server block
+
+        Zones are grouped if they use the same scheme and port and their plugin
+        chains are structurally identical.
+
+        Returns:
+            Returns groups of zones in order of their first zone
+        """
+
+        groups: Dict[Tuple, List[CoreDNSZone]] = {}
         for zone in self.objects.values():
-            result += f"{zone.to_caddy()}\n\n"
-        return result.strip()
+            key = (
+                zone.scheme,
+                zone.port,
+                tuple(plugin.structure() for plugin in zone.chain())
+            )
+            groups.setdefault(key, []).append(zone)
+
+        return list(groups.values())
+
+    def to_caddy(self, aggregate: bool = False, snippets: bool = False) -> str:
+        """Return Corefile in Caddy format
+
+        Snippets are rendered before zones, since a snippet must be defined
+        before it is imported.
+
+        Args:
+            aggregate: Whether to render zones returned together by
+                server_blocks as a single server block
+            snippets: Whether to move plugins shared by multiple zones into
+                snippets using extract_snippets
+        """
+
+        if not aggregate:
+            zones = list(self.objects.values())
+            addresses = [zone.name_string for zone in zones]
+        else:
+            groups = self.server_blocks()
+            zones = [group[0] for group in groups]
+            addresses = [" ".join(zone.name_string for zone in group) for group in groups]
+
+        defined = list(self.snippets.values())
+        if snippets:
+            extracted, zones = self.extract_snippets(zones)
+            defined += extracted
+
+        blocks = [snippet.to_caddy() for snippet in defined]
+        blocks += [zone.to_caddy(address) for zone, address in zip(zones, addresses)]
+
+        return "\n\n".join(blocks).strip()
 
     def to_dict(self) -> Dict[str, Dict]:
-        return {key: self.objects[key].to_dict() for key in self.objects}
+        result = {key: self.objects[key].to_dict() for key in self.objects}
+        for block in list(self.snippets.values()) + list(self.templates.values()):
+            result[block.name_string] = block.to_dict()
+
+        return result
+
+    def digest(self) -> str:
+        """Return SHA-256 hex digest of the rendered Corefile"""
+
+        return hashlib.sha256(self.to_caddy().encode()).hexdigest()
 
     @staticmethod
     def from_dict(d) -> "CoreDNSCorefile":
-        return CoreDNSCorefile(
-            zones={key: CoreDNSZone.from_dict(d[key]) for key in d}
+        snippets = {}
+        templates = {}
+        zone_keys = []
+        for key, value in d.items():
+            if CoreDNSCorefile.snippet_name(key) is not None:
+                snippets[value["name"]] = CoreDNSSnippet.from_dict(value)
+            elif CoreDNSCorefile.template_name(key) is not None:
+                templates[value["name"]] = CoreDNSZoneTemplate.from_dict(value)
+            else:
+                zone_keys.append(key)
+
+        # Templates must be loaded before zones created from them
+        zones = {}
+        for key in zone_keys:
+            value = d[key]
+            if CoreDNSZone.parse_address(key)[2] is None:
+                # Older Corefiles keyed zones by their names
+                key = CoreDNSZone.address(
+                    value["name"],
+                    value["port"],
+                    value.get("scheme", SCHEME_DNS)
+                )
+
+            if "template" in value:
+                zones[key] = CoreDNSTemplateZone(
+                    value["name"],
+                    templates[value["template"]],
+                    value["params"],
+                    port=value["port"],
+                    scheme=value.get("scheme", SCHEME_DNS)
+                )
+            else:
+                zones[key] = CoreDNSZone.from_dict(value)
+
+        return CoreDNSCorefile(zones=zones, snippets=snippets, templates=templates)
+
+    def find_zones(
+            self,
+            zone: str,
+            port: Optional[int] = None,
+            scheme: Optional[str] = None
+    ) -> List[str]:
+        """Find keys of the zones matching given address
+
+        Candidates are looked up in zone_index and matched using their keys
+        only, so zones of lazily loaded corefiles are not built.
+
+        Args:
+            zone: Either a zone key (i.e. 'tls://example.io:853') or a zone name
+            port: If given, only zones using this port match
+            scheme: If given, only zones using this scheme match
+
+        Returns:
+            Returns list of matching zone keys
+        """
+
+        if zone in self.objects and port is None and scheme is None:
+            return [zone]
+
+        name = zone
+        if "://" in zone:
+            given_scheme, name, given_port = CoreDNSZone.parse_address(zone)
+            scheme = given_scheme if scheme is None else scheme
+            port = given_port if port is None else port
+
+        result = []
+        for key in self.zone_index().get(name):
+            key_scheme, key_name, key_port = self.zone_address(key)
+
+            if key_name != name:
+                continue
+            if port is not None and key_port != port:
+                continue
+            if scheme is not None and key_scheme != scheme:
+                continue
+
+            result.append(key)
+
+        return result
+
+    def zone_address(self, key: str) -> Tuple[str, str, int]:
+        """Return scheme, name and port of the zone with given key
+
+        The zone is built only if its key is not an address.
+        """
+
+        scheme, name, port = CoreDNSZone.parse_address(key)
+        if port is None:
+            # Keys of older Corefiles are zone names
+            zone = self.objects[key]
+            scheme, name, port = zone.scheme, zone.name, zone.port
+
+        return scheme, name, port
+
+    def validate_multisocket(self) -> Optional[str]:
+        """Check that zones served on the same address use the same 'multisocket'
+
+        CoreDNS opens the sockets of a port once for every server block on
+        it, so it refuses to start if the blocks ask for different numbers of
+        sockets. A zone without the plugin uses a single socket.
+
+        Returns:
+            Returns the reason if zones disagree, None otherwise
+        """
+
+        def describe(args: Optional[List[str]]) -> str:
+            if args is None:
+                return "no multisocket"
+            return " ".join(["'multisocket"] + args) + "'"
+
+        first: Dict[Tuple[str, int], Tuple[str, Optional[List[str]]]] = {}
+        for key, zone in self.objects.items():
+            plugins: List[CoreDNSPlugin] = []
+            self._expand(self.block(key, edit=False), plugins, set())
+            instances = [plugin.args for plugin in plugins if plugin.name == "multisocket"]
+            if len(instances) > 1:
+                return f"zone {key} has more than one multisocket plugin"
+
+            args = instances[0] if instances else None
+            other, other_args = first.setdefault((zone.scheme, zone.port), (key, args))
+            if other_args != args:
+                return (
+                    f"zones {other} and {key} share port {zone.port} but use "
+                    f"{describe(other_args)} and {describe(args)}"
+                )
+
+        return None
+
+    def zone_index(self) -> ZoneIndex:
+        """Return index of zone keys by zone name
+
+        The index is built again only if objects are changed directly.
+        """
+
+        if not self._zones_current():
+            self._zones = ZoneIndex((key, self.zone_address(key)[1]) for key in self.objects)
+            self._zones_objects = self.objects
+            self._zones_version = _version(self.objects)
+
+        return self._zones
+
+    def _zones_current(self) -> bool:
+        objects = self.objects
+        return self._zones is not None and self._zones_objects is objects and (
+            self._zones_version == _version(objects)
         )
 
+    def plugin_index(self) -> PluginIndex:
+        """Return index of zone keys by the plugins they use
+
+        Zones returned by block are indexed again when the index is used
+        next, and the index is built again if objects are changed directly.
+        Zones created from a template are indexed again when the template
+        is returned by block.
+        """
+
+        if not self._plugins_current():
+            self._plugins = PluginIndex()
+            for key in self.objects:
+                self._plugins.add(key, self.objects[key])
+            self._plugins_objects = self.objects
+            self._plugins_version = _version(self.objects)
+            self._plugins_dirty.clear()
+
+        for key in self._plugins_dirty:
+            self._plugins.add(key, self.objects[key])
+        self._plugins_dirty.clear()
+
+        return self._plugins
+
+    def _plugins_current(self) -> bool:
+        objects = self.objects
+        return self._plugins is not None and self._plugins_objects is objects and (
+            self._plugins_version == _version(objects)
+        )
+
+    def zones_using(
+            self,
+            name: str,
+            args: Iterable[str] = (),
+            prop: Optional[str] = None
+    ) -> List[str]:
+        """Return keys of the zones that use a plugin
+
+        Only the zones found in plugin_index are checked.
+
+        Args:
+            name: Name of the plugin
+            args: Values that must be among arguments of the plugin
+            prop: Name of a property that plugin must have
+
+        Returns:
+            Returns keys of the zones having an instance of the plugin that
+            matches all of args and prop
+        """
+
+        args = list(args)
+        result = []
+        for key in self.plugin_index().zones(name, args, prop):
+            zone = self.objects[key]
+            for plugin_key in zone.instances(name):
+                plugin = zone.objects[plugin_key]
+                if all(arg in plugin.args for arg in args) and (
+                        prop is None or plugin.instances(prop)
+                ):
+                    result.append(key)
+                    break
+
+        return result
+
+    def route(
+            self,
+            name: str,
+            port: Optional[int] = None,
+            scheme: Optional[str] = None
+    ) -> Optional[str]:
+        """Return key of the zone that serves a domain name
+
+        Like CoreDNS, the zone whose name is the longest suffix of name wins.
+
+        Args:
+            name: Domain name, i.e. 'foo.bar.example.io'
+            port: If given, only zones using this port are considered
+            scheme: If given, only zones using this scheme are considered
+
+        Returns:
+            Returns key of the zone, None if no zone serves name
+        """
+
+        for keys in self.zone_index().matches(name):
+            for key in keys:
+                key_scheme, _, key_port = self.zone_address(key)
+                if (port is None or key_port == port) and (scheme is None or key_scheme == scheme):
+                    return key
+
+        return None
+
+    def overlapping(self, key: str) -> List[str]:
+        """Return keys of the zones served on the same address as the zone with
+        given key, whose names contain or are contained in its name
+
+        Queries for names under a zone are routed to the most specific of
+        these zones, so a zone only serves the part of its name that more
+        specific zones do not.
+        """
+
+        scheme, name, port = self.zone_address(key)
+        index = self.zone_index()
+        keys = [k for keys in index.matches(name) for k in keys] + index.subzones(name)
+
+        result = []
+        for other in keys:
+            other_scheme, _, other_port = self.zone_address(other)
+            if other != key and (other_scheme, other_port) == (scheme, port):
+                result.append(other)
+
+        return result
+
+    def add_object(
+            self,
+            obj: CoreDNSZone,
+            replace: bool = True,
+            multiple: bool = False
+    ) -> Optional[CoreDNSZone]:
+        key = obj.key
+        new = key not in self.objects
+        current = self._zones_current()
+        plugins_current = self._plugins_current()
+
+        added = super(CoreDNSCorefile, self).add_object(obj, replace=replace, multiple=multiple)
+        if added is None:
+            return None
+
+        if current:
+            if new:
+                self._zones.add(key, obj.name)
+            self._zones_version = _version(self.objects)
+        if plugins_current:
+            self._plugins_dirty.add(key)
+            self._plugins_version = _version(self.objects)
+
+        return added
+
+    def remove_object(self, name: str) -> Optional[CoreDNSZone]:
+        current = self._zones_current()
+        plugins_current = self._plugins_current()
+
+        removed = super(CoreDNSCorefile, self).remove_object(name)
+        if removed is None:
+            return None
+
+        if current:
+            self._zones.remove(name, removed.name)
+            self._zones_version = _version(self.objects)
+        if plugins_current:
+            self._plugins.remove(name)
+            self._plugins_dirty.discard(name)
+            self._plugins_version = _version(self.objects)
+
+        return removed
+
     def add_zone(
             self,
             name: str,
             port: int = 53,
             plugins: Optional[Dict[str, CoreDNSPlugin]] = None,
-            replace: bool = True
+            replace: bool = True,
+            scheme: str = SCHEME_DNS
     ) -> Optional[CoreDNSZone]:
         """Add new zone
 
+        Zones are keyed by their address, so the same zone can be served
+        using different schemes and ports.
+
         Args:
             name: Name of the zone
             port: Port that zone uses
             plugins: Plugins required by the zone
             replace: Whether to replace existing zone or not
+            scheme: Protocol of the server block, one of SCHEMES
 
         Returns:
             Returns newly added CoreDNSZone object. If already exists
             and replace is False, returns None
         """
 
-        new_zone = CoreDNSZone(name, port, plugins)
+        new_zone = CoreDNSZone(name, port, plugins, scheme=scheme)
         return self.add_object(new_zone, replace=replace)
 
 
+# Plugins that are represented by a subclass of CoreDNSPlugin
+PLUGIN_CLASSES: Dict[str, type] = {
+    "rewrite": CoreDNSRewritePlugin
+}
+
 # Some plugin definitions for the sake of simplicity
 PLUGIN_CACHE = CoreDNSPlugin("cache")
 PLUGIN_LOG = CoreDNSPlugin("log")
@@ -0,0 +1,156 @@
+"""Go runtime settings of CoreDNS derived from the limits of its container
+
+The Go runtime sizes its scheduler by the CPUs of the host and grows its heap
+without regard to the cgroup memory limit. Under a CPU quota this causes
+throttling, and under a memory limit it causes OOM kills before the garbage
+collector runs. GOMAXPROCS and GOMEMLIMIT are derived from the cgroup limits
+of the workload container instead.
+"""
+
+__all__ = [
+    "CgroupLimits",
+    "parse_cpu_max",
+    "parse_memory_max",
+    "read_cgroup_limits",
+    "go_environment"
+]
+
+import math
+
+from typing import (
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional
+)
+
+# cgroup v2 files
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_MEMORY_MAX = "/sys/fs/cgroup/memory.max"
+# cgroup v1 files
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+CGROUP_V1_MEMORY_LIMIT = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+
+# cgroup v1 reports no memory limit as the largest page aligned value
+_V1_MEMORY_UNLIMITED = 1 << 62
+
+MIB = 1 << 20
+
+
+class CgroupLimits(NamedTuple):
+    """CPU quota (in CPUs) and memory limit (in bytes), None if unlimited"""
+
+    cpus: Optional[float] = None
+    memory: Optional[int] = None
+
+
+def parse_cpu_max(quota: str, period: str = "") -> Optional[float]:
+    """Return CPU quota in CPUs
+
+    Args:
+        quota: Either contents of cgroup v2 'cpu.max' ('max 100000' or
+            '150000 100000'), or cgroup v1 'cpu.cfs_quota_us' ('-1' or '150000')
+        period: Contents of cgroup v1 'cpu.cfs_period_us'
+
+    Returns:
+        Returns None if there is no quota
+    """
+
+    fields = quota.split()
+    if len(fields) == 2:
+        quota, period = fields
+    elif len(fields) == 1:
+        quota = fields[0]
+    else:
+        return None
+
+    if quota == "max" or int(quota) <= 0 or not period.strip() or int(period) <= 0:
+        return None
+
+    return int(quota) / int(period)
+
+
+def parse_memory_max(limit: str) -> Optional[int]:
+    """Return memory limit in bytes from cgroup v2 'memory.max' or cgroup v1
+    'memory.limit_in_bytes', None if there is no limit"""
+
+    limit = limit.strip()
+    if not limit or limit == "max" or int(limit) >= _V1_MEMORY_UNLIMITED:
+        return None
+
+    return int(limit)
+
+
+def read_cgroup_limits(read: Callable[[str], Optional[str]]) -> CgroupLimits:
+    """Read limits of a container, trying cgroup v2 files first
+
+    Args:
+        read: Returns contents of a file in the container, None if it does
+            not exist
+
+    Returns:
+        Returns limits of the container, invalid files are treated as missing
+    """
+
+    cpus = None
+    memory = None
+    try:
+        cpu_max = read(CGROUP_CPU_MAX)
+        if cpu_max is not None:
+            cpus = parse_cpu_max(cpu_max)
+        else:
+            quota = read(CGROUP_V1_CPU_QUOTA)
+            if quota is not None:
+                cpus = parse_cpu_max(quota, read(CGROUP_V1_CPU_PERIOD) or "")
+    except ValueError:
+        cpus = None
+
+    try:
+        memory_max = read(CGROUP_MEMORY_MAX)
+        if memory_max is None:
+            memory_max = read(CGROUP_V1_MEMORY_LIMIT)
+        if memory_max is not None:
+            memory = parse_memory_max(memory_max)
+    except ValueError:
+        memory = None
+
+    return CgroupLimits(cpus, memory)
+
+
+def go_environment(
+        limits: CgroupLimits,
+        max_procs: int = 0,
+        memory_limit: int = 0,
+        memory_limit_percent: int = 90,
+        gogc: int = 100
+) -> Dict[str, str]:
+    """Return environment variables of the Go runtime
+
+    Args:
+        limits: Limits of the container
+        max_procs: GOMAXPROCS, 0 derives it from the CPU quota, rounded down
+            and at least 1
+        memory_limit: GOMEMLIMIT in MiB, 0 derives it from memory_limit_percent
+            of the memory limit, leaving room for memory outside the Go heap
+        memory_limit_percent: Percentage of the memory limit used as GOMEMLIMIT
+        gogc: GOGC, -1 turns garbage collection off until GOMEMLIMIT is reached
+
+    Returns:
+        Returns variables, GOMAXPROCS and GOMEMLIMIT are omitted when there is
+        no limit to derive them from
+    """
+
+    env = {"GOGC": "off" if gogc < 0 else str(gogc)}
+
+    if max_procs > 0:
+        env["GOMAXPROCS"] = str(max_procs)
+    elif limits.cpus is not None:
+        env["GOMAXPROCS"] = str(max(1, math.floor(limits.cpus)))
+
+    if memory_limit > 0:
+        env["GOMEMLIMIT"] = f"{memory_limit}MiB"
+    elif limits.memory is not None:
+        env["GOMEMLIMIT"] = f"{max(1, limits.memory * memory_limit_percent // 100 // MIB)}MiB"
+
+    return env
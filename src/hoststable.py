@@ -0,0 +1,209 @@
+"""Static host tables served by CoreDNS 'hosts' plugin from separate files"""
+
+__all__ = [
+    "HOSTS_DIR",
+    "HostsTable"
+]
+
+import bisect
+import ipaddress
+import re
+
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Tuple
+)
+
+# Directory in the workload that hosts files are pushed to
+HOSTS_DIR = "/etc/coredns/hosts"
+
+# Table names are file names in HOSTS_DIR, so they cannot contain '/' or
+# start with '.', which rules out '.' and '..'
+_TABLE_NAME_REGEX = re.compile(r"^\w[\w.-]*$")
+
+HostsEntry = Tuple[str, str]
+
+
+class HostsTable:
+    """Sorted, deduplicated list of (ip, hostname) pairs
+
+    Entries are kept sorted by IP then hostname, so rendering groups
+    hostnames of an IP in a single pass and diffing two tables is a merge.
+    """
+
+    def __init__(self, entries: Iterable[HostsEntry] = ()):
+        """Create a hosts table
+
+        Args:
+            entries: (ip, hostname) pairs, duplicates are dropped
+
+        Raises:
+            ValueError: When an IP address is invalid
+        """
+
+        entries = set(entries)
+        for ip, _ in entries:
+            HostsTable.validate_ip(ip)
+
+        self.entries: List[HostsEntry] = sorted(entries)
+
+    @staticmethod
+    def validate_ip(ip: str):
+        """Raise ValueError if ip is not a valid IPv4 or IPv6 address"""
+
+        ipaddress.ip_address(ip)
+
+    @staticmethod
+    def validate_name(name: str):
+        """Raise ValueError if name cannot be used as a file name in HOSTS_DIR"""
+
+        if not _TABLE_NAME_REGEX.match(name):
+            raise ValueError(f"Invalid hosts table name '{name}'")
+
+    @staticmethod
+    def path(name: str) -> str:
+        """Return path of the hosts file of table name in the workload
+
+        Raises:
+            ValueError: When name is not a valid table name
+        """
+
+        HostsTable.validate_name(name)
+        return f"{HOSTS_DIR}/{name}"
+
+    @staticmethod
+    def parse(text: str) -> "HostsTable":
+        """Create a table from hosts file format ('IP HOSTNAME...' lines)
+
+        Raises:
+            ValueError: When a line has no hostname or its IP is invalid
+        """
+
+        entries = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            line = line.split('#', maxsplit=1)[0].split()
+            if not line:
+                continue
+            if len(line) < 2:
+                raise ValueError(f"Missing hostname in line {line_number}")
+
+            entries.extend((line[0], hostname) for hostname in line[1:])
+
+        return HostsTable(entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[HostsEntry]:
+        return iter(self.entries)
+
+    def __contains__(self, entry: HostsEntry) -> bool:
+        i = bisect.bisect_left(self.entries, entry)
+        return i < len(self.entries) and self.entries[i] == entry
+
+    def __eq__(self, other: "HostsTable"):
+        if other is None:
+            return False
+
+        return self.entries == other.entries
+
+    def add(self, ip: str, *hostnames: str) -> int:
+        """Add hostnames of an IP
+
+        Returns:
+            Returns number of entries that did not exist before
+        """
+
+        HostsTable.validate_ip(ip)
+
+        added = 0
+        for hostname in hostnames:
+            entry = (ip, hostname)
+            i = bisect.bisect_left(self.entries, entry)
+            if i == len(self.entries) or self.entries[i] != entry:
+                self.entries.insert(i, entry)
+                added += 1
+
+        return added
+
+    def update(self, other: "HostsTable") -> int:
+        """Add all entries of other table
+
+        Returns:
+            Returns number of entries that did not exist before
+        """
+
+        added, _ = self.diff(other)
+        if added:
+            self.entries = sorted(set(self.entries).union(added))
+
+        return len(added)
+
+    def remove(self, ip: str, *hostnames: str) -> int:
+        """Remove hostnames of an IP, or all hostnames of it if none given
+
+        Returns:
+            Returns number of removed entries
+        """
+
+        start = bisect.bisect_left(self.entries, (ip, ""))
+        end = start
+        while end < len(self.entries) and self.entries[end][0] == ip:
+            end += 1
+
+        if not hostnames:
+            del self.entries[start:end]
+            return end - start
+
+        hostnames = set(hostnames)
+        kept = [entry for entry in self.entries[start:end] if entry[1] not in hostnames]
+        self.entries[start:end] = kept
+        return end - start - len(kept)
+
+    def diff(self, other: "HostsTable") -> Tuple[List[HostsEntry], List[HostsEntry]]:
+        """Compare with other table in a single pass
+
+        Returns:
+            Returns (added, removed) entries, where added entries exist only in
+            other and removed entries exist only in this table
+        """
+
+        added = []
+        removed = []
+        i = j = 0
+        while i < len(self.entries) and j < len(other.entries):
+            if self.entries[i] == other.entries[j]:
+                i += 1
+                j += 1
+            elif self.entries[i] < other.entries[j]:
+                removed.append(self.entries[i])
+                i += 1
+            else:
+                added.append(other.entries[j])
+                j += 1
+
+        removed.extend(self.entries[i:])
+        added.extend(other.entries[j:])
+        return added, removed
+
+    def grouped(self) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (ip, hostnames) for each IP in the table"""
+
+        ip = None
+        hostnames: List[str] = []
+        for entry_ip, hostname in self.entries:
+            if entry_ip != ip:
+                if hostnames:
+                    yield ip, hostnames
+                ip, hostnames = entry_ip, []
+            hostnames.append(hostname)
+
+        if hostnames:
+            yield ip, hostnames
+
+    def to_hosts(self) -> str:
+        """Return table in hosts file format"""
+
+        return "".join(f"{ip} {' '.join(hostnames)}\n" for ip, hostnames in self.grouped())
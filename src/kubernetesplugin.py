@@ -0,0 +1,139 @@
+"""Manage properties of CoreDNS 'kubernetes' plugin"""
+
+__all__ = [
+    "KUBERNETES_POD_MODES",
+    "KUBERNETES_PROFILES",
+    "kubernetes_properties",
+    "apply_kubernetes_properties"
+]
+
+import re
+
+from typing import (
+    Dict,
+    List,
+    Optional
+)
+
+from coredns import CoreDNSPlugin
+
+KUBERNETES_POD_MODES = ["disabled", "insecure", "verified"]
+KUBERNETES_MAX_TTL = 3600
+
+# Presets applied before explicitly given settings. 'large-cluster' stops
+# watching pods and caches answers longer, it should be combined with
+# 'namespaces' and 'labels' to limit watched services and endpoints
+KUBERNETES_PROFILES: Dict[str, Dict] = {
+    "large-cluster": {
+        "pods": "disabled",
+        "ttl": 30,
+        "endpoint_pod_names": False
+    }
+}
+
+_NAMESPACE_REGEX = re.compile(r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?$")
+
+# Properties that have no arguments and are either present or not
+_FLAG_PROPERTIES = ["endpoint_pod_names", "noendpoints"]
+
+
+def kubernetes_properties(
+        pods: Optional[str] = None,
+        namespaces: Optional[List[str]] = None,
+        labels: Optional[str] = None,
+        ttl: Optional[int] = None,
+        endpoint_pod_names: Optional[bool] = None,
+        noendpoints: Optional[bool] = None,
+        profile: Optional[str] = None
+) -> Dict[str, Optional[List[str]]]:
+    """Validate settings and return corresponding 'kubernetes' plugin properties
+
+    Settings that are None are not managed and left as is.
+
+    Args:
+        pods: Pod mode, one of KUBERNETES_POD_MODES
+        namespaces: Namespaces exposed by CoreDNS
+        labels: Label selector of exposed services and endpoints
+        ttl: TTL of the answers, between 0 and 3600
+        endpoint_pod_names: Whether to use pod names for endpoint records
+        noendpoints: Whether to disable endpoint records
+        profile: Name of a preset in KUBERNETES_PROFILES
+
+    Returns:
+        Returns a dictionary of property names to property arguments. If
+        arguments are None, the property must be removed
+
+    Raises:
+        ValueError: When a setting is invalid
+    """
+
+    settings = {}
+    if profile:
+        if profile not in KUBERNETES_PROFILES:
+            raise ValueError(f"Profile must be one of {list(KUBERNETES_PROFILES)}")
+        settings.update(KUBERNETES_PROFILES[profile])
+
+    given = {
+        "pods": pods,
+        "namespaces": namespaces,
+        "labels": labels,
+        "ttl": ttl,
+        "endpoint_pod_names": endpoint_pod_names,
+        "noendpoints": noendpoints
+    }
+    settings.update({key: value for key, value in given.items() if value is not None})
+
+    properties: Dict[str, Optional[List[str]]] = {}
+
+    if "pods" in settings:
+        if settings["pods"] not in KUBERNETES_POD_MODES:
+            raise ValueError(f"Pod mode must be one of {KUBERNETES_POD_MODES}")
+        properties["pods"] = [settings["pods"]]
+
+    if "namespaces" in settings:
+        for namespace in settings["namespaces"]:
+            if not _NAMESPACE_REGEX.match(namespace):
+                raise ValueError(f"Invalid namespace '{namespace}'")
+        properties["namespaces"] = list(settings["namespaces"]) or None
+
+    if "labels" in settings:
+        properties["labels"] = settings["labels"].split() or None
+
+    if "ttl" in settings:
+        if not 0 <= settings["ttl"] <= KUBERNETES_MAX_TTL:
+            raise ValueError(f"TTL must be between 0 and {KUBERNETES_MAX_TTL}")
+        properties["ttl"] = [str(settings["ttl"])]
+
+    for flag in _FLAG_PROPERTIES:
+        if flag in settings:
+            properties[flag] = [] if settings[flag] else None
+
+    return properties
+
+
+def apply_kubernetes_properties(
+        plugin: CoreDNSPlugin,
+        properties: Dict[str, Optional[List[str]]]
+) -> bool:
+    """Add, replace or remove properties returned by kubernetes_properties
+
+    Args:
+        plugin: 'kubernetes' plugin to update
+        properties: Properties returned by kubernetes_properties
+
+    Returns:
+        Returns True if plugin is changed
+    """
+
+    changed = False
+    for name, args in properties.items():
+        existing = plugin.objects.get(name)
+        if args is None:
+            if existing is not None:
+                plugin.remove_object(name)
+                changed = True
+        elif existing is None or existing.args != args:
+            plugin.add_property(name, *args)
+            changed = True
+
+    return changed
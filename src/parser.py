@@ -1,22 +1,79 @@
+import fnmatch
+import os
+import re
 import shlex
 import enum
 
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor
+)
+
 from typing import (
+    Any,
+    Deque,
     Dict,
     Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
     Optional,
     List,
+    Tuple,
+    TypeVar,
+    Union
 )
 
 from coredns import (
     CoreDNSCorefile,
-    CoreDNSObject
+    CoreDNSObject,
+    CoreDNSPlugin,
+    CoreDNSRewritePlugin,
+    INSTANCE_SEPARATOR,
+    PLUGIN_IMPORT,
+    SCHEME_DNS,
+    SCHEMES,
+    SCHEME_PORTS,
+    SCHEMES_REQUIRE_TLS
+)
+from kubernetesplugin import (
+    kubernetes_properties,
+    apply_kubernetes_properties
 )
+from rewriterules import (
+    parse_rule,
+    compile_rules
+)
+
+_BLOCK_NAME_REGEX = re.compile(r"^[\w.-]+$")
+
+# Zone selectors apply a command to every matching zone: '*' matches all
+# zones, a glob (i.e. '*.example.io') or 're:' followed by a regular expression
+# matches zone keys and names
+SELECTOR_ALL = "*"
+SELECTOR_REGEX_PREFIX = "re:"
+_T = TypeVar("_T")
+
+_SELECTOR_GLOB_CHARS = "*?["
+
+# Script statements handled while compiling, besides PARSER_COMMANDS
+SCRIPT_SET = "set"
+SCRIPT_FOR = "for"
+SCRIPT_END = "end"
+SCRIPT_INCLUDE = "include"
+INCLUDE_RESOURCE_PREFIX = "resource:"
+
+_VARIABLE_REGEX = re.compile(r"\$\{(\w+)\}")
+_RANGE_REGEX = re.compile(r"^(-?\d+)\.\.(-?\d+)$")
+# Maximum number of compiled items kept while waiting for an included script
+_INCLUDE_WINDOW = 4096
 
 
 class ResultType(enum.Enum):
     ADD_NO_REPLACE = "Not replacing, nothing changed"
     REMOVE_NOT_FOUND = "Not found, nothing changed"
+    FIND_NOT_FOUND = "Not found"
 
 
 class ValidationError(Exception):
@@ -31,6 +88,22 @@ class RequiredError(Exception):
         self.message = message
 
 
+class Operation(NamedTuple):
+    """A script line compiled to its command and converted params"""
+
+    line: int
+    command: str
+    params: Dict[str, Any]
+
+
+class _Include(NamedTuple):
+    """Included script to be compiled"""
+
+    path: str
+    variables: Dict[str, str]
+    stack: Tuple[str, ...]
+
+
 class Parser:
     @staticmethod
     def return_result_if_none(obj: Optional[CoreDNSObject], result_type: ResultType) -> str:
@@ -50,22 +123,131 @@ class Parser:
             raise RequiredError(f"Missing required arguments: {missing}")
 
     @staticmethod
-    def validate_plugin_owners(corefile: CoreDNSCorefile, zone: str):
-        if zone not in corefile.objects:
+    def validate_plugin_owners(corefile: CoreDNSCorefile, zone: str) -> str:
+        """Check that zone exists and return its key in corefile
+
+        Args:
+            corefile: Corefile that zone belongs
+            zone: Either key or name of the zone
+        """
+
+        name = CoreDNSCorefile.snippet_name(zone)
+        if name is not None:
+            if name not in corefile.snippets:
+                raise ValidationError(f"Could not found given snippet {name}")
+            return zone
+
+        name = CoreDNSCorefile.template_name(zone)
+        if name is not None:
+            if name not in corefile.templates:
+                raise ValidationError(f"Could not found given template {name}")
+            return zone
+
+        keys = corefile.find_zones(zone)
+        if not keys:
             raise ValidationError(f"Could not found given zone {zone}")
+        if len(keys) > 1:
+            raise ValidationError(f"Zone {zone} is ambiguous, use one of {keys}")
+
+        return keys[0]
 
     @staticmethod
-    def validate_property_owners(corefile: CoreDNSCorefile, plugin: str, zone: str):
+    def validate_property_owners(corefile: CoreDNSCorefile, plugin: str, zone: str) -> str:
         try:
-            Parser.validate_plugin_owners(corefile, zone)
+            key = Parser.validate_plugin_owners(corefile, zone)
         except ValidationError as e:
             raise e
 
-        if plugin not in corefile.objects[zone].objects:
+        if Parser.resolve_key(corefile.block(key, edit=False), plugin) is None:
             raise ValidationError(f"Could not found given plugin {plugin}")
 
+        return key
+
+    @staticmethod
+    def is_selector(zone: str) -> bool:
+        """Whether zone is a selector of multiple zones instead of a single zone"""
+
+        return zone.startswith(SELECTOR_REGEX_PREFIX) or any(
+            c in zone for c in _SELECTOR_GLOB_CHARS
+        )
+
+    @staticmethod
+    def select_zones(
+            corefile: CoreDNSCorefile,
+            selector: str,
+            keys: Optional[List[str]] = None
+    ) -> List[str]:
+        """Return keys of the zones whose key or name matches selector
+
+        Args:
+            corefile: Corefile that zones belong
+            selector: '*', a glob, or 're:' followed by a regular expression
+            keys: If given, only these zones are checked
+
+        Raises:
+            ValidationError: When regular expression is invalid
+        """
+
+        if keys is None:
+            keys = list(corefile.objects)
+        if selector == SELECTOR_ALL:
+            return keys
+
+        if selector.startswith(SELECTOR_REGEX_PREFIX):
+            try:
+                match = re.compile(selector[len(SELECTOR_REGEX_PREFIX):]).search
+            except re.error as e:
+                raise ValidationError(f"Invalid zone selector {selector}: {e}")
+            return [key for key in keys if match(key) or match(corefile.zone_address(key)[1])]
+
+        # Zone names are case-insensitive, so are globs
+        match = re.compile(fnmatch.translate(selector.lower())).match
+        return [
+            key for key in keys
+            if match(key.lower()) or match(corefile.zone_address(key)[1].lower())
+        ]
+
+    @staticmethod
+    def plugin_name(plugin: str) -> str:
+        """Return name of the plugin addressed by name or key"""
+
+        return plugin.split(INSTANCE_SEPARATOR, maxsplit=1)[0]
+
+    @staticmethod
+    def resolve_key(owner: CoreDNSObject, name: str, index: Optional[int] = None) -> Optional[str]:
+        """Return key of a child of owner addressed by key, or by name and index
+
+        Args:
+            owner: Zone or plugin that child belongs
+            name: Either key (i.e. 'forward:2') or name of the child
+            index: Position of the child among children with the same name.
+                If None or negative, name must be a key or a unique name
+
+        Returns:
+            Returns key of the child, None if it does not exist
+
+        Raises:
+            ValidationError: When name is shared by multiple children and
+                index is not given
+        """
+
+        if index is not None and index >= 0:
+            keys = owner.instances(name)
+            return keys[index] if index < len(keys) else None
+
+        if name in owner.objects:
+            return name
+
+        keys = owner.instances(name)
+        if len(keys) > 1:
+            raise ValidationError(f"{name} is ambiguous, use one of {keys} or an index")
+
+        return keys[0] if keys else None
+
     @staticmethod
     def str2bool(s: str) -> bool:
+        if isinstance(s, bool):
+            return s
         return s.lower() in ["true", "yes"]
 
     @staticmethod
@@ -77,7 +259,10 @@ class Parser:
             conversion_map = {
                 "args": str.split,
                 "port": int,
-                "replace": Parser.str2bool
+                "replace": Parser.str2bool,
+                "multiple": Parser.str2bool,
+                "index": int,
+                "plugin_index": int
             }
 
         for arg in conversion_map:
@@ -99,11 +284,29 @@ class Parser:
             Parser.convert_params(params, conversion_map)
 
     @staticmethod
-    def parse_args(cmd: str) -> Dict:
+    def split_args(cmd: str) -> Dict[str, str]:
+        """Split 'name=value' pairs of cmd without converting values
+
+        Raises:
+            ValueError: When a word is not a 'name=value' pair or a quote is
+                not closed
+        """
+
         lexer = shlex.shlex(cmd, posix=True, punctuation_chars=True)
-        lexer.wordchars += '='
+        lexer.wordchars += '=:'
 
-        params = dict(word.split('=', maxsplit=1) for word in lexer)
+        pairs = {}
+        for word in lexer:
+            if '=' not in word:
+                raise ValueError(f"Expected 'name=value' instead of '{word}'")
+            name, value = word.split('=', maxsplit=1)
+            pairs[name] = value
+
+        return pairs
+
+    @staticmethod
+    def parse_args(cmd: str) -> Dict:
+        params = Parser.split_args(cmd)
 
         Parser.default_params(
             params,
@@ -119,77 +322,266 @@ class Parser:
     @staticmethod
     def reset(corefile: CoreDNSCorefile, _=None) -> str:
         corefile.objects = {}
+        corefile.snippets = {}
+        corefile.templates = {}
         return ""
 
+    @staticmethod
+    def reject_rewrite(plugin: str):
+        """Raise ValidationError if plugin is 'rewrite', whose properties are
+        rules managed only by rewrite commands"""
+
+        if Parser.plugin_name(plugin) == "rewrite":
+            raise ValidationError(
+                "rewrite rules are managed with add_rewrite and remove_rewrite"
+            )
+
     @staticmethod
     def add_property(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name", "plugin", "zone"])
+        Parser.raise_required(params, PARSER_REQUIRED["add_property"])
+        Parser.reject_rewrite(params["plugin"])
 
         name: str = params["name"]
         zone: str = params["zone"]
         plugin: str = params["plugin"]
         args: List[str] = params["args"]
         replace: bool = params["replace"]
+        multiple: bool = Parser.str2bool(params.get("multiple", False))
 
-        Parser.validate_property_owners(corefile, plugin, zone)
+        if Parser.is_selector(zone):
+            keys = Parser.selected_plugins(corefile, params)
+            added = 0
+            for zone, plugin in keys:
+                added += corefile.block(zone).edit(plugin).add_property(
+                    name,
+                    *args,
+                    replace=replace,
+                    multiple=multiple
+                ) is not None
+            if not added:
+                return ResultType.ADD_NO_REPLACE.value
+            return f"Added {name} to {added} plugins"
 
-        added = corefile.objects[zone].objects[plugin].add_property(
+        zone, plugin = Parser.plugin_key(corefile, zone, plugin, params.get("plugin_index"))
+
+        added = corefile.block(zone).edit(plugin).add_property(
             name,
             *args,
-            replace=replace
+            replace=replace,
+            multiple=multiple
         )
         return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
 
     @staticmethod
     def remove_property(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name", "plugin", "zone"])
+        Parser.raise_required(params, PARSER_REQUIRED["remove_property"])
+        Parser.reject_rewrite(params["plugin"])
 
         name: str = params["name"]
         zone: str = params["zone"]
         plugin: str = params["plugin"]
 
-        Parser.validate_property_owners(corefile, plugin, zone)
+        if Parser.is_selector(zone):
+            keys = Parser.selected_plugins(corefile, params, prop=name)
+            owners = [(zone, plugin, Parser.resolve_key(
+                corefile.block(zone, edit=False).objects[plugin], name, params.get("index")
+            )) for zone, plugin in keys]
+
+            removed = 0
+            for zone, plugin, key in owners:
+                if key is not None:
+                    corefile.block(zone).edit(plugin).remove_object(key)
+                    removed += 1
+            if not removed:
+                return ResultType.REMOVE_NOT_FOUND.value
+            return f"Removed {name} from {removed} plugins"
 
-        removed = corefile.objects[zone].objects[plugin].remove_object(name)
+        zone, plugin = Parser.plugin_key(corefile, zone, plugin, params.get("plugin_index"))
+
+        owner = corefile.block(zone).edit(plugin)
+        key = Parser.resolve_key(owner, name, params.get("index"))
+
+        removed = owner.remove_object(key) if key is not None else None
         return Parser.return_result_if_none(removed, ResultType.REMOVE_NOT_FOUND)
 
+    @staticmethod
+    def selected_plugins(
+            corefile: CoreDNSCorefile,
+            params: Dict,
+            prop: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        """Return keys of the zones selected by params["zone"] and their plugin
+        addressed by params["plugin"] and params["plugin_index"]
+
+        Only zones using the plugin, and having property prop if given, are
+        checked. Every zone is checked before anything is changed.
+
+        Raises:
+            ValidationError: When plugin is ambiguous in a zone
+        """
+
+        plugin: str = params["plugin"]
+        candidates = corefile.zones_using(Parser.plugin_name(plugin), prop=prop)
+
+        result = []
+        for zone in Parser.select_zones(corefile, params["zone"], candidates):
+            try:
+                key = Parser.resolve_key(
+                    corefile.block(zone, edit=False),
+                    plugin,
+                    params.get("plugin_index")
+                )
+            except ValidationError as e:
+                raise ValidationError(f"{e.message} in zone {zone}")
+            if key is not None:
+                result.append((zone, key))
+
+        return result
+
+    @staticmethod
+    def plugin_key(
+            corefile: CoreDNSCorefile,
+            zone: str,
+            plugin: str,
+            index: Optional[int] = None
+    ) -> Tuple[str, str]:
+        """Return keys of a zone and its plugin addressed by key, or by name and index
+
+        Raises:
+            ValidationError: When zone or plugin does not exist or is ambiguous
+        """
+
+        zone_key = Parser.validate_plugin_owners(corefile, zone)
+        key = Parser.resolve_key(corefile.block(zone_key), plugin, index)
+        if key is None:
+            raise ValidationError(f"Could not found given plugin {plugin}")
+
+        return zone_key, key
+
     @staticmethod
     def add_plugin(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name", "zone"])
+        Parser.raise_required(params, PARSER_REQUIRED["add_plugin"])
 
         name: str = params["name"]
         zone: str = params["zone"]
         args: List[str] = params["args"]
         replace: bool = params["replace"]
+        multiple: bool = Parser.str2bool(params.get("multiple", False))
 
-        Parser.validate_plugin_owners(corefile, zone)
+        if Parser.is_selector(zone):
+            added = 0
+            for key in Parser.select_zones(corefile, zone):
+                if not (replace or multiple) and name in corefile.block(key, edit=False).objects:
+                    continue
+                corefile.block(key).add_plugin(name, *args, replace=replace, multiple=multiple)
+                added += 1
+            if not added:
+                return ResultType.ADD_NO_REPLACE.value
+            return f"Added {name} to {added} zones"
+
+        zone = Parser.validate_plugin_owners(corefile, zone)
 
-        added = corefile.objects[zone].add_plugin(
+        added = corefile.block(zone).add_plugin(
             name,
             *args,
-            replace=replace
+            replace=replace,
+            multiple=multiple
         )
         return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
 
     @staticmethod
     def remove_plugin(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name", "zone"])
+        Parser.raise_required(params, PARSER_REQUIRED["remove_plugin"])
 
         name: str = params["name"]
         zone: str = params["zone"]
 
-        Parser.validate_plugin_owners(corefile, zone)
+        if Parser.is_selector(zone):
+            return Parser.remove_plugins(corefile, params)
+
+        zone = Parser.validate_plugin_owners(corefile, zone)
+
+        if name == "kubernetes" and "autopath" in corefile.block(zone).objects:
+            raise ValidationError("autopath requires kubernetes plugin, disable autopath first")
 
-        removed = corefile.objects[zone].remove_object(name)
+        key = Parser.resolve_key(corefile.block(zone), name, params.get("index"))
+
+        removed = corefile.block(zone).remove_object(key) if key is not None else None
         return Parser.return_result_if_none(removed, ResultType.REMOVE_NOT_FOUND)
 
+    @staticmethod
+    def remove_plugins(corefile: CoreDNSCorefile, params: Dict) -> str:
+        """Remove a plugin from every zone selected by params["zone"]
+
+        Unless params["name"] is a key or params["index"] is given, every
+        instance of the plugin having all of params["args"] is removed.
+        """
+
+        name: str = params["name"]
+        args: List[str] = params.get("args", [])
+        index: Optional[int] = params.get("index")
+
+        removed: Dict[str, List[str]] = {}
+        candidates = corefile.zones_using(Parser.plugin_name(name), args)
+        for zone in Parser.select_zones(corefile, params["zone"], candidates):
+            block = corefile.block(zone, edit=False)
+            if index is not None and index >= 0 or INSTANCE_SEPARATOR in name:
+                keys = [Parser.resolve_key(block, name, index)]
+            else:
+                keys = block.instances(name)
+
+            keys = [
+                key for key in keys
+                if key is not None and all(arg in block.objects[key].args for arg in args)
+            ]
+            if keys:
+                if Parser.plugin_name(name) == "kubernetes" and "autopath" in block.objects:
+                    raise ValidationError(
+                        f"autopath requires kubernetes plugin, disable autopath in {zone} first"
+                    )
+                removed[zone] = keys
+
+        for zone, keys in removed.items():
+            block = corefile.block(zone)
+            for key in keys:
+                block.remove_object(key)
+
+        if not removed:
+            return ResultType.REMOVE_NOT_FOUND.value
+        return f"Removed {name} from {len(removed)} zones"
+
+    @staticmethod
+    def find_plugin(corefile: CoreDNSCorefile, params: Dict) -> str:
+        """Return keys of the zones using a plugin, one per line
+
+        Zones can be narrowed by params["zone"] selector, plugin arguments
+        params["args"] and a property params["property"].
+        """
+
+        Parser.raise_required(params, PARSER_REQUIRED["find_plugin"])
+
+        keys = corefile.zones_using(
+            params["name"],
+            params.get("args", []),
+            params.get("property") or None
+        )
+        keys = Parser.select_zones(corefile, params.get("zone") or SELECTOR_ALL, keys)
+
+        if not keys:
+            return ResultType.FIND_NOT_FOUND.value
+        return "\n".join(keys)
+
     @staticmethod
     def add_zone(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name"])
+        Parser.raise_required(params, PARSER_REQUIRED["add_zone"])
+
+        scheme: str = params.get("scheme") or SCHEME_DNS
+        if scheme not in SCHEMES:
+            raise ValidationError(f"Scheme must be one of {SCHEMES}")
 
         Parser.default_params(
             params,
-            {"port": "53"},
+            {"port": str(SCHEME_PORTS[scheme])},
             convert=True,
             conversion_map={"port": int}
         )
@@ -197,33 +589,574 @@ class Parser:
         name: str = params["name"]
         port: int = params["port"]
         replace: bool = params["replace"]
+        tls_cert: str = params.get("tls_cert", "")
+        tls_key: str = params.get("tls_key", "")
+        tls_ca: str = params.get("tls_ca", "")
+
+        plugins = {}
+        if tls_cert or tls_key:
+            if not (tls_cert and tls_key):
+                raise ValidationError("Both tls_cert and tls_key are required")
+            plugins["tls"] = CoreDNSPlugin("tls", tls_cert, tls_key, *([tls_ca] if tls_ca else []))
+        elif scheme in SCHEMES_REQUIRE_TLS:
+            raise ValidationError(f"Scheme {scheme} requires tls_cert and tls_key")
 
-        added = corefile.add_zone(name, port, replace=replace)
+        added = corefile.add_zone(name, port, plugins=plugins, replace=replace, scheme=scheme)
 
         return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
 
     @staticmethod
     def remove_zone(corefile: CoreDNSCorefile, params: Dict) -> str:
-        Parser.raise_required(params, ["name"])
+        Parser.raise_required(params, PARSER_REQUIRED["remove_zone"])
 
-        zone = corefile.remove_object(params["name"])
+        keys = corefile.find_zones(params["name"])
+        if len(keys) > 1:
+            raise ValidationError(f"Zone {params['name']} is ambiguous, use one of {keys}")
+
+        zone = corefile.remove_object(keys[0]) if keys else None
         return Parser.return_result_if_none(zone, ResultType.REMOVE_NOT_FOUND)
 
     @staticmethod
-    def exec(corefile: CoreDNSCorefile, filename: str):
-        with open(filename, "r") as f:
-            line_number = 0
-            for line in f.readlines():
-                line_number += 1
-                if line.startswith('#') or not line or line.isspace():
-                    continue
+    def set_kubernetes(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["set_kubernetes"])
+
+        zone = Parser.validate_property_owners(corefile, "kubernetes", params["zone"])
+
+        Parser.convert_params(params, {
+            "namespaces": lambda s: s.split() if isinstance(s, str) else s,
+            "ttl": int,
+            "endpoint_pod_names": Parser.str2bool,
+            "noendpoints": Parser.str2bool
+        })
+
+        try:
+            properties = kubernetes_properties(
+                pods=params.get("pods"),
+                namespaces=params.get("namespaces"),
+                labels=params.get("labels"),
+                ttl=params.get("ttl"),
+                endpoint_pod_names=params.get("endpoint_pod_names"),
+                noendpoints=params.get("noendpoints"),
+                profile=params.get("profile")
+            )
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        plugin = corefile.block(zone).edit("kubernetes")
+        pods = properties.get("pods")
+        if "autopath" in corefile.block(zone).objects and pods and pods != ["verified"]:
+            raise ValidationError("autopath requires 'pods verified', disable autopath first")
+
+        apply_kubernetes_properties(plugin, properties)
+        return plugin.to_caddy()
+
+    @staticmethod
+    def set_autopath(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["set_autopath"])
+
+        Parser.default_params(
+            params,
+            {"enabled": "true"},
+            convert=True,
+            conversion_map={"enabled": Parser.str2bool}
+        )
+
+        zone = Parser.validate_plugin_owners(corefile, params["zone"])
+
+        try:
+            corefile.block(zone).set_autopath(params["enabled"], *params["args"])
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        if not params["enabled"]:
+            return "Disabled autopath"
+        return corefile.block(zone).to_caddy()
+
+    @staticmethod
+    def add_rewrite(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["add_rewrite"])
+
+        zone = Parser.validate_plugin_owners(corefile, params["zone"])
+        args: List[str] = params["args"]
+        before: str = params.get("before") or None
+
+        try:
+            parse_rule(args)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        block = corefile.block(zone)
+        if "rewrite" in block.objects:
+            plugin = block.edit("rewrite")
+        else:
+            plugin = block.add_plugin("rewrite")
+        if not isinstance(plugin, CoreDNSRewritePlugin):
+            raise ValidationError("rewrite plugin is not a rule list, remove and add it again")
+
+        try:
+            rule = plugin.add_rule(*args, before=before)
+        except KeyError:
+            raise ValidationError(f"Rewrite rule {before} does not exist")
+
+        return f"Added rewrite rule {rule.key}"
+
+    @staticmethod
+    def remove_rewrite(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["remove_rewrite"])
+
+        zone = Parser.validate_property_owners(corefile, "rewrite", params["zone"])
+
+        plugin = corefile.block(zone).edit("rewrite")
+        removed = plugin.remove_object(str(params["id"]))
+        if not plugin.objects:
+            corefile.block(zone).remove_object("rewrite")
+
+        return Parser.return_result_if_none(removed, ResultType.REMOVE_NOT_FOUND)
+
+    @staticmethod
+    def compile_rewrite(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["compile_rewrite"])
+
+        Parser.default_params(
+            params,
+            {"dry_run": "false", "merge": "true"},
+            convert=True,
+            conversion_map={"dry_run": Parser.str2bool, "merge": Parser.str2bool}
+        )
+
+        zone = Parser.validate_property_owners(corefile, "rewrite", params["zone"])
+
+        plugin = corefile.block(zone).edit("rewrite")
+        if not isinstance(plugin, CoreDNSRewritePlugin):
+            raise ValidationError("rewrite plugin is not a rule list, remove and add it again")
+
+        try:
+            compiled = compile_rules(plugin.rules(), merge=params["merge"])
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        if not params["dry_run"]:
+            plugin.set_rules(compiled.rules)
+
+        return compiled.report()
+
+    @staticmethod
+    def add_snippet(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["add_snippet"])
+
+        name: str = params["name"]
+        replace: bool = params["replace"]
+
+        if not _BLOCK_NAME_REGEX.match(name):
+            raise ValidationError(f"Invalid snippet name '{name}'")
+
+        plugins = {}
+        if params.get("zone"):
+            zone = Parser.validate_plugin_owners(corefile, params["zone"])
+            plugins = {
+                key: CoreDNSPlugin.from_dict(plugin.to_dict())
+                for key, plugin in corefile.block(zone).objects.items()
+                if plugin.name != PLUGIN_IMPORT
+            }
+
+        added = corefile.add_snippet(name, plugins=plugins, replace=replace)
+        return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
+
+    @staticmethod
+    def remove_snippet(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["remove_snippet"])
+
+        Parser.default_params(
+            params,
+            {"inline": "true"},
+            convert=True,
+            conversion_map={"inline": Parser.str2bool}
+        )
+
+        removed = corefile.remove_snippet(params["name"], inline=params["inline"])
+        return Parser.return_result_if_none(removed, ResultType.REMOVE_NOT_FOUND)
+
+    @staticmethod
+    def import_snippet(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["import_snippet"])
+
+        Parser.default_params(
+            params,
+            {"enabled": "true"},
+            convert=True,
+            conversion_map={"enabled": Parser.str2bool}
+        )
+
+        name: str = params["name"]
+        if name not in corefile.snippets:
+            raise ValidationError(f"Could not found given snippet {name}")
+
+        zone = Parser.validate_plugin_owners(corefile, params["zone"])
+        if zone == corefile.snippets[name].name_string:
+            raise ValidationError("A snippet cannot import itself")
+
+        block = corefile.block(zone)
+        if not params["enabled"]:
+            for key in list(block.instances(PLUGIN_IMPORT)):
+                if block.objects[key].args[:1] == [name]:
+                    block.remove_object(key)
+        elif name not in block.imports():
+            block.add_plugin(PLUGIN_IMPORT, name, multiple=True)
+
+        return block.to_caddy()
+
+    @staticmethod
+    def add_template(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["add_template"])
+
+        name: str = params["name"]
+        replace: bool = params["replace"]
+
+        if not _BLOCK_NAME_REGEX.match(name):
+            raise ValidationError(f"Invalid template name '{name}'")
+
+        plugins = {}
+        if params.get("zone"):
+            zone = Parser.validate_plugin_owners(corefile, params["zone"])
+            plugins = {
+                key: CoreDNSPlugin.from_dict(plugin.to_dict())
+                for key, plugin in corefile.block(zone, edit=False).objects.items()
+            }
+
+        added = corefile.add_template(name, plugins=plugins, replace=replace)
+        return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
+
+    @staticmethod
+    def remove_template(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["remove_template"])
+
+        removed = corefile.remove_template(params["name"])
+        return Parser.return_result_if_none(removed, ResultType.REMOVE_NOT_FOUND)
+
+    @staticmethod
+    def add_zone_from_template(corefile: CoreDNSCorefile, params: Dict) -> str:
+        Parser.raise_required(params, PARSER_REQUIRED["add_zone_from_template"])
+
+        template: str = params["template"]
+        if template not in corefile.templates:
+            raise ValidationError(f"Could not found given template {template}")
+
+        scheme: str = params.get("scheme") or SCHEME_DNS
+        if scheme not in SCHEMES:
+            raise ValidationError(f"Scheme must be one of {SCHEMES}")
+
+        Parser.default_params(
+            params,
+            {"port": str(SCHEME_PORTS[scheme])},
+            convert=True,
+            conversion_map={"port": int}
+        )
+
+        variables = {}
+        for arg in params["args"]:
+            variable, sep, value = arg.partition('=')
+            if not sep or not variable:
+                raise ValidationError(f"Template variables must be in 'name=value' format: {arg}")
+            variables[variable] = value
+
+        try:
+            added = corefile.add_zone_from_template(
+                template,
+                params["name"],
+                variables,
+                port=params["port"],
+                replace=params["replace"],
+                scheme=scheme
+            )
+        except ValueError as e:
+            raise ValidationError(str(e))
 
-                cmd = line.split(maxsplit=1)
-                if cmd[0] in PARSER_COMMANDS:
-                    params = Parser.parse_args(cmd[1])
-                    PARSER_COMMANDS[cmd[0]](corefile, params)
+        return Parser.return_result_if_none(added, ResultType.ADD_NO_REPLACE)
+
+    @staticmethod
+    def expand_variables(text: str, variables: Dict[str, str]) -> str:
+        """Replace ${name} in text with values of variables, unknown names
+        (i.e. template variables) are kept as is"""
+
+        if "${" not in text:
+            return text
+        return _VARIABLE_REGEX.sub(lambda m: variables.get(m.group(1), m.group(0)), text)
+
+    @staticmethod
+    def loop_values(words: List[str]) -> Iterator[str]:
+        """Yield values of a 'for' loop, 'N..M' yields integers from N to M"""
+
+        for word in words:
+            match = _RANGE_REGEX.match(word)
+            if match is None:
+                yield word
+                continue
+
+            first, last = int(match.group(1)), int(match.group(2))
+            step = 1 if first <= last else -1
+            for i in range(first, last + step, step):
+                yield str(i)
+
+    @staticmethod
+    def include_path(target: str, base: str, resources: Dict[str, str]) -> str:
+        """Return path of an included script
+
+        Args:
+            target: 'resource:<name>' or a path, relative to base if not absolute
+            base: Directory of the including script
+            resources: Paths of the resources by their names
+        """
+
+        if target.startswith(INCLUDE_RESOURCE_PREFIX):
+            name = target[len(INCLUDE_RESOURCE_PREFIX):]
+            if name not in resources:
+                raise RuntimeError(f"Unknown resource '{name}'")
+            return os.path.abspath(resources[name])
+
+        return os.path.abspath(os.path.join(base, target))
+
+    @staticmethod
+    def _loop_body(lines: Iterator[Tuple[int, str]], line_number: int) -> List[Tuple[int, str]]:
+        body = []
+        depth = 1
+        for number, line in lines:
+            keyword = line.split(maxsplit=1)[:1]
+            if keyword == [SCRIPT_FOR]:
+                depth += 1
+            elif keyword == [SCRIPT_END]:
+                depth -= 1
+                if not depth:
+                    return body
+            body.append((number, line))
+
+        raise RuntimeError(f"'{SCRIPT_FOR}' in line {line_number} has no '{SCRIPT_END}'")
+
+    @staticmethod
+    def _split_line(split: Callable[[str], _T], text: str, line_number: int) -> _T:
+        """Return split(text), reporting malformed text with the line number"""
+
+        try:
+            return split(text)
+        except ValueError as e:
+            raise RuntimeError(f"{e} in line {line_number}")
+
+    @staticmethod
+    def _expand(
+            lines: Iterable[Tuple[int, str]],
+            variables: Dict[str, str],
+            base: str,
+            resources: Dict[str, str],
+            stack: Tuple[str, ...]
+    ) -> Iterator[Union[Operation, _Include]]:
+        """Yield operations of the lines, and includes to be compiled
+        separately, expanding loops one iteration at a time"""
+
+        lines = iter(lines)
+        for line_number, line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            cmd = line.split(maxsplit=1)
+            keyword = cmd[0]
+            rest = Parser.expand_variables(cmd[1], variables) if len(cmd) > 1 else ""
+
+            if keyword == SCRIPT_SET:
+                pairs = Parser._split_line(Parser.split_args, rest, line_number)
+                variables = {**variables, **pairs}
+            elif keyword == SCRIPT_FOR:
+                body = Parser._loop_body(lines, line_number)
+                words = Parser._split_line(shlex.split, rest, line_number)
+                if len(words) < 2 or words[1] != "in":
+                    raise RuntimeError(
+                        f"Expected '{SCRIPT_FOR} <name> in <values...>' in line {line_number}"
+                    )
+                for value in Parser.loop_values(words[2:]):
+                    yield from Parser._expand(
+                        body, {**variables, words[0]: value}, base, resources, stack
+                    )
+            elif keyword == SCRIPT_END:
+                raise RuntimeError(f"'{SCRIPT_END}' without '{SCRIPT_FOR}' in line {line_number}")
+            elif keyword == SCRIPT_INCLUDE:
+                words = Parser._split_line(shlex.split, rest, line_number)
+                if len(words) != 1:
+                    raise RuntimeError(f"Expected '{SCRIPT_INCLUDE} <path>' in line {line_number}")
+
+                path = Parser.include_path(words[0], base, resources)
+                if path in stack:
+                    raise RuntimeError(f"Recursive include of {path} in line {line_number}")
+                yield _Include(path, variables, stack + (path,))
+            elif keyword in PARSER_COMMANDS:
+                params = Parser._split_line(Parser.parse_args, rest, line_number)
+                try:
+                    Parser.raise_required(params, PARSER_REQUIRED[keyword])
+                except RequiredError as e:
+                    raise RequiredError(f"{e.message} in line {line_number}")
+
+                yield Operation(line_number, keyword, params)
+            else:
+                raise RuntimeError(f"Unknown command '{keyword}' in line {line_number}")
+
+    @staticmethod
+    def _compile_include(
+            include: _Include,
+            resources: Dict[str, str]
+    ) -> Tuple[List[Operation], List[str]]:
+        """Compile an included script, runs in a worker process
+
+        Returns:
+            Returns operations of the script and paths of the scripts it
+            includes, itself first
+        """
+
+        includes = [include.path]
+        try:
+            with open(include.path, "r") as f:
+                operations = list(Parser.iter_compile(
+                    f,
+                    base=os.path.dirname(include.path),
+                    resources=resources,
+                    variables=include.variables,
+                    includes=includes,
+                    _stack=include.stack
+                ))
+        except RequiredError as e:
+            raise RequiredError(f"{e.message} of {include.path}")
+        except (RuntimeError, OSError) as e:
+            raise RuntimeError(f"{e} of {include.path}")
+
+        return operations, includes
+
+    @staticmethod
+    def iter_compile(
+            lines: Iterable[str],
+            base: str = ".",
+            resources: Optional[Dict[str, str]] = None,
+            variables: Optional[Dict[str, str]] = None,
+            workers: int = 0,
+            includes: Optional[List[str]] = None,
+            _stack: Tuple[str, ...] = ()
+    ) -> Iterator[Operation]:
+        """Compile script lines to operations, lazily
+
+        Besides commands, scripts may use:
+            set <name>=<value>...         Set variables used as ${name}
+            for <name> in <values...>     Repeat lines until 'end' for each value,
+            end                           'N..M' is a range of integers
+            include <path>                Compile another script in place, path is
+                                          'resource:<name>' or relative to the script
+
+        Lines are split, parsed and checked for required params once, so
+        applying the operations only runs the commands. Loops are expanded
+        one iteration at a time, and operations are yielded as they are
+        compiled. Included scripts see variables set before the include and
+        cannot change them, so they are independent and are compiled in a
+        process pool if workers is more than 1. Their operations are yielded
+        in script order.
+
+        Args:
+            lines: Lines of the script
+            base: Directory that included paths are relative to
+            resources: Paths of the resources by their names
+            variables: Variables defined before the first line
+            workers: Number of processes compiling included scripts
+            includes: If given, paths of included scripts are appended to it
+                once each, in the order they are first included
+            _stack: Paths of the scripts including this one
+
+        Returns:
+            Returns operations in script order
+
+        Raises:
+            RuntimeError: When a command is unknown, a loop is unterminated
+                or an include is missing or recursive
+            RequiredError: When a command misses required params
+        """
+
+        resources = {} if resources is None else resources
+        includes = [] if includes is None else includes
+        items = Parser._expand(
+            enumerate(lines, start=1), dict(variables or {}), base, resources, _stack
+        )
+
+        if workers <= 1:
+            for item in items:
+                if isinstance(item, _Include):
+                    operations, paths = Parser._compile_include(item, resources)
+                    Parser._add_includes(includes, paths)
+                    yield from operations
                 else:
-                    raise RuntimeError(f"Unknown command '{cmd[0]}' in line {line_number}")
+                    yield item
+            return
+
+        # Processes are started when the first include is submitted
+        with ProcessPoolExecutor(workers) as pool:
+            pending: Deque[Union[Operation, Future]] = deque()
+            for item in items:
+                if isinstance(item, _Include):
+                    pending.append(pool.submit(Parser._compile_include, item, resources))
+                else:
+                    pending.append(item)
+
+                # Operations after an include wait for it, up to a limit
+                while pending and (
+                        not isinstance(pending[0], Future) or len(pending) > _INCLUDE_WINDOW
+                ):
+                    yield from Parser._resolve(pending.popleft(), includes)
+
+            while pending:
+                yield from Parser._resolve(pending.popleft(), includes)
+
+    @staticmethod
+    def _resolve(item: Union[Operation, Future], includes: List[str]) -> Iterator[Operation]:
+        if isinstance(item, Future):
+            operations, paths = item.result()
+            Parser._add_includes(includes, paths)
+            yield from operations
+        else:
+            yield item
+
+    @staticmethod
+    def _add_includes(includes: List[str], paths: List[str]):
+        """Append paths not in includes yet, a script included by a loop is
+        listed once"""
+
+        for path in paths:
+            if path not in includes:
+                includes.append(path)
+
+    @staticmethod
+    def compile(lines: Iterable[str], **kwargs) -> List[Operation]:
+        """Compile script lines to a list of operations, see iter_compile"""
+
+        return list(Parser.iter_compile(lines, **kwargs))
+
+    @staticmethod
+    def compile_file(filename: str, **kwargs) -> List[Operation]:
+        """Compile a script file to a list of operations, see iter_compile"""
+
+        path = os.path.abspath(filename)
+        with open(path, "r") as f:
+            return Parser.compile(f, base=os.path.dirname(path), _stack=(path,), **kwargs)
+
+    @staticmethod
+    def apply(corefile: CoreDNSCorefile, operations: Iterable[Operation]):
+        """Apply compiled operations to corefile in order"""
+
+        for operation in operations:
+            # Commands may fill in defaults, keep the compiled params intact
+            PARSER_COMMANDS[operation.command](corefile, dict(operation.params))
+
+    @staticmethod
+    def exec(corefile: CoreDNSCorefile, filename: str, **kwargs):
+        """Compile and apply a script file, operations are applied as they
+        are compiled"""
+
+        path = os.path.abspath(filename)
+        with open(path, "r") as f:
+            Parser.apply(corefile, Parser.iter_compile(
+                f, base=os.path.dirname(path), _stack=(path,), **kwargs
+            ))
 
 
 PARSER_COMMANDS: Dict[str, Callable[[CoreDNSCorefile, Dict], str]] = {
@@ -232,6 +1165,42 @@ PARSER_COMMANDS: Dict[str, Callable[[CoreDNSCorefile, Dict], str]] = {
     "remove_property": Parser.remove_property,
     "add_plugin": Parser.add_plugin,
     "remove_plugin": Parser.remove_plugin,
+    "find_plugin": Parser.find_plugin,
     "add_zone": Parser.add_zone,
-    "remove_zone": Parser.remove_zone
+    "remove_zone": Parser.remove_zone,
+    "set_kubernetes": Parser.set_kubernetes,
+    "set_autopath": Parser.set_autopath,
+    "add_rewrite": Parser.add_rewrite,
+    "remove_rewrite": Parser.remove_rewrite,
+    "compile_rewrite": Parser.compile_rewrite,
+    "add_snippet": Parser.add_snippet,
+    "remove_snippet": Parser.remove_snippet,
+    "import_snippet": Parser.import_snippet,
+    "add_template": Parser.add_template,
+    "remove_template": Parser.remove_template,
+    "add_zone_from_template": Parser.add_zone_from_template
+}
+
+# Required params of each command, checked by the command and again when a
+# script is compiled
+PARSER_REQUIRED: Dict[str, List[str]] = {
+    "reset": [],
+    "add_property": ["name", "plugin", "zone"],
+    "remove_property": ["name", "plugin", "zone"],
+    "add_plugin": ["name", "zone"],
+    "remove_plugin": ["name", "zone"],
+    "find_plugin": ["name"],
+    "add_zone": ["name"],
+    "remove_zone": ["name"],
+    "set_kubernetes": ["zone"],
+    "set_autopath": ["zone"],
+    "add_rewrite": ["zone", "args"],
+    "remove_rewrite": ["zone", "id"],
+    "compile_rewrite": ["zone"],
+    "add_snippet": ["name"],
+    "remove_snippet": ["name"],
+    "import_snippet": ["name", "zone"],
+    "add_template": ["name"],
+    "remove_template": ["name"],
+    "add_zone_from_template": ["template", "name"]
 }
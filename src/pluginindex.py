@@ -0,0 +1,102 @@
+"""Inverted index from plugins to the zones that use them"""
+
+__all__ = [
+    "PluginIndex"
+]
+
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+
+Term = Tuple[str, ...]
+
+
+class PluginIndex:
+    """Maps plugin names, plugin names with one of their argument values, and
+    plugin names with one of their property names to keys of the zones using them
+
+    Terms of different instances of a plugin are not told apart, so zones
+    returned for several terms may only have them spread over instances.
+    """
+
+    def __init__(self):
+        # Keys are kept in dictionaries to keep the order they are indexed in
+        self._zones: Dict[Term, Dict[str, None]] = {}
+        self._terms: Dict[str, Set[Term]] = {}
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._terms
+
+    @staticmethod
+    def terms(
+            name: str,
+            args: Iterable[str] = (),
+            prop: Optional[str] = None
+    ) -> List[Term]:
+        """Return terms of a plugin named name with given args and property"""
+
+        terms = [("plugin", name)] + [("arg", name, arg) for arg in args]
+        if prop is not None:
+            terms.append(("property", name, prop))
+        return terms
+
+    def add(self, key: str, zone):
+        """Index plugins of zone, replacing its previous terms
+
+        Args:
+            key: Key of the zone
+            zone: A CoreDNSBlock
+        """
+
+        self.remove(key)
+
+        terms = set()
+        for plugin in zone.objects.values():
+            terms.update(PluginIndex.terms(plugin.name, plugin.args))
+            terms.update(("property", plugin.name, prop.name) for prop in plugin.objects.values())
+
+        for term in terms:
+            self._zones.setdefault(term, {})[key] = None
+        self._terms[key] = terms
+
+    def remove(self, key: str) -> bool:
+        """Remove terms of zone with given key
+
+        Returns:
+            Returns True if zone was indexed
+        """
+
+        terms = self._terms.pop(key, None)
+        if terms is None:
+            return False
+
+        for term in terms:
+            keys = self._zones[term]
+            del keys[key]
+            if not keys:
+                del self._zones[term]
+
+        return True
+
+    def zones(
+            self,
+            name: str,
+            args: Iterable[str] = (),
+            prop: Optional[str] = None
+    ) -> List[str]:
+        """Return keys of the zones using plugin name with all of args and prop
+
+        Only the zones having the rarest of the terms are visited.
+        """
+
+        postings = [self._zones.get(term, {}) for term in PluginIndex.terms(name, args, prop)]
+        postings.sort(key=len)
+        return [key for key in postings[0] if all(key in keys for keys in postings[1:])]
@@ -0,0 +1,169 @@
+"""Push files to the workload concurrently, skipping unchanged ones
+
+Each pushed file gets a sidecar file ('<path>.sha256') holding the SHA-256
+digest of its content, and the digest is also kept by the charm. A file is
+pushed only if either of them differs from its new content, so a workload that
+lost its files gets them again while an unchanged one is left alone.
+
+Files are pushed by a bounded thread pool, since each push is a round trip
+over the Pebble socket. Pebble writes every file to a temporary path and
+renames it in place, so a file is never seen half written. Sidecars are pushed
+only after every file is pushed, so a failed run is retried as a whole.
+"""
+
+__all__ = [
+    "DIGEST_SUFFIX",
+    "DEFAULT_WORKERS",
+    "PushResult",
+    "PushPipeline"
+]
+
+import hashlib
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Tuple
+)
+
+from ops.pebble import (
+    PathError,
+    ProtocolError
+)
+
+# Suffix of the files holding SHA-256 digest of the pushed files
+DIGEST_SUFFIX = ".sha256"
+
+DEFAULT_WORKERS = 4
+
+
+class PushResult(NamedTuple):
+    """Outcome of a file in a PushPipeline run"""
+
+    path: str
+    size: int
+    seconds: float
+    pushed: bool
+    reload: bool
+
+    def report(self) -> str:
+        if not self.pushed:
+            return f"{self.path}: not changed"
+        return f"{self.path}: {self.size} bytes in {self.seconds * 1000:.1f}ms"
+
+
+class _File(NamedTuple):
+    content: str
+    digest: str
+    reload: bool
+    kwargs: Dict[str, Any]
+
+
+class PushPipeline:
+    """Set of files pushed to a container together"""
+
+    def __init__(
+            self,
+            container,
+            digests: MutableMapping[str, str],
+            workers: int = DEFAULT_WORKERS
+    ):
+        """Create a pipeline
+
+        Args:
+            container: Workload container
+            digests: Digests of the files pushed before by their paths,
+                updated when files are pushed
+            workers: Maximum number of concurrent pushes
+        """
+
+        self.container = container
+        self.digests = digests
+        self.workers = workers
+        self._files: Dict[str, _File] = {}
+
+    def add(self, path: str, content: str, reload: bool = False, **kwargs):
+        """Add a file to be pushed
+
+        Args:
+            path: Path of the file in the container
+            content: Content of the file
+            reload: Whether CoreDNS must be restarted if the file changes
+            **kwargs: Passed to container.push, i.e. make_dirs
+        """
+
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        self._files[path] = _File(content, digest, reload, kwargs)
+
+    def _remote_digest(self, path: str) -> Optional[str]:
+        try:
+            return self.container.pull(path + DIGEST_SUFFIX).read().strip()
+        except (PathError, ProtocolError):
+            return None
+
+    def _push(self, path: str) -> Tuple[bool, float]:
+        """Push a file unless it is unchanged, runs in a worker thread"""
+
+        file = self._files[path]
+        if self.digests.get(path) == file.digest and self._remote_digest(path) == file.digest:
+            return False, 0.0
+
+        start = time.monotonic()
+        self.container.push(path, file.content, **file.kwargs)
+        return True, time.monotonic() - start
+
+    def _push_digest(self, path: str):
+        file = self._files[path]
+        self.container.push(path + DIGEST_SUFFIX, file.digest, **file.kwargs)
+
+    def run(self) -> List[PushResult]:
+        """Push changed files
+
+        Returns:
+            Returns results in the order files are added
+
+        Raises:
+            PathError: When a file cannot be pushed, digests of the files are
+                not updated
+        """
+
+        paths = list(self._files)
+        if not paths:
+            return []
+
+        with ThreadPoolExecutor(min(self.workers, len(paths))) as pool:
+            # Wait for every push before raising the first error
+            futures = [pool.submit(self._push, path) for path in paths]
+            outcomes = [future.exception() or future.result() for future in futures]
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    raise outcome
+
+            pushed = [path for path, (changed, _) in zip(paths, outcomes) if changed]
+            for future in [pool.submit(self._push_digest, path) for path in pushed]:
+                future.result()
+
+        for path in pushed:
+            self.digests[path] = self._files[path].digest
+
+        return [
+            PushResult(
+                path,
+                len(self._files[path].content.encode()),
+                seconds,
+                changed,
+                self._files[path].reload
+            ) for path, (changed, seconds) in zip(paths, outcomes)
+        ]
+
+    @staticmethod
+    def reload_required(results: List[PushResult]) -> bool:
+        """Whether a pushed file requires restarting CoreDNS"""
+
+        return any(result.pushed and result.reload for result in results)
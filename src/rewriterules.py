@@ -0,0 +1,218 @@
+"""Compile rules of CoreDNS 'rewrite' plugin
+
+CoreDNS evaluates rewrite rules one after another for each query, so the
+number of rules is the number of evaluations a query needs in the worst case.
+Compiling drops duplicate and dead rules and merges runs of exact name rules
+into a single regex rule.
+"""
+
+__all__ = [
+    "RULE_STOP",
+    "RULE_CONTINUE",
+    "NAME_MATCH_TYPES",
+    "RewriteRule",
+    "RewriteCompilation",
+    "parse_rule",
+    "compile_rules"
+]
+
+import re
+
+from typing import (
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple
+)
+
+RULE_STOP = "stop"
+RULE_CONTINUE = "continue"
+RULE_MODES = [RULE_STOP, RULE_CONTINUE]
+
+NAME_MATCH_EXACT = "exact"
+NAME_MATCH_REGEX = "regex"
+NAME_MATCH_TYPES = [NAME_MATCH_EXACT, "prefix", "suffix", "substring", NAME_MATCH_REGEX]
+
+# Maximum number of names merged in a single regex rule
+MERGE_MAX_NAMES = 256
+
+
+class RewriteRule(NamedTuple):
+    """Parsed rewrite rule
+
+    Only 'name' rules have match, source and target. Tokens following the
+    target (i.e. 'answer name ...') are kept in extra.
+    """
+
+    tokens: Tuple[str, ...]
+    mode: str
+    field: str
+    match: Optional[str] = None
+    source: Optional[str] = None
+    target: Optional[str] = None
+    extra: Tuple[str, ...] = ()
+
+    def is_exact_name(self) -> bool:
+        return self.field == "name" and self.match == NAME_MATCH_EXACT
+
+    def may_rename(self) -> bool:
+        """Whether a later rule can see a name changed by this rule"""
+
+        return self.mode == RULE_CONTINUE and self.field == "name"
+
+
+class RewriteCompilation(NamedTuple):
+    """Result of compile_rules"""
+
+    rules: List[List[str]]
+    duplicates: List[List[str]]
+    dead: List[List[str]]
+    merged: int
+    evaluations_before: int
+    evaluations_after: int
+
+    def report(self) -> str:
+        return (
+            f"Evaluations per query: {self.evaluations_before} -> {self.evaluations_after} "
+            f"(duplicates: {len(self.duplicates)}, dead: {len(self.dead)}, "
+            f"merged: {self.merged})"
+        )
+
+
+def normalize_name(name: str) -> str:
+    """Return name lowercased and fully qualified, as CoreDNS matches it"""
+
+    name = name.lower()
+    return name if name.endswith('.') else name + '.'
+
+
+def parse_rule(tokens: Sequence[str]) -> RewriteRule:
+    """Parse arguments of a 'rewrite' line
+
+    Args:
+        tokens: Arguments of the line, i.e. ['stop', 'name', 'exact', 'a.com', 'b.com']
+
+    Returns:
+        Returns parsed rule
+
+    Raises:
+        ValueError: When the rule is incomplete
+    """
+
+    tokens = tuple(tokens)
+    rest = list(tokens)
+
+    mode = RULE_STOP
+    if rest and rest[0] in RULE_MODES:
+        mode = rest.pop(0)
+
+    if not rest:
+        raise ValueError("Rewrite rule requires a field")
+
+    field = rest.pop(0)
+    if field != "name":
+        return RewriteRule(tokens, mode, field, extra=tuple(rest))
+
+    match = NAME_MATCH_EXACT
+    if rest and rest[0] in NAME_MATCH_TYPES:
+        match = rest.pop(0)
+
+    if len(rest) < 2:
+        raise ValueError("Rewrite name rule requires FROM and TO")
+
+    return RewriteRule(tokens, mode, field, match, rest[0], rest[1], tuple(rest[2:]))
+
+
+def _mergeable(rule: RewriteRule) -> bool:
+    return rule.is_exact_name() and not rule.extra and '{' not in rule.target
+
+
+def _same_run(head: RewriteRule, rule: RewriteRule) -> bool:
+    return _mergeable(rule) and rule.mode == head.mode and rule.target == head.target
+
+
+def _merge(run: List[RewriteRule]) -> List[str]:
+    names = "|".join(re.escape(normalize_name(rule.source)[:-1]) for rule in run)
+    head = run[0]
+
+    tokens = [] if head.tokens[0] not in RULE_MODES else [head.mode]
+    return tokens + [
+        "name", NAME_MATCH_REGEX, f"^({names})\\.$", head.target, "answer", "auto"
+    ]
+
+
+def compile_rules(rules: Sequence[Sequence[str]], merge: bool = True) -> RewriteCompilation:
+    """Remove duplicate and dead rules and merge exact name rules
+
+    A rule is a duplicate when an identical rule precedes it and would have
+    either stopped the query or renamed it. An exact name rule is dead when a
+    preceding 'stop' rule matches the same name. A 'continue' name rule between
+    the two may rename a query into the matched name, so it ends both checks.
+
+    Contiguous exact name rules with the same mode and target, and no extra
+    tokens, are merged into a single 'regex' rule with 'answer auto'.
+
+    Args:
+        rules: Rules in evaluation order
+        merge: Whether to merge exact name rules
+
+    Returns:
+        Returns compiled rules and statistics
+
+    Raises:
+        ValueError: When a rule is invalid
+    """
+
+    parsed = [parse_rule(rule) for rule in rules]
+
+    kept: List[RewriteRule] = []
+    duplicates: List[List[str]] = []
+    dead: List[List[str]] = []
+
+    seen = set()
+    stopped_names = set()
+    for rule in parsed:
+        if rule.tokens in seen:
+            duplicates.append(list(rule.tokens))
+            continue
+        if rule.is_exact_name() and normalize_name(rule.source) in stopped_names:
+            dead.append(list(rule.tokens))
+            continue
+
+        if rule.may_rename():
+            seen.clear()
+            stopped_names.clear()
+
+        if rule.mode == RULE_STOP or rule.is_exact_name():
+            seen.add(rule.tokens)
+        if rule.mode == RULE_STOP and rule.is_exact_name():
+            stopped_names.add(normalize_name(rule.source))
+
+        kept.append(rule)
+
+    compiled: List[List[str]] = []
+    merged = 0
+    i = 0
+    while i < len(kept):
+        rule = kept[i]
+        j = i + 1
+        if merge and _mergeable(rule):
+            while j < len(kept) and j - i < MERGE_MAX_NAMES and _same_run(rule, kept[j]):
+                j += 1
+
+        if j - i > 1:
+            compiled.append(_merge(kept[i:j]))
+            merged += j - i
+        else:
+            compiled.append(list(rule.tokens))
+        i = j
+
+    return RewriteCompilation(
+        rules=compiled,
+        duplicates=duplicates,
+        dead=dead,
+        merged=merged,
+        evaluations_before=len(parsed),
+        evaluations_after=len(compiled)
+    )
@@ -0,0 +1,859 @@
+"""Compact, versioned serialization of Corefiles and zone files
+
+Serialized data starts with a header made of MAGIC, format version and
+compression method, followed by a (possibly compressed) JSON body. Every
+string in the body is interned into a single string table and referenced by
+its index, so repeated plugin and property names are stored once.
+
+Corefile body:
+    {"s": [strings...], "z": [zone...], "n": [snippet...], "t": [template...]}
+    zone:     [key, name, port, [plugin...] | {"t": template, "p": [[var, value]...]}, scheme]
+              (scheme is omitted for 'dns', version 1 never has it. Zones
+              created from a template store only the template variables)
+    snippet:  [name, [plugin...]]
+              ("n" is omitted if there are no snippets, added in version 3)
+    template: [name, [plugin...]]
+              ("t" is omitted if there are no templates, added in version 4)
+    plugin:   [key, name, [arg...], [property...]]
+    property: [key, name, [arg...]]
+
+Corefile delta body (a corefile stored relative to another one):
+    {"s": [strings...], "z": [zone...], "r": [key...], "o": [key...], "n": [...], "t": [...]}
+    ("z" has only zones that differ, "r" has keys of zones to remove and "o"
+    has the order of zone keys if it differs. If templates differ, "f" is 1
+    and "z" has every zone)
+
+Hosts table body:
+    {"h": [[ip, [hostname...]]...]}
+
+Zone file body:
+    {"s": [strings...], "r": [[key, hostname, record_type, [arg...]]...]}
+
+Script body (operations compiled from a script file):
+    {"s": [strings...], "o": [[line, command, [param...]]...]}
+    param:    [name, 0, string] | [name, 1, [string...]] | [name, 2, value]
+              (strings are indices in "s", value is a JSON literal such as
+              an integer or boolean)
+
+Text form of the data (used for StoredState and relation data) is base64.
+
+Corefiles can be loaded lazily: zones are kept as their raw serialized entries
+until accessed, and untouched zones are written back as is when the corefile
+is serialized again. Their string table is reused, and rebuilt with only the
+strings in use once unused strings are more than STRING_TABLE_MAX_UNUSED of it.
+"""
+
+__all__ = [
+    "FORMAT_VERSION",
+    "COMPRESSION_NONE",
+    "COMPRESSION_ZLIB",
+    "COMPRESSION_LZMA",
+    "SerializationError",
+    "StringTable",
+    "LazyObjects",
+    "dumps_corefile",
+    "loads_corefile",
+    "loads_zone",
+    "dumps_corefile_delta",
+    "loads_corefile_delta",
+    "dumps_zonefile",
+    "loads_zonefile",
+    "dumps_hoststable",
+    "loads_hoststable",
+    "encode_corefile",
+    "decode_corefile",
+    "encode_corefile_delta",
+    "decode_corefile_delta",
+    "encode_zonefile",
+    "decode_zonefile",
+    "encode_hoststable",
+    "decode_hoststable",
+    "dumps_script",
+    "loads_script",
+    "encode_script",
+    "decode_script"
+]
+
+import base64
+import binascii
+import functools
+import json
+import lzma
+import zlib
+
+from collections.abc import MutableMapping
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+
+from coredns import (
+    CoreDNSObject,
+    CoreDNSBlock,
+    CoreDNSSnippet,
+    CoreDNSZoneTemplate,
+    CoreDNSTemplateZone,
+    CoreDNSCorefile,
+    CoreDNSZone,
+    CoreDNSPlugin,
+    CoreDNSPluginProperty,
+    SCHEME_DNS
+)
+from dnszonefile import (
+    CoreDNSZoneFile,
+    DNSRecord
+)
+from hoststable import HostsTable
+from parser import Operation
+
+MAGIC = b"CDF"
+FORMAT_VERSION = 4
+# Versions that can still be read
+SUPPORTED_VERSIONS = [1, 2, 3, 4]
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+_HEADER_SIZE = len(MAGIC) + 2
+
+# Share of unused strings in a string table reused from a lazily loaded
+# corefile above which the table is rebuilt with only the strings in use
+STRING_TABLE_MAX_UNUSED = 0.25
+
+# Types of script params
+_PARAM_STRING = 0
+_PARAM_LIST = 1
+_PARAM_LITERAL = 2
+
+
+class SerializationError(Exception):
+    def __init__(self, message: str = ""):
+        super(SerializationError, self).__init__(message)
+        self.message = message
+
+
+class StringTable:
+    """Interns strings and maps them to indices"""
+
+    def __init__(self, strings: Optional[List[str]] = None):
+        self.strings: List[str] = [] if strings is None else strings
+        self._indices: Dict[str, int] = {}
+        for i, s in enumerate(self.strings):
+            self._indices.setdefault(s, i)
+
+    def index(self, s: str) -> int:
+        """Return index of s, adding it to the table if required"""
+
+        i = self._indices.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.strings.append(s)
+            self._indices[s] = i
+
+        return i
+
+    def indices(self, strings: List[str]) -> List[int]:
+        return [self.index(s) for s in strings]
+
+    def get(self, i: int) -> str:
+        return self.strings[i]
+
+    def get_all(self, indices: List[int]) -> List[str]:
+        return [self.strings[i] for i in indices]
+
+
+class LazyObjects(MutableMapping):
+    """Mapping of objects that are built from raw entries only when accessed"""
+
+    def __init__(
+            self,
+            raw: Dict[str, Any],
+            loader: Callable[[Any], Any],
+            table: StringTable
+    ):
+        """Create a lazy mapping
+
+        Args:
+            raw: Raw serialized entries by their keys
+            loader: Function that builds an object from a raw entry
+            table: String table that raw entries refer to
+        """
+
+        self.table: StringTable = table
+        self._loader = loader
+        self._pending: Dict[str, Any] = dict(raw)
+        # Keeps the order of keys, values of pending keys are None
+        self._objects: Dict[str, Any] = dict.fromkeys(raw)
+        # Counts changes, so indexes of the corefile notice them
+        self.version = 0
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._pending:
+            self._objects[key] = self._loader(self._pending.pop(key))
+        return self._objects[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self._pending.pop(key, None)
+        self._objects[key] = value
+        self.version += 1
+
+    def __delitem__(self, key: str):
+        self._pending.pop(key, None)
+        del self._objects[key]
+        self.version += 1
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._objects
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._objects)
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def copy(self) -> "LazyObjects":
+        """Return a copy sharing raw entries and already built objects"""
+
+        clone = LazyObjects({}, self._loader, self.table)
+        clone._pending = dict(self._pending)
+        clone._objects = dict(self._objects)
+        return clone
+
+    def reorder(self, keys: List[str]):
+        """Order keys as given without building objects, keys must be the same"""
+
+        self._objects = {key: self._objects[key] for key in keys}
+        self.version += 1
+
+    def raw(self, key: str) -> Optional[Any]:
+        """Return raw entry of key if it is not accessed yet, None otherwise"""
+
+        return self._pending.get(key)
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._objects and key not in self._pending
+
+
+def _compress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data, 9)
+    if compression == COMPRESSION_LZMA:
+        return lzma.compress(data)
+
+    raise SerializationError(f"Unknown compression {compression}")
+
+
+def _decompress(data: bytes, compression: int) -> bytes:
+    try:
+        if compression == COMPRESSION_NONE:
+            return data
+        if compression == COMPRESSION_ZLIB:
+            return zlib.decompress(data)
+        if compression == COMPRESSION_LZMA:
+            return lzma.decompress(data)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise SerializationError(f"Corrupted data: {e}")
+
+    raise SerializationError(f"Unknown compression {compression}")
+
+
+def _pack(body: Dict[str, Any], compression: int) -> bytes:
+    data = json.dumps(body, separators=(',', ':')).encode()
+    return MAGIC + bytes([FORMAT_VERSION, compression]) + _compress(data, compression)
+
+
+def _unpack(data: bytes) -> Dict[str, Any]:
+    if len(data) < _HEADER_SIZE or not data.startswith(MAGIC):
+        raise SerializationError("Invalid header")
+
+    version = data[len(MAGIC)]
+    if version not in SUPPORTED_VERSIONS:
+        raise SerializationError(f"Unsupported format version {version}")
+
+    compression = data[len(MAGIC) + 1]
+    try:
+        body = json.loads(_decompress(data[_HEADER_SIZE:], compression))
+    except ValueError as e:
+        raise SerializationError(f"Corrupted data: {e}")
+
+    if not isinstance(body, dict):
+        raise SerializationError("Corrupted data: body is not an object")
+    return body
+
+
+def _malformed_as_error(f: Callable) -> Callable:
+    """Raise SerializationError instead of the errors f raises reading a
+    body that does not have the expected structure"""
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise SerializationError(f"Malformed data: {e!r}")
+
+    return wrapper
+
+
+def _dump_plugins(block: CoreDNSBlock, table: StringTable) -> List:
+    plugins = []
+    for plugin_key, plugin in block.objects.items():
+        properties = [
+            [table.index(prop_key), table.index(prop.name), table.indices(prop.args)]
+            for prop_key, prop in plugin.objects.items()
+        ]
+        plugins.append([
+            table.index(plugin_key),
+            table.index(plugin.name),
+            table.indices(plugin.args),
+            properties
+        ])
+
+    return plugins
+
+
+def _dump_zone(zone: CoreDNSZone, key: str, table: StringTable) -> List:
+    if isinstance(zone, CoreDNSTemplateZone) and not zone.materialized():
+        plugins = {
+            "t": table.index(zone.template.name),
+            "p": [[table.index(var), table.index(value)] for var, value in zone.params.items()]
+        }
+    else:
+        plugins = _dump_plugins(zone, table)
+
+    result = [table.index(key), table.index(zone.name), zone.port, plugins]
+    if zone.scheme != SCHEME_DNS:
+        result.append(table.index(zone.scheme))
+
+    return result
+
+
+def _dump_blocks(blocks: Dict[str, CoreDNSBlock], table: StringTable) -> List:
+    return [[table.index(name), _dump_plugins(block, table)] for name, block in blocks.items()]
+
+
+def _load_blocks(data: List, table: StringTable, cls: Callable) -> Dict[str, CoreDNSBlock]:
+    blocks = {}
+    for name, plugins in data:
+        block = cls(table.get(name), plugins={})
+        _load_plugins(block, plugins, table)
+        blocks[block.name] = block
+
+    return blocks
+
+
+def _zone_key(data: List, table: StringTable) -> str:
+    """Return key of a serialized zone, its address if it is stored under
+    the name only as older Corefiles did"""
+
+    key = table.get(data[0])
+    if CoreDNSZone.parse_address(key)[2] is not None:
+        return key
+
+    scheme = table.get(data[4]) if len(data) > 4 else SCHEME_DNS
+    return CoreDNSZone.address(table.get(data[1]), data[2], scheme)
+
+
+def _load_zone(
+        data: List,
+        table: StringTable,
+        templates: Optional[Dict[str, CoreDNSZoneTemplate]] = None
+) -> Tuple[str, CoreDNSZone]:
+    key, name, port, plugins = data[:4]
+    scheme = table.get(data[4]) if len(data) > 4 else SCHEME_DNS
+
+    if isinstance(plugins, dict):
+        template = table.get(plugins["t"])
+        if templates is None or template not in templates:
+            raise SerializationError(f"Unknown template {template}")
+
+        zone = CoreDNSTemplateZone(
+            table.get(name),
+            templates[template],
+            {table.get(var): table.get(value) for var, value in plugins["p"]},
+            port=port,
+            scheme=scheme
+        )
+        return _zone_key(data, table), zone
+
+    zone = CoreDNSZone(table.get(name), port, plugins={}, scheme=scheme)
+    _load_plugins(zone, plugins, table)
+
+    return _zone_key(data, table), zone
+
+
+def _load_plugins(block: CoreDNSBlock, plugins: List, table: StringTable):
+    for plugin_key, plugin_name, plugin_args, properties in plugins:
+        plugin = CoreDNSPlugin.create(
+            table.get(plugin_name),
+            *table.get_all(plugin_args)
+        )
+        for prop_key, prop_name, prop_args in properties:
+            prop = CoreDNSPluginProperty(table.get(prop_name), *table.get_all(prop_args))
+            prop.instance = CoreDNSObject.instance_of(table.get(prop_key), prop.name)
+            plugin.objects[table.get(prop_key)] = prop
+
+        plugin.instance = CoreDNSObject.instance_of(table.get(plugin_key), plugin.name)
+        block.objects[table.get(plugin_key)] = plugin
+
+
+def dumps_corefile(corefile: CoreDNSCorefile, compression: int = COMPRESSION_ZLIB) -> bytes:
+    """Serialize a corefile
+
+    Args:
+        corefile: Corefile to serialize
+        compression: One of COMPRESSION_NONE, COMPRESSION_ZLIB or COMPRESSION_LZMA
+
+    Returns:
+        Returns serialized corefile
+    """
+
+    table, zones = _dump_zones(corefile.objects)
+    return _pack(_corefile_body(corefile, table, zones), compression)
+
+
+def _dump_zones(objects: Dict[str, CoreDNSZone]) -> Tuple[StringTable, List]:
+    if not isinstance(objects, LazyObjects):
+        table = StringTable()
+        return table, [_dump_zone(zone, key, table) for key, zone in objects.items()]
+
+    # Keep indices of the loaded table so untouched zones are copied as is
+    table = StringTable(list(objects.table.strings))
+
+    zones = []
+    for key in objects:
+        raw = objects.raw(key)
+        zones.append(raw if raw is not None else _dump_zone(objects[key], key, table))
+
+    return table, zones
+
+
+def _corefile_body(corefile: CoreDNSCorefile, table: StringTable, zones: List) -> Dict[str, Any]:
+    body = {"s": table.strings, "z": zones}
+    if corefile.snippets:
+        body["n"] = _dump_blocks(corefile.snippets, table)
+    if corefile.templates:
+        body["t"] = _dump_blocks(corefile.templates, table)
+
+    if isinstance(corefile.objects, LazyObjects):
+        _compact_strings(body)
+
+    return body
+
+
+def _map_plugins(plugins: List, f: Callable[[int], int]) -> List:
+    return [
+        [
+            f(key),
+            f(name),
+            [f(arg) for arg in args],
+            [[f(p_key), f(p_name), [f(arg) for arg in p_args]] for p_key, p_name, p_args in props]
+        ] for key, name, args, props in plugins
+    ]
+
+
+def _map_zone(zone: List, f: Callable[[int], int]) -> List:
+    key, name, port, plugins = zone[:4]
+    if isinstance(plugins, dict):
+        plugins = {"t": f(plugins["t"]), "p": [[f(var), f(value)] for var, value in plugins["p"]]}
+    else:
+        plugins = _map_plugins(plugins, f)
+
+    return [f(key), f(name), port, plugins] + [f(scheme) for scheme in zone[4:]]
+
+
+def _map_body(body: Dict[str, Any], f: Callable[[int], int]):
+    """Replace every string index in zones, snippets and templates of body with f(index)"""
+
+    body["z"] = [_map_zone(zone, f) for zone in body["z"]]
+    for blocks in ("n", "t"):
+        if blocks in body:
+            body[blocks] = [[f(name), _map_plugins(plugins, f)] for name, plugins in body[blocks]]
+
+
+def _compact_strings(body: Dict[str, Any]):
+    """Drop unused strings from the string table of a corefile body
+
+    Untouched zones of a lazily loaded corefile keep the indices of the
+    loaded table, so strings of removed or changed zones stay in it. The
+    table is rebuilt once they are more than STRING_TABLE_MAX_UNUSED of it,
+    so stored state does not grow with every edit.
+    """
+
+    used = set()
+
+    def collect(i: int) -> int:
+        used.add(i)
+        return i
+
+    _map_body(body, collect)
+    strings = body["s"]
+    if len(strings) - len(used) <= STRING_TABLE_MAX_UNUSED * len(strings):
+        return
+
+    indices = {old: new for new, old in enumerate(sorted(used))}
+    _map_body(body, indices.__getitem__)
+    body["s"] = [strings[i] for i in sorted(used)]
+
+
+@_malformed_as_error
+def loads_corefile(data: bytes, lazy: bool = False) -> CoreDNSCorefile:
+    """Deserialize a corefile serialized by dumps_corefile
+
+    Args:
+        data: Serialized corefile
+        lazy: Whether to build zones only when they are accessed
+
+    Raises:
+        SerializationError: When data is invalid
+    """
+
+    body = _unpack(data)
+    table = StringTable(body["s"])
+
+    snippets = _load_blocks(body.get("n", []), table, CoreDNSSnippet)
+    templates = _load_blocks(body.get("t", []), table, CoreDNSZoneTemplate)
+
+    if lazy:
+        zones = LazyObjects(
+            {_zone_key(zone, table): zone for zone in body["z"]},
+            _malformed_as_error(lambda zone: _load_zone(zone, table, templates)[1]),
+            table
+        )
+    else:
+        zones = dict(_load_zone(zone, table, templates) for zone in body["z"])
+
+    return CoreDNSCorefile(zones, snippets=snippets, templates=templates)
+
+
+@_malformed_as_error
+def loads_zone(data: bytes, key: str) -> Optional[CoreDNSZone]:
+    """Deserialize only a single zone of a serialized corefile
+
+    Args:
+        data: Corefile serialized by dumps_corefile
+        key: Key of the zone in the corefile
+
+    Returns:
+        Returns the zone if found, None otherwise
+    """
+
+    body = _unpack(data)
+    table = StringTable(body["s"])
+    for zone in body["z"]:
+        if key in (table.get(zone[0]), _zone_key(zone, table)):
+            templates = _load_blocks(body.get("t", []), table, CoreDNSZoneTemplate)
+            return _load_zone(zone, table, templates)[1]
+
+    return None
+
+
+def dumps_corefile_delta(
+        corefile: CoreDNSCorefile,
+        base: CoreDNSCorefile,
+        compression: int = COMPRESSION_ZLIB
+) -> bytes:
+    """Serialize a corefile as its difference from base
+
+    Only zones that differ from the zones of base are stored, so versions
+    of a corefile that differ by a few zones take little space. Snippets and
+    templates are stored in full. If templates differ, every zone is stored
+    since zones following a template cannot be shared. Zones of lazily
+    loaded corefiles are compared by their entries until they are built.
+
+    Args:
+        corefile: Corefile to serialize
+        base: Corefile that loads_corefile_delta builds corefile from
+        compression: One of COMPRESSION_NONE, COMPRESSION_ZLIB or COMPRESSION_LZMA
+
+    Returns:
+        Returns serialized delta
+    """
+
+    if corefile.templates != base.templates:
+        table, zones = _dump_zones(corefile.objects)
+        body = _corefile_body(corefile, table, zones)
+        body["f"] = 1
+        return _pack(body, compression)
+
+    added, removed, changed = _diff_zones(base.objects, corefile.objects)
+
+    table = StringTable()
+    zones = [_dump_zone(corefile.objects[key], key, table) for key in changed + added]
+    body = _corefile_body(corefile, table, zones)
+    body["r"] = table.indices(removed)
+
+    removed = set(removed)
+    keys = list(corefile.objects)
+    if [key for key in base.objects if key not in removed] + added != keys:
+        body["o"] = table.indices(keys)
+
+    return _pack(body, compression)
+
+
+def _diff_zones(
+        base: MutableMapping[str, CoreDNSZone],
+        objects: MutableMapping[str, CoreDNSZone]
+) -> Tuple[List[str], List[str], List[str]]:
+    """Compare zones like CoreDNSObject.diff, building only the zones that
+    may differ
+
+    Returns:
+        Returns (added, removed, changed) keys
+    """
+
+    added = [key for key in objects if key not in base]
+    removed = [key for key in base if key not in objects]
+    changed = [key for key in base if key in objects and not _same_zone(base, objects, key)]
+
+    return added, removed, changed
+
+
+def _same_zone(
+        base: MutableMapping[str, CoreDNSZone],
+        objects: MutableMapping[str, CoreDNSZone],
+        key: str
+) -> bool:
+    base_raw = base.raw(key) if isinstance(base, LazyObjects) else None
+    raw = objects.raw(key) if isinstance(objects, LazyObjects) else None
+    if base_raw is not None and raw is not None:
+        # Zones not built yet are compared by their entries
+        if base.table is objects.table:
+            return base_raw == raw
+        return _map_zone(base_raw, base.table.get) == _map_zone(raw, objects.table.get)
+
+    zone = objects[key]
+    return base[key] is zone or base[key] == zone
+
+
+def _base_key(corefile: CoreDNSCorefile, key: str) -> str:
+    """Return key of the zone that a delta stored before zones were keyed by
+    their addresses refers to by name"""
+
+    if key in corefile.objects or CoreDNSZone.parse_address(key)[2] is not None:
+        return key
+
+    keys = corefile.find_zones(key)
+    return keys[0] if len(keys) == 1 else key
+
+
+@_malformed_as_error
+def loads_corefile_delta(data: bytes, base: CoreDNSCorefile) -> CoreDNSCorefile:
+    """Deserialize a corefile serialized by dumps_corefile_delta
+
+    The result is a snapshot of base, so zones kept from base are shared
+    with it, and not built if base is loaded lazily.
+
+    Args:
+        data: Serialized delta
+        base: Corefile given to dumps_corefile_delta
+
+    Raises:
+        SerializationError: When data is invalid
+    """
+
+    body = _unpack(data)
+    table = StringTable(body["s"])
+
+    snippets = _load_blocks(body.get("n", []), table, CoreDNSSnippet)
+    if body.get("f"):
+        templates = _load_blocks(body.get("t", []), table, CoreDNSZoneTemplate)
+        zones = dict(_load_zone(zone, table, templates) for zone in body["z"])
+        return CoreDNSCorefile(zones, snippets=snippets, templates=templates)
+
+    corefile = base.snapshot()
+    corefile.snippets = snippets
+    for key in table.get_all(body["r"]):
+        del corefile.objects[_base_key(corefile, key)]
+    for zone in body["z"]:
+        key, zone = _load_zone(zone, table, corefile.templates)
+        corefile.objects[key] = zone
+
+    if "o" in body:
+        keys = [_base_key(corefile, key) for key in table.get_all(body["o"])]
+        if isinstance(corefile.objects, LazyObjects):
+            corefile.objects.reorder(keys)
+        else:
+            corefile.objects = {key: corefile.objects[key] for key in keys}
+
+    return corefile
+
+
+def dumps_zonefile(zonefile: CoreDNSZoneFile, compression: int = COMPRESSION_ZLIB) -> bytes:
+    """Serialize a zone file"""
+
+    table = StringTable()
+    records = [
+        [
+            table.index(key),
+            table.index(record.hostname),
+            table.index(record.record_type),
+            table.indices(record.args)
+        ] for key, record in zonefile.records.items()
+    ]
+    return _pack({"s": table.strings, "r": records}, compression)
+
+
+@_malformed_as_error
+def loads_zonefile(data: bytes) -> CoreDNSZoneFile:
+    """Deserialize a zone file serialized by dumps_zonefile"""
+
+    body = _unpack(data)
+    table = StringTable(body["s"])
+
+    zonefile = CoreDNSZoneFile()
+    for key, hostname, record_type, args in body["r"]:
+        zonefile.add_record_from_instance(
+            DNSRecord(table.get(hostname), table.get(record_type), *table.get_all(args)),
+            name=table.get(key)
+        )
+
+    return zonefile
+
+
+def dumps_hoststable(table: HostsTable, compression: int = COMPRESSION_ZLIB) -> bytes:
+    """Serialize a hosts table, storing each IP once"""
+
+    return _pack({"h": list(table.grouped())}, compression)
+
+
+@_malformed_as_error
+def loads_hoststable(data: bytes) -> HostsTable:
+    """Deserialize a hosts table serialized by dumps_hoststable"""
+
+    body = _unpack(data)
+
+    table = HostsTable()
+    # Entries are already sorted and unique
+    table.entries = [(ip, hostname) for ip, hostnames in body["h"] for hostname in hostnames]
+    return table
+
+
+def _dump_param(name: str, value: Any, table: StringTable) -> List:
+    if isinstance(value, str):
+        return [table.index(name), _PARAM_STRING, table.index(value)]
+    if isinstance(value, list):
+        return [table.index(name), _PARAM_LIST, table.indices(value)]
+    return [table.index(name), _PARAM_LITERAL, value]
+
+
+def _load_param(param: List, table: StringTable) -> Tuple[str, Any]:
+    name, kind, value = param
+    if kind == _PARAM_STRING:
+        return table.get(name), table.get(value)
+    if kind == _PARAM_LIST:
+        return table.get(name), table.get_all(value)
+    if kind == _PARAM_LITERAL:
+        return table.get(name), value
+
+    raise SerializationError(f"Unknown param type {kind}")
+
+
+def dumps_script(operations: List[Operation], compression: int = COMPRESSION_ZLIB) -> bytes:
+    """Serialize operations compiled from a script"""
+
+    table = StringTable()
+    body = [
+        [
+            operation.line,
+            table.index(operation.command),
+            [_dump_param(name, value, table) for name, value in operation.params.items()]
+        ] for operation in operations
+    ]
+    return _pack({"s": table.strings, "o": body}, compression)
+
+
+@_malformed_as_error
+def loads_script(data: bytes) -> List[Operation]:
+    """Deserialize operations serialized by dumps_script"""
+
+    body = _unpack(data)
+    table = StringTable(body["s"])
+
+    return [
+        Operation(line, table.get(command), dict(_load_param(param, table) for param in params))
+        for line, command, params in body["o"]
+    ]
+
+
+def _to_text(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _from_text(data: str) -> bytes:
+    try:
+        return base64.b64decode(data, validate=True)
+    except binascii.Error as e:
+        raise SerializationError(f"Invalid base64 data: {e}")
+
+
+def encode_corefile(corefile: CoreDNSCorefile, compression: int = COMPRESSION_ZLIB) -> str:
+    """Serialize a corefile to text"""
+
+    return _to_text(dumps_corefile(corefile, compression))
+
+
+def decode_corefile(data: str, lazy: bool = False) -> CoreDNSCorefile:
+    """Deserialize a corefile from text"""
+
+    return loads_corefile(_from_text(data), lazy=lazy)
+
+
+def encode_corefile_delta(
+        corefile: CoreDNSCorefile,
+        base: CoreDNSCorefile,
+        compression: int = COMPRESSION_ZLIB
+) -> str:
+    """Serialize a corefile as its difference from base to text"""
+
+    return _to_text(dumps_corefile_delta(corefile, base, compression))
+
+
+def decode_corefile_delta(data: str, base: CoreDNSCorefile) -> CoreDNSCorefile:
+    """Deserialize a corefile delta from text"""
+
+    return loads_corefile_delta(_from_text(data), base)
+
+
+def encode_zonefile(zonefile: CoreDNSZoneFile, compression: int = COMPRESSION_ZLIB) -> str:
+    """Serialize a zone file to text"""
+
+    return _to_text(dumps_zonefile(zonefile, compression))
+
+
+def decode_zonefile(data: str) -> CoreDNSZoneFile:
+    """Deserialize a zone file from text"""
+
+    return loads_zonefile(_from_text(data))
+
+
+def encode_hoststable(table: HostsTable, compression: int = COMPRESSION_ZLIB) -> str:
+    """Serialize a hosts table to text"""
+
+    return _to_text(dumps_hoststable(table, compression))
+
+
+def decode_hoststable(data: str) -> HostsTable:
+    """Deserialize a hosts table from text"""
+
+    return loads_hoststable(_from_text(data))
+
+
+def encode_script(operations: List[Operation], compression: int = COMPRESSION_ZLIB) -> str:
+    """Serialize compiled operations to text"""
+
+    return _to_text(dumps_script(operations, compression))
+
+
+def decode_script(data: str) -> List[Operation]:
+    """Deserialize compiled operations from text"""
+
+    return loads_script(_from_text(data))
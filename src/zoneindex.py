@@ -0,0 +1,153 @@
+"""Index of zones by name for finding the zone that serves a domain name
+
+CoreDNS routes a query to the server block whose zone is the longest suffix
+of the queried name. The index is a trie of zone names keyed by their labels
+in reverse order ('foo.example.io' is io -> example -> foo), so finding that
+zone takes O(labels) steps regardless of the number of zones.
+"""
+
+__all__ = [
+    "name_labels",
+    "ZoneIndex"
+]
+
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple
+)
+
+
+def name_labels(name: str) -> List[str]:
+    """Return labels of a domain name starting from the root
+
+    Names are case insensitive and may be fully qualified, so 'Example.IO.'
+    and 'example.io' both give ['io', 'example']. The root zone '.' has no
+    labels.
+    """
+
+    name = name.lower().rstrip('.')
+    return name.split('.')[::-1] if name else []
+
+
+class _Node:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # Keys of the zones with this name, one for each address it is served on
+        self.keys: List[str] = []
+
+
+class ZoneIndex:
+    """Trie of zone keys by zone name"""
+
+    def __init__(self, zones: Iterable[Tuple[str, str]] = ()):
+        """Create an index
+
+        Args:
+            zones: (key, name) pairs of the zones
+        """
+
+        self._root = _Node()
+        self._size = 0
+
+        for key, name in zones:
+            self.add(key, name)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _path(self, name: str) -> Iterator[_Node]:
+        """Yield root and nodes of the labels of name as long as they exist"""
+
+        node = self._root
+        yield node
+        for label in name_labels(name):
+            node = node.children.get(label)
+            if node is None:
+                return
+            yield node
+
+    def add(self, key: str, name: str):
+        """Add zone key served for name, adding the same key again does nothing"""
+
+        node = self._root
+        for label in name_labels(name):
+            node = node.children.setdefault(label, _Node())
+
+        if key not in node.keys:
+            node.keys.append(key)
+            self._size += 1
+
+    def remove(self, key: str, name: str) -> bool:
+        """Remove zone key served for name
+
+        Returns:
+            Returns True if key existed
+        """
+
+        labels = name_labels(name)
+        path = list(self._path(name))
+        if len(path) != len(labels) + 1 or key not in path[-1].keys:
+            return False
+
+        path[-1].keys.remove(key)
+        self._size -= 1
+
+        # Drop nodes that no longer lead to any zone
+        for depth in range(len(labels), 0, -1):
+            node = path[depth]
+            if node.keys or node.children:
+                break
+            del path[depth - 1].children[labels[depth - 1]]
+
+        return True
+
+    def get(self, name: str) -> List[str]:
+        """Return keys of the zones named exactly name"""
+
+        labels = name_labels(name)
+        path = list(self._path(name))
+        return list(path[-1].keys) if len(path) == len(labels) + 1 else []
+
+    def matches(self, name: str) -> List[List[str]]:
+        """Return keys of the zones that name belongs to, most specific zone first
+
+        Args:
+            name: Domain name, i.e. 'foo.bar.example.io'
+
+        Returns:
+            Returns keys grouped by zone name, i.e. keys of 'example.io' before
+            keys of '.'
+        """
+
+        return [list(node.keys) for node in self._path(name) if node.keys][::-1]
+
+    def longest_match(self, name: str) -> List[str]:
+        """Return keys of the most specific zone that name belongs to"""
+
+        result: List[str] = []
+        for node in self._path(name):
+            if node.keys:
+                result = node.keys
+        return list(result)
+
+    def subzones(self, name: str) -> List[str]:
+        """Return keys of the zones below name, not including name itself"""
+
+        labels = name_labels(name)
+        path = list(self._path(name))
+        if len(path) != len(labels) + 1:
+            return []
+
+        result = []
+        stack = list(path[-1].children.values())
+        while stack:
+            node = stack.pop()
+            result.extend(node.keys)
+            stack.extend(node.children.values())
+
+        return result
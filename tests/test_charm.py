@@ -3,14 +3,38 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
+import os
+import tempfile
 import unittest
 from unittest.mock import (
-    # Mock,
-    MagicMock
+    Mock,
+    MagicMock,
+    patch
 )
 
-from charm import CorednsK8SCharm
-from ops.model import ActiveStatus
+from charm import (
+    CorednsK8SCharm,
+    PEER_RELATION,
+    PEER_KEY_COREFILE,
+    PEER_KEY_DIGEST,
+    PEER_KEY_HOSTS
+)
+from coredns import (
+    CoreDNSPlugin,
+    PLUGIN_CACHE
+)
+from parser import Parser
+from serialization import (
+    encode_corefile,
+    decode_corefile
+)
+from ops.model import (
+    ActiveStatus,
+    BlockedStatus,
+    Container,
+    MaintenanceStatus
+)
 from ops.testing import Harness
 
 
@@ -19,6 +43,7 @@ class TestCharm(unittest.TestCase):
         self.harness = Harness(CorednsK8SCharm)
         self.addCleanup(self.harness.cleanup)
         self.harness.begin()
+        self.harness.set_can_connect("coredns", True)
         container = self.harness.model.unit.get_container("coredns")
         container.push = MagicMock()
         container.stop = MagicMock()
@@ -48,6 +73,7 @@ class TestCharm(unittest.TestCase):
                     "summary": "coredns",
                     "command": "/coredns -conf /Corefile",
                     "startup": "enabled",
+                    "environment": {"GOGC": "100"}
                 }
             },
         }
@@ -62,3 +88,554 @@ class TestCharm(unittest.TestCase):
         ).get_service("coredns")
         self.assertTrue(service.is_running())
         self.assertEqual(self.harness.model.unit.status, ActiveStatus("Pebble ready"))
+
+    def test_go_runtime_environment(self):
+        container = self.harness.model.unit.get_container("coredns")
+        push = Container.push.__get__(container)
+        push("/sys/fs/cgroup/cpu.max", "250000 100000\n", make_dirs=True)
+        push("/sys/fs/cgroup/memory.max", str(512 << 20), make_dirs=True)
+
+        self.harness.charm.on.coredns_pebble_ready.emit(container)
+        environment = container.get_plan().services["coredns"].environment
+        self.assertDictEqual(
+            dict(environment),
+            {"GOGC": "100", "GOMAXPROCS": "2", "GOMEMLIMIT": "460MiB"}
+        )
+
+        # Same limits and config, layer is not added again
+        with patch.object(container, "add_layer") as add_layer:
+            self.harness.update_config({"cache-ttl": 30})
+            add_layer.assert_not_called()
+
+        with patch.object(container, "replan") as replan:
+            self.harness.update_config({"go-max-procs": 4, "go-gc": -1})
+            replan.assert_called_once()
+        environment = container.get_plan().services["coredns"].environment
+        self.assertEqual(environment["GOMAXPROCS"], "4")
+        self.assertEqual(environment["GOGC"], "off")
+
+        # Without a memory limit, garbage collection is never turned off
+        container.remove_path("/sys/fs/cgroup/memory.max")
+        self.harness.update_config({"cache-ttl": 60})
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+        self.assertEqual(container.get_plan().services["coredns"].environment["GOGC"], "off")
+
+    def test_multisocket(self):
+        container = self.harness.model.unit.get_container("coredns")
+        push = Container.push.__get__(container)
+        push("/sys/fs/cgroup/cpu.max", "400000 100000\n", make_dirs=True)
+
+        def rendered() -> str:
+            return [
+                call.args[1] for call in container.push.call_args_list
+                if call.args[0] == "/Corefile"
+            ][-1]
+
+        # Set before the container is reachable, the count follows the limits
+        # read by pebble-ready
+        self.harness.set_can_connect("coredns", False)
+        self.harness.update_config({"multisocket-sockets": -1})
+        self.harness.set_can_connect("coredns", True)
+        self.harness.charm.on.coredns_pebble_ready.emit(container)
+        self.assertIn("\tmultisocket 4\n", rendered())
+        for corefile in (self.harness.charm.corefile, self.harness.charm.new_corefile):
+            self.assertNotIn("multisocket", corefile.objects[".:53"].objects)
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+        # Zones get it when rendered, templates and the zones following them do not
+        corefile = self.harness.charm.new_corefile
+        corefile.add_zone("example.io")
+        corefile.add_template("t", plugins={"forward": CoreDNSPlugin("forward", ".", "${up}")})
+        corefile.add_zone_from_template("t", "a.io", {"up": "10.0.0.1"})
+        self.harness.charm.new_corefile = corefile
+        event = Mock(params={})
+        self.harness.charm._on_update(event)
+        event.fail.assert_not_called()
+        self.assertEqual(rendered().count("\tmultisocket 4\n"), 3)
+        corefile = self.harness.charm.corefile
+        self.assertNotIn("multisocket", corefile.templates["t"].objects)
+        self.assertFalse(corefile.objects["a.io:53"].materialized())
+
+        # A new count is rendered again
+        self.harness.update_config({"multisocket-sockets": 2})
+        self.assertEqual(rendered().count("\tmultisocket 2\n"), 3)
+
+        # Unmanaged, a zone on the same port without the plugin would stop CoreDNS
+        self.harness.update_config({"multisocket-sockets": 0})
+        self.assertNotIn("multisocket", rendered())
+        corefile = self.harness.charm.new_corefile
+        corefile.block(".:53").add_plugin("multisocket", "2")
+        self.harness.charm.new_corefile = corefile
+        event = Mock(params={})
+        self.harness.charm._on_update(event)
+        event.fail.assert_called_once()
+
+        self.harness.update_config({"multisocket-sockets": 2048})
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+
+    def test_config_changed_cache(self):
+        corefile = self.harness.charm.corefile
+        corefile.add_zone("example.io", plugins={"cache": CoreDNSPlugin("cache", "300")})
+        self.harness.charm.corefile = corefile
+        self.harness.charm.new_corefile = corefile
+
+        self.harness.update_config({
+            "cache-success-capacity": 1000,
+            "cache-prefetch-amount": 5
+        })
+
+        expected = "\tcache {\n\t\tsuccess 1000\n\t\tprefetch 5\n\t}"
+        self.assertEqual(
+            self.harness.charm.corefile.objects[".:53"].objects["cache"].to_caddy(),
+            expected
+        )
+        self.assertEqual(
+            self.harness.charm.new_corefile.objects[".:53"].objects["cache"].to_caddy(),
+            expected
+        )
+
+        # Zones other than the default one keep their own cache
+        for corefile in (self.harness.charm.corefile, self.harness.charm.new_corefile):
+            self.assertEqual(
+                corefile.objects["example.io:53"].objects["cache"],
+                CoreDNSPlugin("cache", "300")
+            )
+
+        container = self.harness.model.unit.get_container("coredns")
+        container.push.assert_any_call("/Corefile", self.harness.charm.corefile.to_caddy())
+
+    def test_config_changed_invalid(self):
+        self.harness.update_config({"cache-ttl": -1})
+
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+        zone = self.harness.charm.corefile.objects[".:53"]
+        self.assertEqual(zone.objects["cache"], PLUGIN_CACHE)
+
+    def test_config_changed_forward(self):
+        corefile = self.harness.charm.corefile
+        corefile.add_zone("corp.example", plugins={
+            "forward": CoreDNSPlugin("forward", ".", "192.168.1.1")
+        })
+        self.harness.charm.corefile = corefile
+        self.harness.charm.new_corefile = corefile
+
+        self.harness.update_config({"cache-ttl": 30})
+        self.harness.update_config({
+            "forward-upstreams": "10.0.0.1 10.0.0.2",
+            "forward-policy": "sequential"
+        })
+
+        self.assertEqual(
+            self.harness.charm.corefile.objects[".:53"].objects["forward"].to_caddy(),
+            "\tforward . 10.0.0.1 10.0.0.2 {\n\t\tpolicy sequential\n\t}"
+        )
+        # Split DNS zones keep their own upstreams
+        self.assertEqual(
+            self.harness.charm.corefile.objects["corp.example:53"].objects["forward"],
+            CoreDNSPlugin("forward", ".", "192.168.1.1")
+        )
+
+    def test_config_changed_templates(self):
+        corefile = self.harness.charm.corefile
+        corefile.add_template("t", plugins={
+            "forward": CoreDNSPlugin("forward", ".", "${up}"),
+            "kubernetes": CoreDNSPlugin("kubernetes", "${zone}")
+        })
+        corefile.add_zone_from_template("t", "a.io", {"up": "10.0.0.1"})
+        self.harness.charm.corefile = corefile
+        self.harness.charm.new_corefile = corefile
+
+        self.harness.update_config({
+            "forward-upstreams": "10.0.0.9",
+            "kubernetes-pods": "verified"
+        })
+
+        corefile = self.harness.charm.corefile
+        self.assertEqual(corefile.templates["t"].objects["forward"].args, [".", "${up}"])
+        self.assertNotIn("pods", corefile.templates["t"].objects["kubernetes"].objects)
+        self.assertFalse(corefile.objects["a.io:53"].materialized())
+        self.assertIn("forward . 10.0.0.1", corefile.to_caddy())
+
+    def test_peer_leader_publishes(self):
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation(PEER_RELATION, "coredns-k8s")
+        self.harness.add_relation_unit(rel_id, "coredns-k8s/1")
+
+        container = self.harness.model.unit.get_container("coredns")
+        self.harness.charm.on.coredns_pebble_ready.emit(container)
+
+        data = self.harness.get_relation_data(rel_id, "coredns-k8s")
+        corefile = self.harness.charm.corefile
+        self.assertEqual(data[PEER_KEY_DIGEST], corefile.digest())
+        self.assertEqual(decode_corefile(data[PEER_KEY_COREFILE]), corefile)
+
+    def test_peer_follower_applies(self):
+        rel_id = self.harness.add_relation(PEER_RELATION, "coredns-k8s")
+        self.harness.add_relation_unit(rel_id, "coredns-k8s/1")
+
+        corefile = self.harness.charm.corefile
+        corefile.add_zone("example.io")
+        container = self.harness.model.unit.get_container("coredns")
+
+        self.harness.update_relation_data(rel_id, "coredns-k8s", {
+            PEER_KEY_COREFILE: encode_corefile(corefile),
+            PEER_KEY_DIGEST: corefile.digest()
+        })
+        self.assertEqual(self.harness.charm.corefile, corefile)
+        self.assertEqual(self.harness.charm.new_corefile, corefile)
+        container.push.assert_any_call("/Corefile", corefile.to_caddy())
+
+        # Same digest must not be applied again
+        pushes = container.push.call_count
+        self.harness.update_relation_data(rel_id, "coredns-k8s", {"other": "value"})
+        self.assertEqual(container.push.call_count, pushes)
+
+    def test_corefile_legacy_dict(self):
+        corefile = self.harness.charm.corefile
+        self.harness.charm._stored.corefile = corefile.to_dict()
+
+        self.assertEqual(self.harness.charm.corefile, corefile)
+
+    def test_config_changed_aggregate_server_blocks(self):
+        corefile = self.harness.charm.corefile
+        corefile.add_zone("example.io", plugins=dict(corefile.objects[".:53"].objects))
+        self.harness.charm.corefile = corefile
+
+        self.harness.update_config({"aggregate-server-blocks": True})
+
+        container = self.harness.model.unit.get_container("coredns")
+        container.push.assert_any_call("/Corefile", corefile.to_caddy(aggregate=True))
+        self.assertTrue(corefile.to_caddy(aggregate=True).startswith(".:53 example.io:53 {"))
+
+    def test_config_changed_extract_snippets(self):
+        corefile = self.harness.charm.corefile
+        for name in ("example.io", "example.com"):
+            corefile.add_zone(name, plugins=dict(corefile.objects[".:53"].objects))
+            corefile.objects[f"{name}:53"].add_plugin("file", f"/etc/coredns/{name}")
+        self.harness.charm.corefile = corefile
+
+        self.harness.update_config({"extract-snippets": True})
+
+        container = self.harness.model.unit.get_container("coredns")
+        rendered = corefile.to_caddy(snippets=True)
+        container.push.assert_any_call("/Corefile", rendered)
+        self.assertTrue(rendered.startswith("(chain-1) {"))
+
+    def test_compile_script(self):
+        self.harness.add_resource("script-file", "add_zone name=example.io\n")
+
+        self.harness.charm.parse_actions_file()
+        digest = self.harness.charm._stored.script_digest
+        self.assertIn("example.io:53", self.harness.charm.corefile.objects)
+
+        # Unchanged script is replayed from the compiled operations
+        with patch.object(Parser, "compile") as compile_script:
+            self.harness.charm.parse_actions_file()
+            compile_script.assert_not_called()
+        self.assertIn("example.io:53", self.harness.charm.corefile.objects)
+
+        # A new parser compiles the script again
+        with tempfile.NamedTemporaryFile("w", suffix=".py") as f, \
+                patch("charm.PARSER_SOURCE", f.name), \
+                patch.object(Parser, "compile", wraps=Parser.compile) as compile_script:
+            f.write("# upgraded\n")
+            f.flush()
+            self.harness.charm.parse_actions_file()
+            compile_script.assert_called_once()
+        self.assertNotEqual(self.harness.charm._stored.script_digest, digest)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            f.write("add_zone name=other.io\n")
+            f.flush()
+            operations = self.harness.charm._compile_script(f.name)
+        self.assertNotEqual(self.harness.charm._stored.script_digest, digest)
+        self.assertEqual(operations[0].params["name"], "other.io")
+
+    def test_resumable_script(self):
+        self.harness.add_resource(
+            "script-file",
+            "add_zone name=a.io\nadd_zone name=b.io\nadd_zone name=c.io\n"
+        )
+        self.harness.update_config({"script-time-budget": 1})
+        container = self.harness.model.unit.get_container("coredns")
+        event = Mock(workload=container)
+
+        clock = iter(range(0, 1000, 10))
+        with patch("charm.SCRIPT_CHUNK_SIZE", 1), \
+                patch("charm.time.monotonic", side_effect=lambda: next(clock)):
+            container.push.reset_mock()
+            self.harness.charm._on_coredns_pebble_ready(event)
+            event.defer.assert_called_once()
+            container.push.assert_not_called()
+            self.assertEqual(
+                self.harness.model.unit.status,
+                MaintenanceStatus("Applying script-file: 1/3 operations")
+            )
+            self.assertNotIn("a.io:53", self.harness.charm.corefile.objects)
+
+            self.harness.charm._on_coredns_pebble_ready(event)
+            self.assertEqual(self.harness.charm._stored.script_checkpoint["offset"], 2)
+
+            self.harness.charm._on_coredns_pebble_ready(event)
+            self.assertEqual(event.defer.call_count, 2)
+            container.push.assert_called()
+            self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+        self.assertEqual(dict(self.harness.charm._stored.script_checkpoint), {})
+        for key in ("a.io:53", "b.io:53", "c.io:53"):
+            self.assertIn(key, self.harness.charm.corefile.objects)
+
+        # A checkpoint over a Corefile changed since is discarded
+        clock = iter(range(0, 1000, 10))
+        with patch("charm.SCRIPT_CHUNK_SIZE", 1), \
+                patch("charm.time.monotonic", side_effect=lambda: next(clock)):
+            self.assertFalse(self.harness.charm.parse_actions_file())
+            corefile = self.harness.charm.corefile
+            corefile.add_zone("changed.io")
+            self.harness.charm.corefile = corefile
+
+            self.assertFalse(self.harness.charm.parse_actions_file())
+            self.assertEqual(self.harness.charm._stored.script_checkpoint["offset"], 1)
+            while not self.harness.charm.parse_actions_file():
+                pass
+        self.assertIn("changed.io:53", self.harness.charm.corefile.objects)
+
+    def test_script_errors(self):
+        container = self.harness.model.unit.get_container("coredns")
+        event = Mock(workload=container)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        def use_script(name: str, script: str):
+            path = os.path.join(directory.name, name)
+            with open(path, "w") as f:
+                f.write(script)
+            # Fetched resources are cached, so each script gets its own path
+            return patch.object(self.harness.model.resources, "fetch", return_value=path)
+
+        for i, script in enumerate((
+                "unknown name=x\n",
+                "for i in 1..2\n",
+                "include missing.txt\n",
+                # Fails when applied
+                "add_zone name=a.io\nadd_plugin name=log zone=missing.io\n"
+        )):
+            with use_script(f"{i}.txt", script):
+                self.harness.charm._on_coredns_pebble_ready(event)
+            event.defer.assert_not_called()
+            self.assertListEqual(list(self.harness.charm.corefile.objects), [".:53"])
+
+        # A checkpoint of a script failing after it is discarded
+        self.harness.update_config({"script-time-budget": 1})
+        clock = iter(range(0, 1000, 10))
+        with use_script("partial.txt", "add_zone name=a.io\nadd_zone name=b.io\n"
+                                       "add_plugin name=log zone=x\n"), \
+                patch("charm.SCRIPT_CHUNK_SIZE", 1), \
+                patch("charm.time.monotonic", side_effect=lambda: next(clock)):
+            self.assertFalse(self.harness.charm.parse_actions_file())
+            self.assertTrue(self.harness.charm._stored.script_checkpoint)
+            while not self.harness.charm.parse_actions_file():
+                pass
+        self.assertEqual(dict(self.harness.charm._stored.script_checkpoint), {})
+        self.assertListEqual(list(self.harness.charm.corefile.objects), [".:53"])
+
+    def test_skip_redundant_push(self):
+        container = self.harness.model.unit.get_container("coredns")
+        container.push = MagicMock(wraps=Container.push.__get__(container))
+        event = Mock(workload=container)
+
+        self.harness.charm._on_coredns_pebble_ready(event)
+        self.assertEqual(container.pull("/Corefile.sha256").read(),
+                         self.harness.charm._stored.pushed_digests["/Corefile"])
+        self.assertTrue(container.get_service("coredns").is_running())
+
+        # Same Corefile and layer, nothing is pushed or restarted
+        pushes = container.push.call_count
+        with patch.object(container, "add_layer") as add_layer:
+            self.harness.charm._on_coredns_pebble_ready(event)
+            add_layer.assert_not_called()
+        self.assertEqual(container.push.call_count, pushes)
+        container.stop.assert_not_called()
+
+        # Files lost by the workload are pushed again
+        container.remove_path("/Corefile.sha256")
+        self.harness.charm._on_coredns_pebble_ready(event)
+        self.assertEqual(container.push.call_count, pushes + 2)
+        container.stop.assert_called_once_with("coredns")
+
+    def test_compile_script_includes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            script = os.path.join(directory, "script.txt")
+            included = os.path.join(directory, "zones.txt")
+            with open(script, "w") as f:
+                f.write("include zones.txt\n")
+            with open(included, "w") as f:
+                f.write("add_zone name=a.io\n")
+
+            operations = self.harness.charm._compile_script(script)
+            self.assertListEqual(list(self.harness.charm._stored.script_includes), [included])
+            self.assertEqual(operations[0].params["name"], "a.io")
+
+            # Changing an included script compiles the script again
+            with open(included, "w") as f:
+                f.write("add_zone name=b.io\n")
+            operations = self.harness.charm._compile_script(script)
+            self.assertEqual(operations[0].params["name"], "b.io")
+
+    def test_rollback(self):
+        self.harness.update_config({"history-size": 2})
+        container = self.harness.model.unit.get_container("coredns")
+        versions = [self.harness.charm.corefile.to_caddy()]
+
+        for name in ("a.io", "b.io", "c.io"):
+            corefile = self.harness.charm.new_corefile
+            corefile.add_zone(name)
+            self.harness.charm.new_corefile = corefile
+            self.harness.charm._on_update(Mock(params={}))
+            versions.append(self.harness.charm.corefile.to_caddy())
+        self.assertEqual(len(self.harness.charm._stored.history), 2)
+
+        event = Mock(params={"steps": 3})
+        self.harness.charm._on_rollback(event)
+        event.fail.assert_called_once()
+
+        event = Mock(params={"steps": 2})
+        self.harness.charm._on_rollback(event)
+        event.set_results.assert_called_once_with({"result": "Rolled back 2 versions"})
+        self.assertEqual(self.harness.charm.corefile.to_caddy(), versions[1])
+        self.assertEqual(self.harness.charm.new_corefile, self.harness.charm.corefile)
+        container.push.assert_any_call("/Corefile", versions[1])
+        self.assertEqual(len(self.harness.charm._stored.history), 0)
+
+        # Config changed while the container is unreachable is recorded too
+        self.harness.set_can_connect("coredns", False)
+        self.harness.update_config({"forward-upstreams": "10.0.0.9"})
+        self.harness.set_can_connect("coredns", True)
+        self.assertIn("forward . 10.0.0.9", self.harness.charm.corefile.to_caddy())
+        self.assertEqual(len(self.harness.charm._stored.history), 1)
+
+        self.harness.charm._on_rollback(Mock(params={"steps": 1}))
+        self.assertEqual(self.harness.charm.corefile.to_caddy(), versions[1])
+
+    def test_print_chain_snippet(self):
+        corefile = self.harness.charm.corefile
+        log = corefile.objects[".:53"].remove_object("log")
+        corefile.add_snippet("shared", plugins={"log": log})
+        corefile.objects[".:53"].add_plugin("import", "shared")
+        self.harness.charm.corefile = corefile
+
+        event = Mock(params={"zone": ".", "current": True})
+        self.harness.charm._on_print_chain(event)
+
+        event.set_results.assert_called_once_with({
+            "chain": ".:53: errors log cache forward"
+        })
+
+    def test_route_name(self):
+        corefile = self.harness.charm.corefile
+        corefile.add_zone("example.io")
+        self.harness.charm.corefile = corefile
+
+        event = Mock(params={"name": "foo.example.io", "port": 0, "current": True})
+        self.harness.charm._on_route_name(event)
+        event.set_results.assert_called_once_with({"zone": "example.io:53", "overlapping": ".:53"})
+
+        event = Mock(params={"name": "foo.example.io", "port": 853, "current": True})
+        self.harness.charm._on_route_name(event)
+        event.fail.assert_called_once()
+
+    def test_find_plugin(self):
+        event = Mock(params={"name": "forward", "args": "", "property": "", "zone": "*",
+                             "current": True})
+        self.harness.charm._on_find_plugin(event)
+        event.set_results.assert_called_once_with({"result": ".:53"})
+
+        event = Mock(params={"name": "forward", "args": "", "property": "", "zone": "re:(",
+                             "current": True})
+        self.harness.charm._on_find_plugin(event)
+        event.fail.assert_called_once()
+
+    def test_print_chain(self):
+        event = Mock(params={"zone": ".", "current": True})
+        self.harness.charm._on_print_chain(event)
+
+        event.set_results.assert_called_once_with({
+            "chain": ".:53: errors log cache forward"
+        })
+
+    def test_set_remove_hosts(self):
+        container = self.harness.model.unit.get_container("coredns")
+        corefile = self.harness.charm.corefile.to_caddy()
+
+        event = Mock(params={
+            "table": "internal",
+            "entries": "10.0.0.1 a.example.io\n10.0.0.2 b.example.io",
+            "replace": False
+        })
+        self.harness.charm._on_set_hosts(event)
+        event.set_results.assert_called_once_with({
+            "path": "/etc/coredns/hosts/internal",
+            "added": 2,
+            "removed": 0,
+            "entries": 2
+        })
+        container.push.assert_any_call(
+            "/etc/coredns/hosts/internal",
+            "10.0.0.1 a.example.io\n10.0.0.2 b.example.io\n",
+            make_dirs=True
+        )
+
+        # Nothing changed, nothing pushed
+        pushes = container.push.call_count
+        self.harness.charm._on_set_hosts(event)
+        self.assertEqual(container.push.call_count, pushes)
+
+        event = Mock(params={"table": "internal", "entries": "10.0.0.1"})
+        self.harness.charm._on_remove_hosts(event)
+        container.push.assert_any_call(
+            "/etc/coredns/hosts/internal",
+            "10.0.0.2 b.example.io\n",
+            make_dirs=True
+        )
+        self.assertEqual(self.harness.charm.corefile.to_caddy(), corefile)
+
+        for name in ("../../Corefile", "..", ".hidden", "a/b"):
+            event = Mock(params={"table": name, "entries": "10.0.0.1 a", "replace": False})
+            self.harness.charm._on_set_hosts(event)
+            event.fail.assert_called_once()
+        self.assertListEqual(list(self.harness.charm._stored.hosts_tables), ["internal"])
+
+    def test_peer_hosts_tables(self):
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation(PEER_RELATION, "coredns-k8s")
+        self.harness.add_relation_unit(rel_id, "coredns-k8s/1")
+
+        event = Mock(params={"table": "internal", "entries": "10.0.0.1 a", "replace": False})
+        self.harness.charm._on_set_hosts(event)
+        data = self.harness.get_relation_data(rel_id, "coredns-k8s")
+        tables = json.loads(data[PEER_KEY_HOSTS])
+        self.assertListEqual(list(tables), ["internal"])
+
+        # Followers push the tables of the leader and drop the others
+        self.harness.set_leader(False)
+        container = self.harness.model.unit.get_container("coredns")
+        container.push.reset_mock()
+        self.harness.charm._stored.hosts_tables = {}
+        self.harness.update_relation_data(rel_id, "coredns-k8s", {PEER_KEY_HOSTS: ""})
+        self.harness.update_relation_data(
+            rel_id,
+            "coredns-k8s",
+            {PEER_KEY_HOSTS: json.dumps(tables)}
+        )
+        container.push.assert_any_call("/etc/coredns/hosts/internal", "10.0.0.1 a\n",
+                                       make_dirs=True)
+        self.assertEqual(dict(self.harness.charm._stored.hosts_tables), tables)
+
+        with patch.object(container, "remove_path") as remove_path:
+            self.harness.update_relation_data(
+                rel_id,
+                "coredns-k8s",
+                {PEER_KEY_HOSTS: json.dumps({})}
+            )
+            remove_path.assert_any_call("/etc/coredns/hosts/internal")
+        self.assertDictEqual(dict(self.harness.charm._stored.hosts_tables), {})
@@ -0,0 +1,198 @@
+import unittest
+
+from charmconfig import (
+    ConfigError,
+    cache_plugin,
+    forward_plugin,
+    go_runtime_environment,
+    kubernetes_config_properties,
+    multisocket_plugin
+)
+from goruntime import CgroupLimits
+from coredns import (
+    CoreDNSPlugin,
+    CoreDNSPluginProperty,
+    PLUGIN_CACHE,
+    PLUGIN_FORWARD_CLOUDFLARE
+)
+
+
+class TestCharmConfig(unittest.TestCase):
+    def setUp(self) -> None:
+        self.maxDiff = None
+
+    def test_cache_plugin_default(self):
+        self.assertEqual(cache_plugin({}), PLUGIN_CACHE)
+        self.assertEqual(cache_plugin({
+            "cache-ttl": 0,
+            "cache-success-capacity": 0,
+            "cache-prefetch-amount": 0,
+            "cache-serve-stale": False
+        }), PLUGIN_CACHE)
+
+    def test_cache_plugin(self):
+        plugin = cache_plugin({
+            "cache-ttl": 600,
+            "cache-success-capacity": 20000,
+            "cache-denial-capacity": 5000,
+            "cache-denial-min-ttl": 10,
+            "cache-prefetch-amount": 10,
+            "cache-prefetch-percentage": 20,
+            "cache-serve-stale": True,
+            "cache-serve-stale-duration": "1h"
+        })
+
+        self.assertEqual(plugin, CoreDNSPlugin("cache", "600", properties={
+            "success": CoreDNSPluginProperty("success", "20000"),
+            "denial": CoreDNSPluginProperty("denial", "5000", "1800", "10"),
+            "prefetch": CoreDNSPluginProperty("prefetch", "10", "1m", "20%"),
+            "serve_stale": CoreDNSPluginProperty("serve_stale", "1h")
+        }))
+        self.assertEqual(
+            plugin.to_caddy(),
+            "\tcache 600 {\n"
+            "\t\tsuccess 20000\n"
+            "\t\tdenial 5000 1800 10\n"
+            "\t\tprefetch 10 1m 20%\n"
+            "\t\tserve_stale 1h\n"
+            "\t}"
+        )
+
+    def test_cache_plugin_raise(self):
+        self.assertRaises(ConfigError, cache_plugin, {"cache-ttl": -1})
+        self.assertRaises(ConfigError, cache_plugin, {
+            "cache-success-ttl": 10,
+            "cache-success-min-ttl": 20
+        })
+        self.assertRaises(ConfigError, cache_plugin, {
+            "cache-prefetch-amount": 1,
+            "cache-prefetch-percentage": 101
+        })
+
+    def test_forward_plugin_default(self):
+        self.assertEqual(forward_plugin({}), PLUGIN_FORWARD_CLOUDFLARE)
+        self.assertEqual(forward_plugin({"forward-upstreams": ""}), PLUGIN_FORWARD_CLOUDFLARE)
+
+        # Changing the returned plugin must not change the module default
+        forward_plugin({}).add_property("policy", "sequential")
+        self.assertNotIn("policy", PLUGIN_FORWARD_CLOUDFLARE.objects)
+
+    def test_forward_plugin(self):
+        plugin = forward_plugin({
+            "forward-upstreams": "10.0.0.1 10.0.0.2:5353",
+            "forward-policy": "round_robin",
+            "forward-max-concurrent": 1000,
+            "forward-health-check": "5s",
+            "forward-expire": "10s",
+            "forward-prefer-udp": True
+        })
+
+        self.assertEqual(
+            plugin.to_caddy(),
+            "\tforward . 10.0.0.1 10.0.0.2:5353 {\n"
+            "\t\tpolicy round_robin\n"
+            "\t\tmax_concurrent 1000\n"
+            "\t\thealth_check 5s\n"
+            "\t\texpire 10s\n"
+            "\t\tprefer_udp\n"
+            "\t}"
+        )
+
+    def test_forward_plugin_tls(self):
+        plugin = forward_plugin({
+            "forward-from": "example.io",
+            "forward-upstreams": "tls://9.9.9.9 tls://149.112.112.112",
+            "forward-tls-servername": "dns.quad9.net"
+        })
+
+        self.assertEqual(plugin, CoreDNSPlugin(
+            "forward", "example.io", "tls://9.9.9.9", "tls://149.112.112.112",
+            properties={
+                "tls_servername": CoreDNSPluginProperty("tls_servername", "dns.quad9.net")
+            }
+        ))
+
+    def test_forward_plugin_raise(self):
+        upstreams = {"forward-upstreams": "10.0.0.1"}
+
+        self.assertRaises(ConfigError, forward_plugin, {
+            "forward-upstreams": "10.0.0.1 tls://9.9.9.9"
+        })
+        self.assertRaises(ConfigError, forward_plugin, dict(upstreams, **{
+            "forward-policy": "fastest"
+        }))
+        self.assertRaises(ConfigError, forward_plugin, dict(upstreams, **{
+            "forward-max-concurrent": -1
+        }))
+        self.assertRaises(ConfigError, forward_plugin, dict(upstreams, **{
+            "forward-force-tcp": True,
+            "forward-prefer-udp": True
+        }))
+        self.assertRaises(ConfigError, forward_plugin, dict(upstreams, **{
+            "forward-tls-servername": "dns.quad9.net"
+        }))
+
+    def test_kubernetes_config_properties(self):
+        self.assertDictEqual(kubernetes_config_properties({
+            "kubernetes-ttl": -1,
+            "kubernetes-endpoint-pod-names": False
+        }), {})
+        self.assertDictEqual(kubernetes_config_properties({
+            "kubernetes-profile": "large-cluster",
+            "kubernetes-namespaces": "default kube-system",
+            "kubernetes-ttl": 0
+        }), {
+            "pods": ["disabled"],
+            "namespaces": ["default", "kube-system"],
+            "ttl": ["0"],
+            "endpoint_pod_names": None
+        })
+
+        self.assertRaises(ConfigError, kubernetes_config_properties, {
+            "kubernetes-pods": "secure"
+        })
+
+    def test_go_runtime_environment(self):
+        limits = CgroupLimits(2.0, 1 << 30)
+        self.assertDictEqual(
+            go_runtime_environment({"go-memory-limit-percent": 75}, limits),
+            {"GOGC": "100", "GOMAXPROCS": "2", "GOMEMLIMIT": "768MiB"}
+        )
+
+        for config in ({"go-memory-limit-percent": 0}, {"go-gc": -2}, {"go-max-procs": -1}):
+            self.assertRaises(ConfigError, go_runtime_environment, config, limits)
+
+        # Garbage collection is turned off only up to a memory limit
+        self.assertRaises(ConfigError, go_runtime_environment, {"go-gc": -1}, CgroupLimits(2.0))
+        self.assertDictEqual(
+            go_runtime_environment({"go-gc": -1, "go-memory-limit": 256}, CgroupLimits(2.0)),
+            {"GOGC": "off", "GOMAXPROCS": "2", "GOMEMLIMIT": "256MiB"}
+        )
+        # Unknown limits only check the options
+        self.assertDictEqual(go_runtime_environment({"go-gc": -1}, None), {"GOGC": "off"})
+        self.assertRaises(ConfigError, go_runtime_environment, {"go-gc": -2}, None)
+
+    def test_multisocket_plugin(self):
+        environment = {"GOGC": "100", "GOMAXPROCS": "8"}
+        self.assertIsNone(multisocket_plugin({}, environment))
+        self.assertEqual(
+            multisocket_plugin({"multisocket-sockets": 4}, environment),
+            CoreDNSPlugin("multisocket", "4")
+        )
+        self.assertEqual(
+            multisocket_plugin({"multisocket-sockets": -1}, environment),
+            CoreDNSPlugin("multisocket", "8")
+        )
+        # CoreDNS falls back to GOMAXPROCS itself
+        self.assertEqual(
+            multisocket_plugin({"multisocket-sockets": -1}, {"GOGC": "100"}),
+            CoreDNSPlugin("multisocket")
+        )
+
+        for sockets in (-2, 1025):
+            self.assertRaises(
+                ConfigError,
+                multisocket_plugin,
+                {"multisocket-sockets": sockets},
+                environment
+            )
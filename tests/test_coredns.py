@@ -5,7 +5,14 @@ from coredns import (
     CoreDNSPluginProperty,
     CoreDNSPlugin,
     CoreDNSZone,
-    CoreDNSCorefile
+    CoreDNSCorefile,
+    CoreDNSRewritePlugin,
+    CoreDNSSnippet,
+    CoreDNSZoneTemplate,
+    CoreDNSTemplateZone,
+    SCHEME_DNS,
+    SCHEME_TLS,
+    SCHEME_GRPC
 )
 
 
@@ -629,54 +636,103 @@ class TestCoreDNS(unittest.TestCase):
         self.assertFalse(corefile3 == corefile5)
 
     def test_corefile_add_zone_from_instance_replace(self):
+        root_zone = CoreDNSZone(".")
         corefile = CoreDNSCorefile(zones={
-            ".": CoreDNSZone(".")
+            ".:53": root_zone
         })
         zone1 = CoreDNSZone(".", 69)
         zone2 = CoreDNSZone(".", 69, plugins={"plugin1": CoreDNSPlugin("plugin1")})
 
         self.assertEqual(corefile.add_object(zone1), zone1)
-        self.assertDictEqual(corefile.objects, {".": zone1})
+        self.assertDictEqual(corefile.objects, {".:53": root_zone, ".:69": zone1})
 
         self.assertEqual(corefile.add_object(zone2), zone2)
-        self.assertDictEqual(corefile.objects, {".": zone2})
+        self.assertDictEqual(corefile.objects, {".:53": root_zone, ".:69": zone2})
 
     def test_corefile_add_zone_from_instance_no_replace(self):
         root_zone = CoreDNSZone(".")
         zone1 = CoreDNSZone("example.com", 69)
         zone2 = CoreDNSZone("example.com", 69, plugins={"plugin1": CoreDNSPlugin("plugin1")})
         corefile = CoreDNSCorefile(zones={
-            ".": root_zone
+            ".:53": root_zone
         })
 
         self.assertEqual(corefile.add_object(zone1, False), zone1)
         self.assertDictEqual(corefile.objects, {
-            ".": root_zone,
-            "example.com": zone1
+            ".:53": root_zone,
+            "example.com:69": zone1
         })
 
         self.assertIsNone(corefile.add_object(zone2, False))
         self.assertDictEqual(corefile.objects, {
-            ".": root_zone,
-            "example.com": zone1
+            ".:53": root_zone,
+            "example.com:69": zone1
         })
 
     def test_corefile_add_zone(self):
         root_zone = CoreDNSZone(".")
         corefile = CoreDNSCorefile(zones={
-            ".": root_zone
+            ".:53": root_zone
         })
         zone1 = CoreDNSZone("example.com", 69)
+        zone2 = CoreDNSZone("example.com", 853, scheme=SCHEME_TLS)
 
         self.assertEqual(
             corefile.add_zone("example.com", 69),
             zone1
         )
+        self.assertEqual(
+            corefile.add_zone("example.com", 853, scheme=SCHEME_TLS),
+            zone2
+        )
         self.assertDictEqual(corefile.objects, {
-            ".": root_zone,
-            "example.com": zone1
+            ".:53": root_zone,
+            "example.com:69": zone1,
+            "tls://example.com:853": zone2
+        })
+
+    def test_corefile_find_zones(self):
+        corefile = CoreDNSCorefile(zones={
+            ".": CoreDNSZone("."),
+            "example.com:53": CoreDNSZone("example.com"),
+            "tls://example.com:853": CoreDNSZone("example.com", 853, scheme=SCHEME_TLS),
+            "example.io:69": CoreDNSZone("example.io", 69)
         })
 
+        self.assertListEqual(corefile.find_zones("."), ["."])
+        self.assertListEqual(corefile.find_zones(".", port=53), ["."])
+        self.assertListEqual(corefile.find_zones("example.io"), ["example.io:69"])
+        self.assertListEqual(corefile.find_zones("example.io:69"), ["example.io:69"])
+        self.assertListEqual(
+            corefile.find_zones("example.com"),
+            ["example.com:53", "tls://example.com:853"]
+        )
+        self.assertListEqual(corefile.find_zones("example.com", port=53), ["example.com:53"])
+        self.assertListEqual(
+            corefile.find_zones("example.com", scheme=SCHEME_TLS),
+            ["tls://example.com:853"]
+        )
+        self.assertListEqual(
+            corefile.find_zones("tls://example.com:853"),
+            ["tls://example.com:853"]
+        )
+        self.assertListEqual(corefile.find_zones("example.org"), [])
+
+    def test_zone_scheme(self):
+        zone1 = CoreDNSZone("example.com", 853, scheme=SCHEME_TLS)
+        zone2 = CoreDNSZone("example.com", 853)
+
+        self.assertEqual(zone1.key, "tls://example.com:853")
+        self.assertEqual(zone1.to_caddy(), "tls://example.com:853")
+        self.assertFalse(zone1 == zone2)
+        self.assertEqual(CoreDNSZone.from_dict(zone1.to_dict()), zone1)
+        self.assertTupleEqual(
+            CoreDNSZone.parse_address("grpc://example.com:443"),
+            (SCHEME_GRPC, "example.com", 443)
+        )
+        self.assertTupleEqual(CoreDNSZone.parse_address("."), (SCHEME_DNS, ".", None))
+        self.assertRaises(ValueError, CoreDNSZone, "example.com", 53, None, "udp")
+
     def test_corefile_remove_zone(self):
         corefile = CoreDNSCorefile(zones={
             ".": CoreDNSZone("."),
@@ -785,13 +841,551 @@ class TestCoreDNS(unittest.TestCase):
             }
         })
 
+        # Zones keyed by their names are keyed by their addresses
         self.assertEqual(corefile, CoreDNSCorefile(zones={
-            "zone1": CoreDNSZone("zone1", plugins={
+            "zone1:53": CoreDNSZone("zone1", plugins={
                 "plugin1": CoreDNSPlugin("plugin1", "arg1")
             }),
-            "zone2": CoreDNSZone("zone2", plugins={
+            "zone2:53": CoreDNSZone("zone2", plugins={
                 "plugin1": CoreDNSPlugin("plugin1", "arg1", properties={
                     "prop1": CoreDNSPluginProperty("prop1")
                 })
             })
         }))
+
+    def test_corefile_digest(self):
+        corefile1 = CoreDNSCorefile(zones={"zone1": CoreDNSZone("zone1")})
+        corefile2 = CoreDNSCorefile(zones={"zone1": CoreDNSZone("zone1")})
+
+        self.assertEqual(corefile1.digest(), corefile2.digest())
+        self.assertEqual(len(corefile1.digest()), 64)
+
+        corefile2.add_zone("zone2")
+        self.assertNotEqual(corefile1.digest(), corefile2.digest())
+
+    def test_corefile_server_blocks(self):
+        zone1 = CoreDNSZone("zone1", plugins={
+            "plugin1": CoreDNSPlugin("plugin1", "arg1"),
+            "plugin2": CoreDNSPlugin("plugin2")
+        })
+        zone2 = CoreDNSZone("zone2", plugins={
+            "plugin1": CoreDNSPlugin("plugin1", "arg1"),
+            "plugin2": CoreDNSPlugin("plugin2")
+        })
+        zone3 = CoreDNSZone("zone3", 69, plugins={
+            "plugin1": CoreDNSPlugin("plugin1", "arg1"),
+            "plugin2": CoreDNSPlugin("plugin2")
+        })
+        zone4 = CoreDNSZone("zone4", plugins={
+            "plugin2": CoreDNSPlugin("plugin2"),
+            "plugin1": CoreDNSPlugin("plugin1", "arg1")
+        })
+        corefile = CoreDNSCorefile(zones={
+            "zone1": zone1,
+            "zone2": zone2,
+            "zone3": zone3,
+            "zone4": zone4
+        })
+
+        self.assertListEqual(corefile.server_blocks(), [[zone1, zone2], [zone3], [zone4]])
+        self.assertEqual(
+            corefile.to_caddy(aggregate=True),
+            "zone1:53 zone2:53 {\n"
+            "\tplugin1 arg1\n"
+            "\tplugin2\n"
+            "}\n"
+            "\n"
+            "zone3:69 {\n"
+            "\tplugin1 arg1\n"
+            "\tplugin2\n"
+            "}\n"
+            "\n"
+            "zone4:53 {\n"
+            "\tplugin2\n"
+            "\tplugin1 arg1\n"
+            "}"
+        )
+
+    def test_corefile_validate_multisocket(self):
+        corefile = CoreDNSCorefile(zones={
+            "a.com:53": CoreDNSZone("a.com", plugins={
+                "multisocket": CoreDNSPlugin("multisocket", "4")
+            }),
+            "b.com:53": CoreDNSZone("b.com", plugins={
+                "import": CoreDNSPlugin("import", "sockets")
+            }),
+            "c.com:5353": CoreDNSZone("c.com", 5353)
+        }, snippets={
+            "sockets": CoreDNSSnippet("sockets", plugins={
+                "multisocket": CoreDNSPlugin("multisocket", "4")
+            })
+        })
+        self.assertIsNone(corefile.validate_multisocket())
+
+        corefile.block("(sockets)").add_plugin("multisocket", "8", replace=True)
+        self.assertEqual(
+            corefile.validate_multisocket(),
+            "zones a.com:53 and b.com:53 share port 53 but use 'multisocket 4' and "
+            "'multisocket 8'"
+        )
+
+        corefile.block("b.com:53").remove_object("import")
+        self.assertIn("no multisocket", corefile.validate_multisocket())
+
+        corefile.block("b.com:53").add_plugin("multisocket", "4")
+        corefile.block("b.com:53").add_plugin("import", "sockets")
+        self.assertIn("more than one", corefile.validate_multisocket())
+
+    def test_zone_chain(self):
+        zone = CoreDNSZone("zone", plugins={
+            "forward": CoreDNSPlugin("forward", ".", "1.1.1.1"),
+            "plugin1": CoreDNSPlugin("plugin1"),
+            "log": CoreDNSPlugin("log"),
+            "cache": CoreDNSPlugin("cache"),
+            "errors": CoreDNSPlugin("errors")
+        })
+
+        self.assertListEqual(
+            [plugin.name for plugin in zone.chain()],
+            ["errors", "log", "cache", "forward", "plugin1"]
+        )
+        self.assertEqual(
+            zone.to_caddy(),
+            "zone:53 {\n"
+            "\terrors\n"
+            "\tlog\n"
+            "\tcache\n"
+            "\tforward . 1.1.1.1\n"
+            "\tplugin1\n"
+            "}"
+        )
+
+        # Re-adding a plugin does not change rendered Corefile
+        before = CoreDNSCorefile(zones={"zone:53": zone}).digest()
+        zone.add_object(zone.remove_object("log"))
+        self.assertListEqual(list(zone.objects)[-1:], ["log"])
+        self.assertEqual(CoreDNSCorefile(zones={"zone:53": zone}).digest(), before)
+
+    def test_zone_autopath(self):
+        zone = CoreDNSZone(".")
+        self.assertRaises(ValueError, zone.set_autopath, True)
+
+        zone.add_plugin("kubernetes", "cluster.local", properties={
+            "pods": CoreDNSPluginProperty("pods", "insecure")
+        })
+        self.assertEqual(
+            zone.set_autopath(True, "cluster.local"),
+            CoreDNSPlugin("autopath", "cluster.local", "@kubernetes")
+        )
+        self.assertEqual(zone.objects["kubernetes"].objects["pods"].args, ["verified"])
+        self.assertIsNone(zone.validate_autopath())
+        self.assertListEqual(
+            [plugin.name for plugin in zone.chain()],
+            ["autopath", "kubernetes"]
+        )
+
+        zone.objects["kubernetes"].add_property("pods", "disabled")
+        self.assertIsNotNone(zone.validate_autopath())
+
+        self.assertIsNone(zone.set_autopath(False))
+        self.assertNotIn("autopath", zone.objects)
+        self.assertIsNone(zone.validate_autopath())
+
+    def test_rewrite_plugin(self):
+        zone = CoreDNSZone(".")
+        plugin = zone.add_plugin("rewrite", "name", "a.com", "b.com")
+        self.assertIsInstance(plugin, CoreDNSRewritePlugin)
+
+        plugin.add_rule("name", "c.com", "d.com")
+        plugin.add_rule("type", "ANY", "HINFO", before="2")
+        self.assertListEqual(list(plugin.objects), ["1", "3", "2"])
+        self.assertEqual(
+            zone.to_caddy(".:53"),
+            ".:53 {\n"
+            "\trewrite name a.com b.com\n"
+            "\trewrite type ANY HINFO\n"
+            "\trewrite name c.com d.com\n"
+            "}"
+        )
+        self.assertRaises(KeyError, plugin.add_rule, "type", "A", "AAAA", before="9")
+
+        # Rule ids do not affect aggregation
+        other = CoreDNSRewritePlugin()
+        other.set_rules(plugin.rules())
+        self.assertListEqual(list(other.objects), ["1", "2", "3"])
+        self.assertEqual(other.structure(), plugin.structure())
+
+        restored = CoreDNSZone.from_dict(zone.to_dict())
+        self.assertIsInstance(restored.objects["rewrite"], CoreDNSRewritePlugin)
+        self.assertEqual(restored.to_caddy(".:53"), zone.to_caddy(".:53"))
+
+    def test_multiple_instances(self):
+        zone = CoreDNSZone(".")
+        first = zone.add_plugin("forward", ".", "10.0.0.1")
+        second = zone.add_plugin("forward", ".", "10.0.0.2", multiple=True)
+        third = zone.add_plugin("forward", ".", "10.0.0.3", multiple=True)
+        zone.add_plugin("log")
+
+        self.assertEqual(first.key, "forward")
+        self.assertEqual(second.key, "forward:2")
+        self.assertEqual(third.key, "forward:3")
+        self.assertListEqual(zone.instances("forward"), ["forward", "forward:2", "forward:3"])
+
+        # Removing an instance keeps ids of the others
+        zone.remove_object("forward:2")
+        self.assertListEqual(zone.instances("forward"), ["forward", "forward:3"])
+        self.assertEqual(zone.add_plugin("forward", "example.com", multiple=True).key, "forward:4")
+
+        # Replacing without multiple only replaces the first instance
+        zone.add_plugin("forward", ".", "10.0.0.9", replace=True)
+        self.assertEqual(zone.objects["forward"].args, [".", "10.0.0.9"])
+
+        self.assertEqual(
+            zone.to_caddy(".:53"),
+            ".:53 {\n"
+            "\tlog\n"
+            "\tforward . 10.0.0.9\n"
+            "\tforward . 10.0.0.3\n"
+            "\tforward example.com\n"
+            "}"
+        )
+
+        # Index is built again when objects are changed directly
+        zone.objects = dict(zone.objects)
+        del zone.objects["forward"]
+        self.assertListEqual(zone.instances("forward"), ["forward:3", "forward:4"])
+        changed = zone.copy()
+        self.assertListEqual(changed.instances("forward"), ["forward:3", "forward:4"])
+        changed.objects.pop("forward:3")
+        changed.objects["forward:5"] = CoreDNSPlugin("forward", ".", "10.0.0.5")
+        self.assertListEqual(changed.instances("forward"), ["forward:4", "forward:5"])
+
+        plugin = CoreDNSPlugin("acl")
+        plugin.add_property("allow", "net", "10.0.0.0/8")
+        plugin.add_property("allow", "net", "192.168.0.0/16", multiple=True)
+        self.assertListEqual(list(plugin.objects), ["allow", "allow:2"])
+
+        restored = CoreDNSZone.from_dict(zone.to_dict())
+        self.assertEqual(restored, zone)
+        self.assertEqual(restored.objects["forward:3"].key, "forward:3")
+
+    def test_diff(self):
+        old = CoreDNSZone(".", plugins={
+            "log": CoreDNSPlugin("log"),
+            "forward": CoreDNSPlugin("forward", ".", "10.0.0.1")
+        })
+        new = CoreDNSZone.from_dict(old.to_dict())
+        new.add_plugin("forward", ".", "10.0.0.2", multiple=True)
+        new.add_plugin("log", "stdout", replace=True)
+        new.remove_object("forward")
+
+        self.assertTupleEqual(old.diff(new), (["forward:2"], ["forward"], ["log"]))
+        self.assertTupleEqual(old.diff(old), ([], [], []))
+
+    def test_snippets(self):
+        corefile = CoreDNSCorefile(zones={
+            "a.com:53": CoreDNSZone("a.com", plugins={"file": CoreDNSPlugin("file", "a.db")})
+        })
+        snippet = corefile.add_snippet("shared", plugins={
+            "log": CoreDNSPlugin("log"),
+            "errors": CoreDNSPlugin("errors")
+        })
+        self.assertIsNone(corefile.add_snippet("shared", replace=False))
+        self.assertIs(corefile.block("(shared)"), snippet)
+        self.assertIs(corefile.block("a.com:53"), corefile.objects["a.com:53"])
+
+        corefile.objects["a.com:53"].add_plugin("import", "shared")
+        self.assertListEqual(corefile.importers("shared"), ["a.com:53"])
+        self.assertListEqual(
+            [plugin.name for plugin in corefile.chain("a.com:53")],
+            ["errors", "log", "file"]
+        )
+        self.assertEqual(
+            corefile.to_caddy(),
+            "(shared) {\n"
+            "\terrors\n"
+            "\tlog\n"
+            "}\n"
+            "\n"
+            "a.com:53 {\n"
+            "\timport shared\n"
+            "\tfile a.db\n"
+            "}"
+        )
+        self.assertEqual(CoreDNSCorefile.from_dict(corefile.to_dict()), corefile)
+        self.assertEqual(CoreDNSSnippet("empty").to_caddy(), "(empty) {\n}")
+
+        corefile.remove_snippet("shared")
+        self.assertDictEqual(corefile.snippets, {})
+        self.assertListEqual(list(corefile.objects["a.com:53"].objects), ["file", "log", "errors"])
+
+        corefile.add_snippet("shared", plugins={"log": CoreDNSPlugin("log")})
+        corefile.objects["a.com:53"].add_plugin("import", "shared")
+        corefile.remove_snippet("shared", inline=False)
+        self.assertListEqual(list(corefile.objects["a.com:53"].objects), ["file", "log", "errors"])
+
+    def test_extract_snippets(self):
+        shared = {
+            "errors": CoreDNSPlugin("errors"),
+            "cache": CoreDNSPlugin("cache", "30"),
+            "forward": CoreDNSPlugin("forward", ".", "10.0.0.1", "10.0.0.2")
+        }
+        corefile = CoreDNSCorefile(zones={
+            f"{name}:53": CoreDNSZone(name, plugins=dict(shared, file=CoreDNSPlugin("file", name)))
+            for name in ("a.com", "b.com", "c.com")
+        })
+        corefile.objects["c.com:53"].add_plugin("log")
+
+        rendered = corefile.to_caddy(snippets=True)
+        self.assertEqual(
+            rendered,
+            "(chain-1) {\n"
+            "\terrors\n"
+            "\tcache 30\n"
+            "\tforward . 10.0.0.1 10.0.0.2\n"
+            "}\n"
+            "\n"
+            "a.com:53 {\n"
+            "\timport chain-1\n"
+            "\tfile a.com\n"
+            "}\n"
+            "\n"
+            "b.com:53 {\n"
+            "\timport chain-1\n"
+            "\tfile b.com\n"
+            "}\n"
+            "\n"
+            "c.com:53 {\n"
+            "\timport chain-1\n"
+            "\tlog\n"
+            "\tfile c.com\n"
+            "}"
+        )
+        self.assertLess(len(rendered), len(corefile.to_caddy()))
+
+        # Model is not changed by rendering
+        self.assertListEqual(
+            list(corefile.objects["a.com:53"].objects),
+            ["errors", "cache", "forward", "file"]
+        )
+        self.assertDictEqual(corefile.snippets, {})
+
+        # Sharing a short plugin does not pay off
+        small = CoreDNSCorefile(zones={
+            "a.com:53": CoreDNSZone("a.com", plugins={"log": CoreDNSPlugin("log")}),
+            "b.com:53": CoreDNSZone("b.com", plugins={"log": CoreDNSPlugin("log")})
+        })
+        self.assertEqual(small.to_caddy(snippets=True), small.to_caddy())
+
+    def test_zone_templates(self):
+        corefile = CoreDNSCorefile(zones={".:53": CoreDNSZone(".")})
+        template = corefile.add_template("tenant", plugins={
+            "file": CoreDNSPlugin("file", "/etc/coredns/${zone}.db"),
+            "forward": CoreDNSPlugin("forward", ".", "${upstream}", properties={
+                "tls_servername": CoreDNSPluginProperty("tls_servername", "dns.${zone}")
+            }),
+            "rewrite": CoreDNSPlugin.create("rewrite", "name", "regex", "^(.*)$", "{1}.svc")
+        })
+        self.assertListEqual(template.variables(), ["upstream", "zone"])
+        self.assertIsNone(corefile.add_template("tenant", replace=False))
+
+        self.assertRaises(ValueError, corefile.add_zone_from_template, "tenant", "a.com", {})
+        self.assertRaises(KeyError, corefile.add_zone_from_template, "missing", "a.com", {})
+
+        zone = corefile.add_zone_from_template("tenant", "a.com", {"upstream": "10.0.0.1"})
+        self.assertIsInstance(zone, CoreDNSTemplateZone)
+        self.assertEqual(zone.key, "a.com:53")
+        self.assertEqual(
+            zone.to_caddy(),
+            "a.com:53 {\n"
+            "\trewrite name regex ^(.*)$ {1}.svc\n"
+            "\tfile /etc/coredns/a.com.db\n"
+            "\tforward . 10.0.0.1 {\n"
+            "\t\ttls_servername dns.a.com\n"
+            "\t}\n"
+            "}"
+        )
+
+        # Reading does not copy plugins, so template changes apply
+        self.assertFalse(zone.materialized())
+        template.add_plugin("log")
+        self.assertIn("log", zone.objects)
+        self.assertFalse(zone.materialized())
+        self.assertDictEqual(zone.to_dict()["params"], {"upstream": "10.0.0.1"})
+
+        # Changing the zone copies plugins and detaches it from the template
+        zone.add_plugin("errors")
+        self.assertTrue(zone.materialized())
+        template.remove_object("log")
+        self.assertIn("log", zone.objects)
+        self.assertNotIn("template", zone.to_dict())
+
+        other = corefile.add_zone_from_template("tenant", "b.com", {"upstream": "10.0.0.2"})
+        self.assertFalse(corefile.block("b.com:53", edit=False).materialized())
+        self.assertIs(corefile.block("<tenant>"), template)
+
+        restored = CoreDNSCorefile.from_dict(corefile.to_dict())
+        self.assertEqual(restored, corefile)
+        self.assertFalse(restored.objects["b.com:53"].materialized())
+        self.assertIsInstance(restored.objects["a.com:53"], CoreDNSZone)
+
+        corefile.remove_template("tenant")
+        self.assertDictEqual(corefile.templates, {})
+        self.assertTrue(other.materialized())
+        self.assertEqual(other.objects["forward"].args, [".", "10.0.0.2"])
+
+        self.assertEqual(
+            CoreDNSZoneTemplate("t", plugins={"log": CoreDNSPlugin("log", "${a}")}).expand(
+                {"a": "stdout"}
+            )["log"].args,
+            ["stdout"]
+        )
+
+    def test_snapshot(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={
+                "log": CoreDNSPlugin("log"),
+                "kubernetes": CoreDNSPlugin("kubernetes", "cluster.local", properties={
+                    "pods": CoreDNSPluginProperty("pods", "insecure")
+                })
+            }),
+            "a.com:53": CoreDNSZone("a.com", plugins={"errors": CoreDNSPlugin("errors")})
+        })
+        corefile.add_snippet("shared", plugins={"log": CoreDNSPlugin("log")})
+        template = corefile.add_template("tenant", plugins={
+            "forward": CoreDNSPlugin("forward", ".", "${upstream}")
+        })
+        corefile.add_zone_from_template("tenant", "t.com", {"upstream": "10.0.0.1"})
+        rendered = corefile.to_caddy()
+
+        snapshot = corefile.snapshot()
+        self.assertEqual(snapshot, corefile)
+        for key in corefile.objects:
+            self.assertIs(snapshot.objects[key], corefile.objects[key])
+
+        # Only the zone and the plugin on the path to the change are copied
+        snapshot.block(".:53").edit("kubernetes").add_property("pods", "verified")
+        self.assertIsNot(snapshot.objects[".:53"], corefile.objects[".:53"])
+        self.assertIs(
+            snapshot.objects[".:53"].objects["log"],
+            corefile.objects[".:53"].objects["log"]
+        )
+        self.assertIs(snapshot.objects["a.com:53"], corefile.objects["a.com:53"])
+        self.assertEqual(corefile.to_caddy(), rendered)
+
+        # Copies are made once
+        zone = snapshot.block(".:53")
+        self.assertIs(snapshot.block(".:53"), zone)
+        self.assertIs(zone.edit("kubernetes"), zone.edit("kubernetes"))
+
+        snapshot.block(".:53").set_autopath(False)
+        snapshot.block("(shared)").add_plugin("errors")
+        snapshot.block("<tenant>").add_plugin("cache")
+        snapshot.remove_object("a.com:53")
+        self.assertEqual(corefile.to_caddy(), rendered)
+        self.assertIn("cache", snapshot.objects["t.com:53"].objects)
+        self.assertFalse(snapshot.objects["t.com:53"].materialized())
+        self.assertIs(corefile.templates["tenant"], template)
+        self.assertNotIn("cache", corefile.objects["t.com:53"].objects)
+
+        # Changes to the original do not show in the snapshot either
+        corefile.block("a.com:53").add_plugin("log")
+        corefile.block("t.com:53")
+        self.assertNotIn("a.com:53", snapshot.objects)
+        self.assertFalse(snapshot.objects["t.com:53"].materialized())
+        self.assertTrue(corefile.objects["t.com:53"].materialized())
+
+        copied = CoreDNSTemplateZone("u.com", template, {"upstream": "10.0.0.2"}).copy()
+        self.assertFalse(copied.materialized())
+
+    def test_route(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone("."),
+            "example.io:53": CoreDNSZone("example.io"),
+            "tls://bar.example.io:853": CoreDNSZone("bar.example.io", 853, scheme=SCHEME_TLS)
+        })
+
+        self.assertEqual(corefile.route("foo.bar.example.io"), "tls://bar.example.io:853")
+        self.assertEqual(corefile.route("foo.bar.example.io", port=53), "example.io:53")
+        self.assertEqual(corefile.route("example.com", scheme=SCHEME_DNS), ".:53")
+        self.assertIsNone(corefile.route("example.com", port=853))
+
+        # Index follows added and removed zones
+        corefile.add_zone("bar.example.io")
+        self.assertEqual(corefile.route("foo.bar.example.io", port=53), "bar.example.io:53")
+        self.assertListEqual(corefile.overlapping("example.io:53"), [".:53", "bar.example.io:53"])
+        self.assertListEqual(corefile.overlapping("bar.example.io:53"), ["example.io:53", ".:53"])
+        corefile.remove_object("bar.example.io:53")
+        self.assertEqual(corefile.route("foo.bar.example.io", port=53), "example.io:53")
+
+        # Objects changed directly are indexed again
+        corefile.objects = {"a.io:53": CoreDNSZone("a.io")}
+        self.assertEqual(corefile.route("x.a.io"), "a.io:53")
+        self.assertIsNone(corefile.route("example.io"))
+
+        # Removing and adding a zone directly keeps the size but not the index
+        corefile.objects[".:53"] = CoreDNSZone(".")
+        self.assertEqual(corefile.route("a.nothing"), ".:53")
+        del corefile.objects[".:53"]
+        corefile.objects["zz.io:53"] = CoreDNSZone("zz.io")
+        self.assertIsNone(corefile.route("a.nothing"))
+        self.assertEqual(corefile.route("x.zz.io"), "zz.io:53")
+
+        snapshot = corefile.snapshot()
+        snapshot.add_zone("b.io")
+        self.assertIsNone(corefile.route("b.io"))
+        self.assertEqual(snapshot.route("b.io"), "b.io:53")
+
+    def test_zones_using(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone("."),
+            "example.io:53": CoreDNSZone("example.io")
+        })
+        corefile.block(".:53").add_plugin("forward", ".", "10.0.0.1")
+        corefile.block("example.io:53").add_plugin("forward", ".", "10.0.0.2")
+        corefile.block("example.io:53").add_plugin("forward", ".", "10.0.0.3", multiple=True)
+
+        self.assertListEqual(corefile.zones_using("forward"), [".:53", "example.io:53"])
+        self.assertListEqual(corefile.zones_using("forward", ["10.0.0.2"]), ["example.io:53"])
+        # Arguments spread over instances do not match
+        self.assertListEqual(corefile.zones_using("forward", ["10.0.0.2", "10.0.0.3"]), [])
+        self.assertIn(".:53", corefile.plugin_index())
+
+        # Zones returned by block are indexed again
+        corefile.block(".:53").edit("forward").add_property("max_fails", "3")
+        self.assertListEqual(corefile.zones_using("forward", prop="max_fails"), [".:53"])
+
+        corefile.add_zone("other.io")
+        corefile.block("other.io:53").add_plugin("log")
+        self.assertListEqual(corefile.zones_using("log"), ["other.io:53"])
+        corefile.remove_object("example.io:53")
+        self.assertListEqual(corefile.zones_using("forward"), [".:53"])
+
+        # Blocks are indexed again without building the whole index
+        index = corefile.plugin_index()
+        corefile.block("other.io:53").add_plugin("errors")
+        self.assertListEqual(corefile.zones_using("errors"), ["other.io:53"])
+        self.assertIs(corefile.plugin_index(), index)
+
+        # Zones replaced directly are indexed again
+        replaced = CoreDNSZone("other.io")
+        replaced.add_plugin("forward", ".", "10.0.0.4")
+        corefile.objects["other.io:53"] = replaced
+        self.assertListEqual(corefile.zones_using("forward"), [".:53", "other.io:53"])
+        self.assertListEqual(corefile.zones_using("log"), [])
+
+        # Objects changed directly are indexed again
+        corefile.objects = {"a.io:53": CoreDNSZone("a.io")}
+        self.assertListEqual(corefile.zones_using("forward"), [])
+
+        # Zones created from a template follow changes to the template
+        corefile.add_template("tenant")
+        corefile.add_zone_from_template("tenant", "b.io", {})
+        self.assertListEqual(corefile.zones_using("cache"), [])
+        corefile.block("<tenant>").add_plugin("cache", "30")
+        self.assertListEqual(corefile.zones_using("cache", ["30"]), ["b.io:53"])
+
+        snapshot = corefile.snapshot()
+        snapshot.block("a.io:53").add_plugin("cache")
+        self.assertListEqual(corefile.zones_using("cache"), ["b.io:53"])
+        self.assertListEqual(snapshot.zones_using("cache"), ["a.io:53", "b.io:53"])
@@ -0,0 +1,57 @@
+import unittest
+
+from goruntime import (
+    CGROUP_CPU_MAX,
+    CGROUP_MEMORY_MAX,
+    CGROUP_V1_CPU_PERIOD,
+    CGROUP_V1_CPU_QUOTA,
+    CGROUP_V1_MEMORY_LIMIT,
+    CgroupLimits,
+    go_environment,
+    parse_cpu_max,
+    parse_memory_max,
+    read_cgroup_limits
+)
+
+
+class TestGoRuntime(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_cpu_max("150000 100000\n"), 1.5)
+        self.assertIsNone(parse_cpu_max("max 100000"))
+        self.assertEqual(parse_cpu_max("50000", "100000"), 0.5)
+        self.assertIsNone(parse_cpu_max("-1", "100000"))
+        self.assertIsNone(parse_cpu_max(""))
+
+        self.assertEqual(parse_memory_max("1073741824\n"), 1 << 30)
+        self.assertIsNone(parse_memory_max("max"))
+        self.assertIsNone(parse_memory_max("9223372036854771712"))
+
+    def test_read_cgroup_limits(self):
+        v2 = {CGROUP_CPU_MAX: "200000 100000", CGROUP_MEMORY_MAX: "max"}
+        self.assertEqual(read_cgroup_limits(v2.get), CgroupLimits(2.0, None))
+
+        v1 = {
+            CGROUP_V1_CPU_QUOTA: "300000",
+            CGROUP_V1_CPU_PERIOD: "100000",
+            CGROUP_V1_MEMORY_LIMIT: str(256 << 20)
+        }
+        self.assertEqual(read_cgroup_limits(v1.get), CgroupLimits(3.0, 256 << 20))
+
+        self.assertEqual(read_cgroup_limits({}.get), CgroupLimits())
+        invalid = {CGROUP_CPU_MAX: "a b", CGROUP_MEMORY_MAX: "1G"}
+        self.assertEqual(read_cgroup_limits(invalid.get), CgroupLimits())
+
+    def test_go_environment(self):
+        self.assertDictEqual(go_environment(CgroupLimits()), {"GOGC": "100"})
+        self.assertDictEqual(
+            go_environment(CgroupLimits(0.5, 1 << 30), gogc=50),
+            {"GOGC": "50", "GOMAXPROCS": "1", "GOMEMLIMIT": "921MiB"}
+        )
+        self.assertDictEqual(
+            go_environment(CgroupLimits(3.9, 1 << 30), max_procs=8, memory_limit=512, gogc=-1),
+            {"GOGC": "off", "GOMAXPROCS": "8", "GOMEMLIMIT": "512MiB"}
+        )
+        self.assertEqual(
+            go_environment(CgroupLimits(3.9, 1 << 30), memory_limit_percent=50)["GOMAXPROCS"],
+            "3"
+        )
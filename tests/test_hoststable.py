@@ -0,0 +1,69 @@
+import unittest
+
+from hoststable import HostsTable
+
+
+class TestHostsTable(unittest.TestCase):
+    def test_init(self):
+        table = HostsTable([
+            ("10.0.0.2", "b.example.io"),
+            ("10.0.0.1", "a.example.io"),
+            ("10.0.0.2", "b.example.io")
+        ])
+
+        self.assertListEqual(table.entries, [
+            ("10.0.0.1", "a.example.io"),
+            ("10.0.0.2", "b.example.io")
+        ])
+        self.assertIn(("10.0.0.1", "a.example.io"), table)
+        self.assertNotIn(("10.0.0.1", "b.example.io"), table)
+        self.assertRaises(ValueError, HostsTable, [("10.0.0.256", "a.example.io")])
+
+    def test_parse(self):
+        table = HostsTable.parse(
+            "# comment\n"
+            "10.0.0.1 a.example.io a\n"
+            "\n"
+            "fd00::1 c.example.io  # trailing comment\n"
+            "10.0.0.1 a.example.io\n"
+        )
+
+        self.assertListEqual(table.entries, [
+            ("10.0.0.1", "a"),
+            ("10.0.0.1", "a.example.io"),
+            ("fd00::1", "c.example.io")
+        ])
+        self.assertEqual(table.to_hosts(), "10.0.0.1 a a.example.io\nfd00::1 c.example.io\n")
+        self.assertRaises(ValueError, HostsTable.parse, "10.0.0.1\n")
+
+    def test_add_remove(self):
+        table = HostsTable()
+
+        self.assertEqual(table.add("10.0.0.2", "b", "c"), 2)
+        self.assertEqual(table.add("10.0.0.1", "a", "b"), 2)
+        self.assertEqual(table.add("10.0.0.1", "a"), 0)
+        self.assertRaises(ValueError, table.add, "host", "a")
+        self.assertEqual(len(table), 4)
+
+        self.assertEqual(table.remove("10.0.0.2", "c", "d"), 1)
+        self.assertEqual(table.remove("10.0.0.1"), 2)
+        self.assertEqual(table.remove("10.0.0.3"), 0)
+        self.assertListEqual(table.entries, [("10.0.0.2", "b")])
+
+    def test_diff_update(self):
+        old = HostsTable.parse("10.0.0.1 a b\n10.0.0.2 c\n")
+        new = HostsTable.parse("10.0.0.1 a\n10.0.0.2 c d\n")
+
+        self.assertTupleEqual(old.diff(new), (
+            [("10.0.0.2", "d")],
+            [("10.0.0.1", "b")]
+        ))
+        self.assertTupleEqual(old.diff(old), ([], []))
+
+        self.assertEqual(old.update(new), 1)
+        self.assertEqual(old, HostsTable.parse("10.0.0.1 a b\n10.0.0.2 c d\n"))
+
+    def test_path(self):
+        self.assertEqual(HostsTable.path("internal.v2"), "/etc/coredns/hosts/internal.v2")
+        for name in ("", ".", "..", "../../Corefile", "a/b", ".hidden"):
+            self.assertRaises(ValueError, HostsTable.path, name)
@@ -0,0 +1,75 @@
+import unittest
+
+from coredns import (
+    CoreDNSPlugin,
+    CoreDNSPluginProperty
+)
+from kubernetesplugin import (
+    kubernetes_properties,
+    apply_kubernetes_properties
+)
+
+
+class TestKubernetesPlugin(unittest.TestCase):
+    def setUp(self) -> None:
+        self.maxDiff = None
+
+    def test_kubernetes_properties(self):
+        self.assertDictEqual(kubernetes_properties(), {})
+        self.assertDictEqual(
+            kubernetes_properties(
+                pods="verified",
+                namespaces=["default", "kube-system"],
+                labels="environment in (production)",
+                ttl=0,
+                endpoint_pod_names=True,
+                noendpoints=False
+            ),
+            {
+                "pods": ["verified"],
+                "namespaces": ["default", "kube-system"],
+                "labels": ["environment", "in", "(production)"],
+                "ttl": ["0"],
+                "endpoint_pod_names": [],
+                "noendpoints": None
+            }
+        )
+        self.assertDictEqual(kubernetes_properties(namespaces=[], labels=""), {
+            "namespaces": None,
+            "labels": None
+        })
+
+    def test_kubernetes_properties_profile(self):
+        self.assertDictEqual(kubernetes_properties(profile="large-cluster"), {
+            "pods": ["disabled"],
+            "ttl": ["30"],
+            "endpoint_pod_names": None
+        })
+        self.assertDictEqual(kubernetes_properties(profile="large-cluster", ttl=60), {
+            "pods": ["disabled"],
+            "ttl": ["60"],
+            "endpoint_pod_names": None
+        })
+
+    def test_kubernetes_properties_raise(self):
+        self.assertRaises(ValueError, kubernetes_properties, pods="secure")
+        self.assertRaises(ValueError, kubernetes_properties, namespaces=["Default"])
+        self.assertRaises(ValueError, kubernetes_properties, ttl=3601)
+        self.assertRaises(ValueError, kubernetes_properties, ttl=-1)
+        self.assertRaises(ValueError, kubernetes_properties, profile="huge")
+
+    def test_apply_kubernetes_properties(self):
+        plugin = CoreDNSPlugin("kubernetes", "cluster.local", properties={
+            "fallthrough": CoreDNSPluginProperty("fallthrough"),
+            "pods": CoreDNSPluginProperty("pods", "insecure"),
+            "endpoint_pod_names": CoreDNSPluginProperty("endpoint_pod_names")
+        })
+
+        properties = kubernetes_properties(profile="large-cluster")
+        self.assertTrue(apply_kubernetes_properties(plugin, properties))
+        self.assertEqual(plugin, CoreDNSPlugin("kubernetes", "cluster.local", properties={
+            "fallthrough": CoreDNSPluginProperty("fallthrough"),
+            "pods": CoreDNSPluginProperty("pods", "disabled"),
+            "ttl": CoreDNSPluginProperty("ttl", "30")
+        }))
+        self.assertFalse(apply_kubernetes_properties(plugin, properties))
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 
 from typing import (
@@ -20,7 +22,8 @@ from coredns import (
     PLUGIN_ERRORS,
     PLUGIN_CACHE,
     PLUGIN_FORWARD_CLOUDFLARE,
-    PLUGIN_LOG
+    PLUGIN_LOG,
+    SCHEME_TLS
 )
 
 
@@ -130,8 +133,13 @@ class TestParser(unittest.TestCase):
             ".": CoreDNSZone(".")
         })
 
+        corefile.add_snippet("shared")
+        corefile.add_template("tenant")
+
         Parser.reset(corefile)
         self.assertDictEqual(corefile.objects, {})
+        self.assertDictEqual(corefile.snippets, {})
+        self.assertDictEqual(corefile.templates, {})
 
     def test_return_result_if_none(self):
         self.assertEqual(
@@ -246,7 +254,7 @@ class TestParser(unittest.TestCase):
                         }
                     )
                 }),
-                "example.io": CoreDNSZone("example.io", port=69, plugins={
+                "example.io:69": CoreDNSZone("example.io", port=69, plugins={
                     "log": PLUGIN_LOG,
                     "errors": PLUGIN_ERRORS
                 })
@@ -267,3 +275,556 @@ class TestParser(unittest.TestCase):
         )
 
         self.assertRaises(RuntimeError, Parser.exec, corefile, filename)
+
+    def test_compile(self):
+        with open("tests/test_script.txt") as f:
+            operations = Parser.compile(f)
+
+        self.assertEqual(len(operations), 6)
+        self.assertEqual(operations[3].line, 6)
+        self.assertEqual(operations[3].command, "add_zone")
+        self.assertEqual(operations[3].params["port"], 69)
+
+        # Replaying operations gives the same corefile as executing the script
+        corefile = CoreDNSCorefile(zones={".": CoreDNSZone(".")})
+        expected = CoreDNSCorefile(zones={".": CoreDNSZone(".")})
+        Parser.apply(corefile, operations)
+        Parser.exec(expected, "tests/test_script.txt")
+        self.assertTrue(corefile == expected)
+        self.assertNotIn("multiple", operations[0].params)
+
+        with self.assertRaises(RequiredError) as cm:
+            Parser.compile(["reset", "", "add_plugin name=log"])
+        self.assertIn("line 3", cm.exception.message)
+        self.assertRaises(RuntimeError, Parser.compile, ["unknown name=log"])
+
+    def test_compile_variables_and_loops(self):
+        operations = Parser.compile([
+            "set upstream=10.0.0.1 port=5353",
+            "for tenant in a b",
+            "    for i in 1..2",
+            "        add_zone name=${tenant}${i}.io port=${port}",
+            "    end",
+            "    # Template variables are not known to the script and are kept",
+            '    add_plugin name=forward args=". ${upstream} ${other}" zone=${tenant}1.io',
+            "end"
+        ])
+
+        self.assertListEqual(
+            [(o.command, o.params["name"]) for o in operations],
+            [("add_zone", "a1.io"), ("add_zone", "a2.io"), ("add_plugin", "forward"),
+             ("add_zone", "b1.io"), ("add_zone", "b2.io"), ("add_plugin", "forward")]
+        )
+        self.assertEqual(operations[0].params["port"], 5353)
+        self.assertListEqual(operations[5].params["args"], [".", "10.0.0.1", "${other}"])
+        self.assertEqual(operations[5].line, 7)
+        self.assertListEqual(list(Parser.loop_values(["3..1", "x"])), ["3", "2", "1", "x"])
+
+        # Loops are expanded lazily
+        operations = Parser.iter_compile(["for i in 1..1000000000", "add_zone name=z${i}", "end"])
+        self.assertEqual(next(operations).params["name"], "z1")
+
+        for lines in (["for i in 1..2", "reset"], ["end"], ["for i 1..2", "end"]):
+            self.assertRaises(RuntimeError, Parser.compile, lines)
+
+        # Malformed params are reported with their line
+        for lines in (["reset", "set foo"], ["reset", "add_zone example.io"], ["", "set a='b"]):
+            with self.assertRaises(RuntimeError) as cm:
+                Parser.compile(lines)
+            self.assertIn("in line 2", str(cm.exception))
+
+    def test_compile_includes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(name: str, *lines: str) -> str:
+                path = os.path.join(directory, name)
+                with open(path, "w") as f:
+                    f.write("\n".join(lines))
+                return path
+
+            write("zone.txt", "add_zone name=${name}", "add_plugin name=log zone=${name}")
+            write("loop.txt", "include self.txt")
+            write("self.txt", "include loop.txt")
+            resource = write("resource.txt", "add_zone name=resource.io")
+            script = write(
+                "script.txt",
+                "for name in a.io b.io c.io",
+                "include zone.txt",
+                "end",
+                "include resource:extra",
+                "add_zone name=last.io"
+            )
+
+            expected = [
+                "a.io", "log", "b.io", "log", "c.io", "log", "resource.io", "last.io"
+            ]
+            for workers in (0, 2):
+                includes = []
+                operations = Parser.compile_file(
+                    script,
+                    resources={"extra": resource},
+                    workers=workers,
+                    includes=includes
+                )
+                self.assertListEqual([o.params["name"] for o in operations], expected)
+                # Scripts included by every iteration are listed once
+                self.assertListEqual(includes, [os.path.join(directory, "zone.txt"), resource])
+
+            with self.assertRaises(RuntimeError) as cm:
+                Parser.compile_file(write("recursive.txt", "include loop.txt"))
+            self.assertIn("Recursive include", str(cm.exception))
+            self.assertRaises(RuntimeError, Parser.compile_file, script)
+
+            corefile = CoreDNSCorefile(zones={".:53": CoreDNSZone(".")})
+            Parser.exec(corefile, write("exec.txt", "for i in 1..2", "add_zone name=z${i}", "end"))
+            self.assertListEqual(list(corefile.objects), [".:53", "z1:53", "z2:53"])
+
+    def test_add_zone_scheme(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".")
+        })
+
+        Parser.add_zone(corefile, Parser.parse_args("name=example.io"))
+        Parser.add_zone(corefile, Parser.parse_args(
+            "name=example.io scheme=tls tls_cert=cert.pem tls_key=key.pem"
+        ))
+        self.assertListEqual(
+            list(corefile.objects),
+            [".:53", "example.io:53", "tls://example.io:853"]
+        )
+        self.assertEqual(
+            corefile.objects["tls://example.io:853"].to_caddy(),
+            "tls://example.io:853 {\n\ttls cert.pem key.pem\n}"
+        )
+
+        self.assertRaises(
+            ValidationError,
+            Parser.add_zone,
+            corefile,
+            Parser.parse_args("name=example.io scheme=https")
+        )
+        self.assertRaises(
+            ValidationError,
+            Parser.add_zone,
+            corefile,
+            Parser.parse_args("name=example.io scheme=udp")
+        )
+
+        # Zone names are ambiguous when served on multiple addresses
+        self.assertRaises(
+            ValidationError,
+            Parser.add_plugin,
+            corefile,
+            Parser.parse_args("name=log zone=example.io")
+        )
+        Parser.add_plugin(corefile, Parser.parse_args("name=log zone=tls://example.io:853"))
+        self.assertIn("log", corefile.objects["tls://example.io:853"].objects)
+
+        Parser.remove_zone(corefile, Parser.parse_args("name=example.io:53"))
+        Parser.add_plugin(corefile, Parser.parse_args("name=errors zone=example.io"))
+        self.assertIn("errors", corefile.objects["tls://example.io:853"].objects)
+
+    def test_set_kubernetes(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={
+                "kubernetes": CoreDNSPlugin("kubernetes", "cluster.local", properties={
+                    "pods": CoreDNSPluginProperty("pods", "insecure")
+                }),
+                "log": PLUGIN_LOG
+            }),
+            "example.io:53": CoreDNSZone("example.io")
+        })
+
+        result = Parser.set_kubernetes(corefile, Parser.parse_args(
+            "zone=. pods=verified namespaces='default kube-system' ttl=10 noendpoints=yes"
+        ))
+        self.assertEqual(
+            result,
+            "\tkubernetes cluster.local {\n"
+            "\t\tpods verified\n"
+            "\t\tnamespaces default kube-system\n"
+            "\t\tttl 10\n"
+            "\t\tnoendpoints\n"
+            "\t}"
+        )
+
+        self.assertRaises(
+            ValidationError,
+            Parser.set_kubernetes,
+            corefile,
+            Parser.parse_args("zone=. pods=secure")
+        )
+        self.assertRaises(
+            ValidationError,
+            Parser.set_kubernetes,
+            corefile,
+            Parser.parse_args("zone=example.io pods=verified")
+        )
+
+    def test_set_autopath(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={
+                "kubernetes": CoreDNSPlugin("kubernetes", "cluster.local"),
+                "cache": PLUGIN_CACHE
+            })
+        })
+
+        self.assertEqual(
+            Parser.set_autopath(corefile, Parser.parse_args("zone=.")),
+            ".:53 {\n"
+            "\tcache\n"
+            "\tautopath @kubernetes\n"
+            "\tkubernetes cluster.local {\n"
+            "\t\tpods verified\n"
+            "\t}\n"
+            "}"
+        )
+
+        # Enabling again replaces the zones autopath applies to
+        self.assertIn(
+            "\tautopath cluster.local @kubernetes\n",
+            Parser.set_autopath(corefile, Parser.parse_args('zone=. args="cluster.local"'))
+        )
+
+        self.assertRaises(
+            ValidationError,
+            Parser.set_kubernetes,
+            corefile,
+            Parser.parse_args("zone=. pods=disabled")
+        )
+        self.assertRaises(
+            ValidationError,
+            Parser.remove_plugin,
+            corefile,
+            Parser.parse_args("name=kubernetes zone=.")
+        )
+
+        self.assertEqual(
+            Parser.set_autopath(corefile, Parser.parse_args("zone=. enabled=false")),
+            "Disabled autopath"
+        )
+        self.assertNotIn("autopath", corefile.objects[".:53"].objects)
+        Parser.remove_plugin(corefile, Parser.parse_args("name=kubernetes zone=."))
+        self.assertRaises(
+            ValidationError,
+            Parser.set_autopath,
+            corefile,
+            Parser.parse_args("zone=.")
+        )
+
+    def test_rewrite(self):
+        corefile = CoreDNSCorefile(zones={".:53": CoreDNSZone(".")})
+
+        self.assertEqual(
+            Parser.add_rewrite(corefile, Parser.parse_args('zone=. args="name a.com t.svc"')),
+            "Added rewrite rule 1"
+        )
+        for args in ("name b.com t.svc", "name a.com u.svc"):
+            Parser.add_rewrite(corefile, Parser.parse_args(f'zone=. args="{args}"'))
+        self.assertRaises(
+            ValidationError,
+            Parser.add_rewrite,
+            corefile,
+            Parser.parse_args('zone=. args="name a.com"')
+        )
+
+        self.assertEqual(
+            Parser.compile_rewrite(corefile, Parser.parse_args("zone=. dry_run=true")),
+            "Evaluations per query: 3 -> 1 (duplicates: 0, dead: 1, merged: 2)"
+        )
+        self.assertEqual(len(corefile.objects[".:53"].objects["rewrite"].objects), 3)
+
+        Parser.compile_rewrite(corefile, Parser.parse_args("zone=."))
+        self.assertEqual(
+            corefile.to_caddy(),
+            ".:53 {\n"
+            "\trewrite name regex ^(a\\.com|b\\.com)\\.$ t.svc answer auto\n"
+            "}"
+        )
+
+        self.assertEqual(
+            Parser.remove_rewrite(corefile, Parser.parse_args("zone=. id=2")),
+            ResultType.REMOVE_NOT_FOUND.value
+        )
+        Parser.remove_rewrite(corefile, Parser.parse_args("zone=. id=1"))
+        self.assertNotIn("rewrite", corefile.objects[".:53"].objects)
+
+        # Rules are not generic properties
+        Parser.add_rewrite(corefile, Parser.parse_args('zone=. args="name a.com t.svc"'))
+        for command in (Parser.add_property, Parser.remove_property):
+            self.assertRaises(
+                ValidationError,
+                command,
+                corefile,
+                Parser.parse_args('name=name args="exact b.com t.svc" plugin=rewrite zone=.')
+            )
+
+        # Block form rules keep their names, and new rules still get ids
+        corefile.block(".:53").edit("rewrite").add_property("name", "exact", "b.com", "t.svc")
+        self.assertEqual(
+            Parser.add_rewrite(corefile, Parser.parse_args('zone=. args="name c.com t.svc"')),
+            "Added rewrite rule 2"
+        )
+        self.assertEqual(
+            corefile.to_caddy(),
+            ".:53 {\n"
+            "\trewrite name a.com t.svc\n"
+            "\trewrite name exact b.com t.svc\n"
+            "\trewrite name c.com t.svc\n"
+            "}"
+        )
+
+    def test_multiple_instances(self):
+        corefile = CoreDNSCorefile(zones={".:53": CoreDNSZone(".")})
+
+        for _ in range(2):
+            Parser.add_plugin(corefile, Parser.parse_args("name=acl zone=. multiple=true"))
+        self.assertListEqual(list(corefile.objects[".:53"].objects), ["acl", "acl:2"])
+
+        Parser.add_property(
+            corefile,
+            Parser.parse_args('name=block args="type ANY" plugin=acl plugin_index=1 zone=.')
+        )
+        for net in ("10.0.0.0/8", "192.168.0.0/16"):
+            Parser.add_property(
+                corefile,
+                Parser.parse_args(f'name=allow args="net {net}" plugin=acl zone=. '
+                                  'plugin_index=0 multiple=true')
+            )
+
+        self.assertEqual(
+            corefile.to_caddy(),
+            ".:53 {\n"
+            "\tacl {\n"
+            "\t\tallow net 10.0.0.0/8\n"
+            "\t\tallow net 192.168.0.0/16\n"
+            "\t}\n"
+            "\tacl {\n"
+            "\t\tblock type ANY\n"
+            "\t}\n"
+            "}"
+        )
+
+        Parser.remove_property(
+            corefile,
+            Parser.parse_args("name=allow index=1 plugin=acl plugin_index=0 zone=.")
+        )
+        self.assertListEqual(list(corefile.objects[".:53"].objects["acl"].objects), ["allow"])
+
+        self.assertEqual(
+            Parser.remove_plugin(corefile, Parser.parse_args("name=acl index=5 zone=.")),
+            ResultType.REMOVE_NOT_FOUND.value
+        )
+        Parser.remove_plugin(corefile, Parser.parse_args("name=acl:2 zone=."))
+        self.assertListEqual(list(corefile.objects[".:53"].objects), ["acl"])
+
+        # Name is ambiguous when no instance uses it as its key
+        Parser.add_plugin(corefile, Parser.parse_args("name=acl zone=. multiple=true"))
+        Parser.remove_plugin(corefile, Parser.parse_args("name=acl zone=."))
+        Parser.add_plugin(corefile, Parser.parse_args("name=acl zone=. multiple=true"))
+        self.assertListEqual(list(corefile.objects[".:53"].objects), ["acl:2", "acl:3"])
+        self.assertRaises(
+            ValidationError,
+            Parser.add_property,
+            corefile,
+            Parser.parse_args('name=block args="type ANY" plugin=acl zone=.')
+        )
+
+    def test_snippets(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={"log": PLUGIN_LOG, "errors": PLUGIN_ERRORS}),
+            "example.io:53": CoreDNSZone("example.io")
+        })
+
+        Parser.add_snippet(corefile, Parser.parse_args("name=defaults zone=."))
+        self.assertListEqual(list(corefile.snippets["defaults"].objects), ["log", "errors"])
+        self.assertRaises(
+            ValidationError,
+            Parser.add_snippet,
+            corefile,
+            Parser.parse_args('name="bad name"')
+        )
+
+        Parser.add_plugin(corefile, Parser.parse_args('name=cache zone="(defaults)"'))
+        self.assertIn("cache", corefile.snippets["defaults"].objects)
+
+        self.assertEqual(
+            Parser.import_snippet(corefile, Parser.parse_args("name=defaults zone=example.io")),
+            "example.io:53 {\n"
+            "\timport defaults\n"
+            "}"
+        )
+        # Importing twice does not add another import
+        Parser.import_snippet(corefile, Parser.parse_args("name=defaults zone=example.io"))
+        self.assertListEqual(corefile.objects["example.io:53"].imports(), ["defaults"])
+
+        self.assertRaises(
+            ValidationError,
+            Parser.import_snippet,
+            corefile,
+            Parser.parse_args('name=defaults zone="(defaults)"')
+        )
+        self.assertRaises(
+            ValidationError,
+            Parser.import_snippet,
+            corefile,
+            Parser.parse_args("name=missing zone=example.io")
+        )
+
+        Parser.import_snippet(
+            corefile,
+            Parser.parse_args("name=defaults zone=example.io enabled=false")
+        )
+        self.assertListEqual(corefile.objects["example.io:53"].imports(), [])
+
+        Parser.import_snippet(corefile, Parser.parse_args("name=defaults zone=example.io"))
+        Parser.remove_snippet(corefile, Parser.parse_args("name=defaults"))
+        self.assertDictEqual(corefile.snippets, {})
+        self.assertListEqual(
+            list(corefile.objects["example.io:53"].objects),
+            ["log", "errors", "cache"]
+        )
+        self.assertEqual(
+            Parser.remove_snippet(corefile, Parser.parse_args("name=defaults")),
+            ResultType.REMOVE_NOT_FOUND.value
+        )
+
+    def test_templates(self):
+        corefile = CoreDNSCorefile(zones={".:53": CoreDNSZone(".")})
+
+        Parser.add_template(corefile, Parser.parse_args("name=tenant"))
+        Parser.add_plugin(
+            corefile,
+            Parser.parse_args('name=forward args=". ${upstream}" zone="<tenant>"')
+        )
+        Parser.add_property(
+            corefile,
+            Parser.parse_args('name=max_fails args="${fails}" plugin=forward zone="<tenant>"')
+        )
+
+        for name, upstream in (("a.com", "10.0.0.1"), ("b.com", "10.0.0.2")):
+            Parser.add_zone_from_template(
+                corefile,
+                Parser.parse_args(
+                    f'template=tenant name={name} args="upstream={upstream} fails=3"'
+                )
+            )
+
+        self.assertEqual(
+            corefile.to_caddy().split("\n\n")[2],
+            "b.com:53 {\n"
+            "\tforward . 10.0.0.2 {\n"
+            "\t\tmax_fails 3\n"
+            "\t}\n"
+            "}"
+        )
+
+        for args in ('template=tenant name=c.com args="upstream=10.0.0.3"',
+                     'template=tenant name=c.com args="upstream"',
+                     "template=missing name=c.com"):
+            self.assertRaises(
+                ValidationError,
+                Parser.add_zone_from_template,
+                corefile,
+                Parser.parse_args(args)
+            )
+
+        # Validation alone does not copy plugins of template zones
+        Parser.validate_property_owners(corefile, "forward", "a.com")
+        self.assertFalse(corefile.objects["a.com:53"].materialized())
+
+        Parser.add_plugin(corefile, Parser.parse_args("name=log zone=a.com"))
+        self.assertTrue(corefile.objects["a.com:53"].materialized())
+        self.assertFalse(corefile.objects["b.com:53"].materialized())
+
+        Parser.remove_template(corefile, Parser.parse_args("name=tenant"))
+        self.assertEqual(
+            Parser.remove_template(corefile, Parser.parse_args("name=tenant")),
+            ResultType.REMOVE_NOT_FOUND.value
+        )
+
+    def test_bulk_commands(self):
+        corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone("."),
+            "tenant-a.io:53": CoreDNSZone("tenant-a.io"),
+            "tenant-b.io:53": CoreDNSZone("tenant-b.io"),
+            "tls://tenant-a.io:853": CoreDNSZone("tenant-a.io", 853, scheme=SCHEME_TLS)
+        })
+
+        self.assertTrue(Parser.is_selector("*.io"))
+        self.assertTrue(Parser.is_selector("re:^tenant"))
+        self.assertFalse(Parser.is_selector("tenant-a.io"))
+        self.assertListEqual(
+            Parser.select_zones(corefile, "re:^tls://"),
+            ["tls://tenant-a.io:853"]
+        )
+        self.assertRaises(ValidationError, Parser.select_zones, corefile, "re:(")
+        # Globs ignore case like zone names do
+        self.assertListEqual(
+            Parser.select_zones(corefile, "TENANT-B.*"),
+            ["tenant-b.io:53"]
+        )
+
+        self.assertEqual(
+            Parser.add_plugin(corefile, Parser.parse_args("name=forward args='. 1.1.1.1' zone=*")),
+            "Added forward to 4 zones"
+        )
+        self.assertEqual(
+            Parser.add_plugin(corefile, Parser.parse_args("name=forward zone='*' replace=false")),
+            ResultType.ADD_NO_REPLACE.value
+        )
+        Parser.add_plugin(
+            corefile,
+            Parser.parse_args('name=forward args=". 10.0.0.2" zone="tenant-*" multiple=true')
+        )
+        self.assertCountEqual(
+            Parser.find_plugin(corefile, Parser.parse_args("name=forward args=10.0.0.2")).split(),
+            ["tenant-a.io:53", "tenant-b.io:53", "tls://tenant-a.io:853"]
+        )
+
+        self.assertEqual(
+            Parser.add_property(
+                corefile,
+                Parser.parse_args("name=max_fails args=3 plugin=forward:2 zone='tenant-*'")
+            ),
+            "Added max_fails to 3 plugins"
+        )
+        self.assertCountEqual(
+            Parser.find_plugin(
+                corefile,
+                Parser.parse_args("name=forward property=max_fails zone='*:53'")
+            ).split("\n"),
+            ["tenant-a.io:53", "tenant-b.io:53"]
+        )
+        self.assertEqual(
+            Parser.remove_property(
+                corefile,
+                Parser.parse_args("name=max_fails plugin=forward plugin_index=1 zone='re:^tls'")
+            ),
+            "Removed max_fails from 1 plugins"
+        )
+
+        self.assertEqual(
+            Parser.remove_plugin(corefile, Parser.parse_args("name=forward args=10.0.0.2 zone=*")),
+            "Removed forward from 3 zones"
+        )
+        self.assertListEqual(list(corefile.objects["tenant-a.io:53"].objects), ["forward"])
+        self.assertEqual(
+            Parser.remove_plugin(corefile, Parser.parse_args("name=forward args=10.0.0.2 zone=*")),
+            ResultType.REMOVE_NOT_FOUND.value
+        )
+        self.assertEqual(
+            Parser.find_plugin(corefile, Parser.parse_args("name=forward args=10.0.0.2")),
+            ResultType.FIND_NOT_FOUND.value
+        )
+
+        # Zones are checked before any of them is changed
+        corefile.block("tenant-b.io:53").add_plugin("kubernetes")
+        corefile.block("tenant-b.io:53").add_plugin("autopath", "@kubernetes")
+        corefile.block(".:53").add_plugin("kubernetes")
+        self.assertRaises(
+            ValidationError,
+            Parser.remove_plugin,
+            corefile,
+            Parser.parse_args("name=kubernetes zone='*'")
+        )
+        self.assertIn("kubernetes", corefile.objects[".:53"].objects)
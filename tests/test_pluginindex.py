@@ -0,0 +1,52 @@
+import unittest
+
+from coredns import CoreDNSZone
+from pluginindex import PluginIndex
+
+
+def zone(name: str, *plugins) -> CoreDNSZone:
+    result = CoreDNSZone(name)
+    for plugin in plugins:
+        result.add_plugin(*plugin)
+    return result
+
+
+class TestPluginIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        root = zone(".", ("forward", ".", "10.0.0.1"), ("cache", "30"))
+        root.objects["forward"].add_property("policy", "sequential")
+
+        self.index = PluginIndex()
+        self.index.add(".:53", root)
+        self.index.add("example.io:53", zone("example.io", ("forward", ".", "10.0.0.2"), ("log",)))
+
+    def test_zones(self):
+        self.assertEqual(len(self.index), 2)
+        self.assertIn(".:53", self.index)
+        self.assertListEqual(self.index.zones("forward"), [".:53", "example.io:53"])
+        self.assertListEqual(self.index.zones("forward", ["."]), [".:53", "example.io:53"])
+        self.assertListEqual(self.index.zones("forward", [".", "10.0.0.2"]), ["example.io:53"])
+        self.assertListEqual(self.index.zones("forward", prop="policy"), [".:53"])
+        self.assertListEqual(self.index.zones("forward", ["10.0.0.2"], "policy"), [])
+        self.assertListEqual(self.index.zones("cache", ["30"]), [".:53"])
+        self.assertListEqual(self.index.zones("hosts"), [])
+
+    def test_add_remove(self):
+        # Adding a zone again replaces its terms
+        self.index.add(".:53", zone(".", ("log",)))
+        self.assertListEqual(self.index.zones("forward"), ["example.io:53"])
+        self.assertListEqual(self.index.zones("log"), ["example.io:53", ".:53"])
+        self.assertListEqual(self.index.zones("cache"), [])
+
+        self.assertTrue(self.index.remove("example.io:53"))
+        self.assertFalse(self.index.remove("example.io:53"))
+        self.assertListEqual(self.index.zones("forward"), [])
+        self.assertListEqual(self.index.zones("log"), [".:53"])
+        self.assertEqual(len(self.index), 1)
+        self.assertNotIn("example.io:53", self.index)
+
+    def test_terms(self):
+        self.assertListEqual(
+            PluginIndex.terms("acl", ["a"], "allow"),
+            [("plugin", "acl"), ("arg", "acl", "a"), ("property", "acl", "allow")]
+        )
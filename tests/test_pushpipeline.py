@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from unittest.mock import MagicMock
+
+from charm import CorednsK8SCharm
+from ops.model import Container
+from ops.pebble import PathError
+from ops.testing import Harness
+from pushpipeline import (
+    DIGEST_SUFFIX,
+    PushPipeline
+)
+
+
+class TestPushPipeline(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(CorednsK8SCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.harness.set_can_connect("coredns", True)
+        self.container = self.harness.model.unit.get_container("coredns")
+        self.digests = {}
+
+    def pipeline(self, **files) -> PushPipeline:
+        pipeline = PushPipeline(self.container, self.digests, workers=2)
+        for name, content in files.items():
+            path = f"/etc/coredns/{name}"
+            pipeline.add(path, content, reload=name == "Corefile", make_dirs=True)
+        return pipeline
+
+    def test_run(self):
+        results = self.pipeline(Corefile=".:53 {\n}", hosts="10.0.0.1 a\n").run()
+
+        self.assertListEqual(
+            [r.path for r in results],
+            ["/etc/coredns/Corefile", "/etc/coredns/hosts"]
+        )
+        self.assertTrue(all(r.pushed for r in results))
+        self.assertEqual(results[1].size, 11)
+        self.assertTrue(PushPipeline.reload_required(results))
+        self.assertEqual(self.container.pull("/etc/coredns/hosts").read(), "10.0.0.1 a\n")
+        self.assertEqual(
+            self.container.pull("/etc/coredns/hosts" + DIGEST_SUFFIX).read(),
+            self.digests["/etc/coredns/hosts"]
+        )
+
+        # Unchanged files are not pushed, changed ones are
+        results = self.pipeline(Corefile=".:53 {\n}", hosts="10.0.0.2 a\n").run()
+        self.assertListEqual([r.pushed for r in results], [False, True])
+        self.assertFalse(PushPipeline.reload_required(results))
+        self.assertEqual(results[0].report(), "/etc/coredns/Corefile: not changed")
+
+        # Files lost by the workload are pushed again
+        self.container.remove_path("/etc/coredns/Corefile" + DIGEST_SUFFIX)
+        results = self.pipeline(Corefile=".:53 {\n}").run()
+        self.assertTrue(results[0].pushed)
+
+    def test_run_error(self):
+        push = Container.push.__get__(self.container)
+
+        def failing_push(path, *args, **kwargs):
+            if path == "/etc/coredns/hosts":
+                raise PathError("generic-file-error", "failed")
+            push(path, *args, **kwargs)
+
+        self.container.push = MagicMock(side_effect=failing_push)
+        self.assertRaises(PathError, self.pipeline(Corefile=".:53 {\n}", hosts="").run)
+
+        # Nothing is recorded, so every file is pushed on the next run
+        self.assertDictEqual(self.digests, {})
+        self.assertRaises(
+            PathError,
+            self.container.pull,
+            "/etc/coredns/Corefile" + DIGEST_SUFFIX
+        )
+
+    def test_concurrency(self):
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def slow_push(path, *args, **kwargs):
+            with lock:
+                active.append(path)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(path)
+
+        self.container.push = MagicMock(side_effect=slow_push)
+        results = self.pipeline(a="1", b="2", c="3", d="4").run()
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(results), 4)
+        # Contents and then their digests
+        self.assertEqual(self.container.push.call_count, 8)
@@ -0,0 +1,97 @@
+import unittest
+
+from rewriterules import (
+    RULE_CONTINUE,
+    RULE_STOP,
+    parse_rule,
+    compile_rules
+)
+
+
+class TestRewriteRules(unittest.TestCase):
+    def setUp(self) -> None:
+        self.maxDiff = None
+
+    def test_parse_rule(self):
+        rule = parse_rule(["name", "a.com", "b.com"])
+        self.assertEqual(rule.mode, RULE_STOP)
+        self.assertTrue(rule.is_exact_name())
+        self.assertEqual((rule.source, rule.target), ("a.com", "b.com"))
+
+        rule = parse_rule(["continue", "name", "suffix", ".a.com", ".b.com", "answer", "auto"])
+        self.assertEqual(rule.mode, RULE_CONTINUE)
+        self.assertEqual(rule.match, "suffix")
+        self.assertTupleEqual(rule.extra, ("answer", "auto"))
+        self.assertTrue(rule.may_rename())
+
+        rule = parse_rule(["type", "ANY", "HINFO"])
+        self.assertEqual(rule.field, "type")
+        self.assertTupleEqual(rule.extra, ("ANY", "HINFO"))
+
+        self.assertRaises(ValueError, parse_rule, [])
+        self.assertRaises(ValueError, parse_rule, ["stop"])
+        self.assertRaises(ValueError, parse_rule, ["name", "exact", "a.com"])
+
+    def test_compile_duplicates_and_dead(self):
+        compiled = compile_rules([
+            ["name", "exact", "a.com", "x.com", "answer", "name", "x.com", "a.com"],
+            ["type", "ANY", "HINFO"],
+            ["type", "ANY", "HINFO"],
+            ["name", "exact", "A.com.", "y.com", "answer", "name", "y.com", "a.com"]
+        ])
+        self.assertListEqual(compiled.duplicates, [["type", "ANY", "HINFO"]])
+        self.assertListEqual(
+            compiled.dead,
+            [["name", "exact", "A.com.", "y.com", "answer", "name", "y.com", "a.com"]]
+        )
+        self.assertEqual(compiled.evaluations_before, 4)
+        self.assertEqual(compiled.evaluations_after, 2)
+
+        # A continue rule may rename queries into a.com, so later rules are kept
+        compiled = compile_rules([
+            ["name", "exact", "a.com", "x.com"],
+            ["continue", "name", "suffix", ".b.com", ".a.com"],
+            ["name", "exact", "a.com", "x.com"]
+        ], merge=False)
+        self.assertListEqual(compiled.duplicates, [])
+        self.assertListEqual(compiled.dead, [])
+        self.assertEqual(compiled.evaluations_after, 3)
+
+        # Continue rules that do not rename are kept when repeated
+        compiled = compile_rules([
+            ["continue", "edns0", "local", "set", "0xffee", "abc"],
+            ["continue", "edns0", "local", "set", "0xffee", "abc"]
+        ])
+        self.assertEqual(compiled.evaluations_after, 2)
+
+    def test_compile_merge(self):
+        compiled = compile_rules([
+            ["name", "exact", "a.com", "t.svc"],
+            ["name", "B.com.", "t.svc"],
+            ["name", "exact", "c.com", "u.svc"],
+            ["name", "exact", "d.com", "u.svc", "answer", "auto"],
+            ["name", "exact", "e.com", "u.svc"]
+        ])
+        self.assertListEqual(compiled.rules, [
+            ["name", "regex", r"^(a\.com|b\.com)\.$", "t.svc", "answer", "auto"],
+            ["name", "exact", "c.com", "u.svc"],
+            ["name", "exact", "d.com", "u.svc", "answer", "auto"],
+            ["name", "exact", "e.com", "u.svc"]
+        ])
+        self.assertEqual(compiled.merged, 2)
+        self.assertEqual(compiled.evaluations_after, 4)
+
+        compiled = compile_rules([
+            ["continue", "name", "exact", "a.com", "t.svc"],
+            ["continue", "name", "exact", "b.com", "t.svc"],
+            ["stop", "name", "exact", "c.com", "t.svc"]
+        ])
+        self.assertListEqual(compiled.rules, [
+            ["continue", "name", "regex", r"^(a\.com|b\.com)\.$", "t.svc", "answer", "auto"],
+            ["stop", "name", "exact", "c.com", "t.svc"]
+        ])
+
+        self.assertEqual(
+            compile_rules([["type", "A", "AAAA"]] * 2).report(),
+            "Evaluations per query: 2 -> 1 (duplicates: 1, dead: 0, merged: 0)"
+        )
@@ -0,0 +1,339 @@
+import json
+import unittest
+
+from coredns import (
+    CoreDNSCorefile,
+    CoreDNSZone,
+    CoreDNSPlugin,
+    CoreDNSPluginProperty,
+    CoreDNSRewritePlugin,
+    CoreDNSTemplateZone,
+    PLUGIN_CACHE,
+    PLUGIN_FORWARD_CLOUDFLARE,
+    SCHEME_TLS
+)
+from dnszonefile import CoreDNSZoneFile
+from hoststable import HostsTable
+from serialization import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    COMPRESSION_LZMA,
+    FORMAT_VERSION,
+    MAGIC,
+    SerializationError,
+    StringTable,
+    LazyObjects,
+    dumps_corefile,
+    loads_corefile,
+    dumps_corefile_delta,
+    loads_corefile_delta,
+    loads_zone,
+    dumps_zonefile,
+    loads_zonefile,
+    encode_corefile,
+    decode_corefile,
+    encode_zonefile,
+    decode_zonefile,
+    dumps_hoststable,
+    loads_hoststable,
+    encode_hoststable,
+    decode_hoststable,
+    dumps_script,
+    loads_script,
+    encode_script,
+    decode_script
+)
+from parser import Parser
+
+
+class TestSerialization(unittest.TestCase):
+    def setUp(self) -> None:
+        self.maxDiff = None
+        self.corefile = CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={
+                "forward": PLUGIN_FORWARD_CLOUDFLARE,
+                "cache": PLUGIN_CACHE,
+                "kubernetes": CoreDNSPlugin(
+                    "kubernetes", "cluster.local", "in-addr.arpa", "ip6.arpa",
+                    properties={
+                        "fallthrough": CoreDNSPluginProperty(
+                            "fallthrough", "in-addr.arpa", "ip6.arpa"
+                        ),
+                        "pods": CoreDNSPluginProperty("pods", "insecure")
+                    }
+                )
+            }),
+            "example.io:69": CoreDNSZone("example.io", 69, plugins={
+                "forward": PLUGIN_FORWARD_CLOUDFLARE,
+                "cache": PLUGIN_CACHE
+            }),
+            "tls://example.io:853": CoreDNSZone("example.io", 853, scheme=SCHEME_TLS, plugins={
+                "tls": CoreDNSPlugin("tls", "cert.pem", "key.pem")
+            })
+        })
+
+    def test_string_table(self):
+        table = StringTable()
+
+        self.assertEqual(table.index("cache"), 0)
+        self.assertEqual(table.index("log"), 1)
+        self.assertEqual(table.index("cache"), 0)
+        self.assertListEqual(table.indices(["log", "errors"]), [1, 2])
+        self.assertListEqual(table.get_all([2, 0]), ["errors", "cache"])
+
+    def test_corefile_round_trip(self):
+        for compression in (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_LZMA):
+            data = dumps_corefile(self.corefile, compression)
+
+            self.assertTrue(data.startswith(MAGIC + bytes([FORMAT_VERSION, compression])))
+            self.assertEqual(loads_corefile(data), self.corefile)
+            self.assertEqual(loads_corefile(data).to_caddy(), self.corefile.to_caddy())
+
+        self.assertEqual(decode_corefile(encode_corefile(self.corefile)), self.corefile)
+
+    def test_rewrite_round_trip(self):
+        rewrite = CoreDNSRewritePlugin("rewrite", "name", "a.com", "b.com")
+        rewrite.add_rule("type", "ANY", "HINFO")
+        self.corefile.objects[".:53"].add_object(rewrite)
+
+        loaded = loads_corefile(dumps_corefile(self.corefile))
+        self.assertIsInstance(loaded.objects[".:53"].objects["rewrite"], CoreDNSRewritePlugin)
+        self.assertEqual(loaded.to_caddy(), self.corefile.to_caddy())
+
+    def test_multiple_instances_round_trip(self):
+        zone = self.corefile.objects["example.io:69"]
+        zone.add_plugin("forward", ".", "10.0.0.1", multiple=True)
+        zone.objects["cache"].add_property("denial", "0", multiple=True)
+
+        loaded = loads_corefile(dumps_corefile(self.corefile))
+        self.assertEqual(loaded, self.corefile)
+        self.assertEqual(loaded.objects["example.io:69"].objects["forward:2"].instance, "2")
+        self.assertListEqual(
+            loaded.objects["example.io:69"].instances("forward"),
+            ["forward", "forward:2"]
+        )
+
+    def test_snippets_round_trip(self):
+        self.corefile.add_snippet("shared", plugins={"log": CoreDNSPlugin("log")})
+        self.corefile.objects["example.io:69"].add_plugin("import", "shared")
+
+        for lazy in (False, True):
+            loaded = loads_corefile(dumps_corefile(self.corefile), lazy=lazy)
+            self.assertEqual(loaded.snippets, self.corefile.snippets)
+            self.assertEqual(loaded.to_caddy(), self.corefile.to_caddy())
+
+        # Snippets are kept when untouched zones are copied as is
+        loaded = loads_corefile(dumps_corefile(self.corefile), lazy=True)
+        self.assertEqual(loads_corefile(dumps_corefile(loaded)).snippets, self.corefile.snippets)
+
+    def test_templates_round_trip(self):
+        self.corefile.add_template("tenant", plugins={
+            "forward": CoreDNSPlugin("forward", ".", "${upstream}")
+        })
+        for i in range(3):
+            self.corefile.add_zone_from_template(
+                "tenant", f"t{i}.com", {"upstream": f"10.0.0.{i}"}
+            )
+        self.corefile.block("t0.com:53").add_plugin("log")
+
+        data = dumps_corefile(self.corefile, COMPRESSION_NONE)
+        for lazy in (False, True):
+            loaded = loads_corefile(data, lazy=lazy)
+            self.assertEqual(loaded.to_caddy(), self.corefile.to_caddy())
+            self.assertNotIsInstance(loaded.objects["t0.com:53"], CoreDNSTemplateZone)
+            self.assertFalse(loaded.objects["t1.com:53"].materialized())
+
+        self.assertFalse(loads_zone(data, "t2.com:53").materialized())
+        self.assertEqual(loads_zone(data, "t2.com:53").objects["forward"].args, [".", "10.0.0.2"])
+
+        # Replacing a template keeps zones created from the old one
+        for lazy in (False, True):
+            loaded = loads_corefile(data, lazy=lazy)
+            loaded.add_template("tenant", plugins={"log": CoreDNSPlugin("log")})
+            rendered = loads_corefile(dumps_corefile(loaded), lazy=lazy).to_caddy()
+            self.assertIn("forward . 10.0.0.1", rendered)
+            self.assertEqual(rendered, loaded.to_caddy())
+
+    def test_corefile_delta(self):
+        base = self.corefile.snapshot()
+        base.block("example.io:69").add_plugin("log")
+        base.remove_object(".:53")
+        base.add_zone("new.io")
+
+        data = dumps_corefile_delta(self.corefile, base, COMPRESSION_NONE)
+        self.assertLess(len(data), len(dumps_corefile(self.corefile, COMPRESSION_NONE)))
+
+        for lazy in (False, True):
+            loaded_base = loads_corefile(dumps_corefile(base), lazy=lazy)
+            loaded = loads_corefile_delta(data, loaded_base)
+            self.assertEqual(loaded, self.corefile)
+            self.assertListEqual(list(loaded.objects), list(self.corefile.objects))
+            self.assertEqual(loaded.to_caddy(), self.corefile.to_caddy())
+            self.assertEqual(loaded_base.to_caddy(), base.to_caddy())
+
+        self.corefile.add_template("tenant", plugins={"log": CoreDNSPlugin("log", "${zone}")})
+        self.corefile.add_zone_from_template("tenant", "t.com", {})
+        loaded = loads_corefile_delta(dumps_corefile_delta(self.corefile, base), base)
+        self.assertEqual(loaded, self.corefile)
+        self.assertIs(loaded.objects["t.com:53"].template, loaded.templates["tenant"])
+
+    def test_corefile_interning(self):
+        data = dumps_corefile(self.corefile, COMPRESSION_NONE)
+
+        self.assertEqual(data.count(b'"forward"'), 1)
+        self.assertEqual(data.count(b'"1.1.1.1"'), 1)
+
+    def test_loads_zone(self):
+        data = dumps_corefile(self.corefile)
+
+        self.assertEqual(loads_zone(data, "example.io:69"), self.corefile.objects["example.io:69"])
+        self.assertIsNone(loads_zone(data, "example.com"))
+
+    def test_zonefile_round_trip(self):
+        zonefile = CoreDNSZoneFile()
+        zonefile.add_record("ns", "ns.example.io", "A", "10.0.0.1")
+        zonefile.add_record(None, "www.example.io", "CNAME", "ns.example.io")
+
+        self.assertEqual(loads_zonefile(dumps_zonefile(zonefile)), zonefile)
+        self.assertEqual(decode_zonefile(encode_zonefile(zonefile)), zonefile)
+
+    def test_invalid_data(self):
+        data = dumps_corefile(self.corefile)
+
+        self.assertRaises(SerializationError, loads_corefile, b"")
+        self.assertRaises(SerializationError, loads_corefile, b"XYZ" + data[3:])
+        self.assertRaises(SerializationError, loads_corefile, MAGIC + bytes([99]) + data[4:])
+        self.assertRaises(SerializationError, loads_corefile, data[:5] + b"corrupted")
+        self.assertRaises(SerializationError, decode_corefile, "not base64!")
+
+        # Valid header with a malformed body
+        header = MAGIC + bytes([FORMAT_VERSION, COMPRESSION_NONE])
+        for body in (b"not json", b"\xff", b"[]", b"{}", b'{"s": [], "z": [[0]]}',
+                     b'{"s": ["a"], "z": [[0, 1, 53, []]]}'):
+            for loads in (loads_corefile, loads_zonefile, loads_hoststable, loads_script):
+                self.assertRaises(SerializationError, loads, header + body)
+            self.assertRaises(SerializationError, loads_zone, header + body, "a")
+            self.assertRaises(
+                SerializationError, loads_corefile_delta, header + body, self.corefile
+            )
+
+        # Zones of a lazy corefile are checked when they are built
+        corefile = loads_corefile(header + b'{"s": ["a:53"], "z": [[0, 5, 53, []]]}', lazy=True)
+        with self.assertRaises(SerializationError):
+            corefile.objects["a:53"]
+
+    def test_lazy_corefile(self):
+        data = dumps_corefile(self.corefile)
+        corefile = loads_corefile(data, lazy=True)
+        objects = corefile.objects
+
+        self.assertIsInstance(objects, LazyObjects)
+        self.assertListEqual(list(objects), [".:53", "example.io:69", "tls://example.io:853"])
+        self.assertIn("example.io:69", objects)
+        self.assertFalse(objects.is_loaded(".:53"))
+        self.assertFalse(objects.is_loaded("example.io:69"))
+
+        self.assertEqual(objects["example.io:69"], self.corefile.objects["example.io:69"])
+        self.assertFalse(objects.is_loaded(".:53"))
+        self.assertTrue(objects.is_loaded("example.io:69"))
+
+        # Untouched zones are written back without being built
+        objects["example.io:69"].add_plugin("log")
+        corefile.add_zone("example.com")
+        data = dumps_corefile(corefile)
+        self.assertFalse(objects.is_loaded(".:53"))
+
+        self.corefile.objects["example.io:69"].add_plugin("log")
+        self.corefile.add_zone("example.com")
+        self.assertEqual(loads_corefile(data), self.corefile)
+
+    def test_lazy_corefile_remove(self):
+        corefile = loads_corefile(dumps_corefile(self.corefile), lazy=True)
+
+        self.assertIsNotNone(corefile.remove_object(".:53"))
+        self.assertIsNone(corefile.remove_object(".:53"))
+        self.assertListEqual(list(corefile.objects), ["example.io:69", "tls://example.io:853"])
+
+        del self.corefile.objects[".:53"]
+        self.assertEqual(loads_corefile(dumps_corefile(corefile)), self.corefile)
+
+    def test_lazy_corefile_compacts_strings(self):
+        data = dumps_corefile(self.corefile)
+        for i in range(20):
+            corefile = loads_corefile(data, lazy=True)
+            corefile.block(".:53").add_plugin("hosts", f"/etc/coredns/hosts/{i}", replace=True)
+            data = dumps_corefile(corefile, compression=COMPRESSION_NONE)
+
+        # Arguments of replaced plugins are dropped once they are a quarter of the table
+        strings = json.loads(data[len(MAGIC) + 2:])["s"]
+        stale = sum(s.startswith("/etc/coredns/hosts/") for s in strings) - 1
+        self.assertLessEqual(stale, len(strings) // 4)
+
+        self.corefile.objects[".:53"].add_plugin("hosts", "/etc/coredns/hosts/19")
+        self.assertEqual(loads_corefile(data), self.corefile)
+
+    def test_loads_version_1(self):
+        body = b'{"s":[".","log"],"z":[[0,0,53,[[1,1,[],[]]]]]}'
+        data = MAGIC + bytes([1, COMPRESSION_NONE]) + body
+
+        # Zones keyed by their names are keyed by their addresses
+        self.assertEqual(loads_corefile(data), CoreDNSCorefile(zones={
+            ".:53": CoreDNSZone(".", plugins={"log": CoreDNSPlugin("log")})
+        }))
+        self.assertListEqual(list(loads_corefile(data, lazy=True).objects), [".:53"])
+        self.assertIsNotNone(loads_zone(data, "."))
+
+    def test_lazy_corefile_delta(self):
+        data = dumps_corefile(self.corefile)
+        base = loads_corefile(data, lazy=True)
+        for corefile in (base.snapshot(), loads_corefile(data, lazy=True)):
+            corefile.block("example.io:69").add_plugin("log")
+
+            # Only the changed zone is built
+            delta = dumps_corefile_delta(corefile, base, COMPRESSION_NONE)
+            for loaded in (base, corefile):
+                self.assertFalse(loaded.objects.is_loaded(".:53"))
+                self.assertFalse(loaded.objects.is_loaded("tls://example.io:853"))
+
+            self.assertEqual(len(json.loads(delta[len(MAGIC) + 2:])["z"]), 1)
+            self.assertEqual(loads_corefile_delta(delta, base).to_caddy(), corefile.to_caddy())
+
+    def test_legacy_corefile_delta(self):
+        legacy = CoreDNSCorefile(zones={
+            ".": CoreDNSZone(".", plugins={"log": CoreDNSPlugin("log")}),
+            "example.io": CoreDNSZone("example.io", plugins={"log": CoreDNSPlugin("log")})
+        })
+        previous = CoreDNSCorefile(zones={
+            "example.io": CoreDNSZone("example.io", plugins={"log": CoreDNSPlugin("log")}),
+            ".": CoreDNSZone(".")
+        })
+        delta = dumps_corefile_delta(previous, legacy)
+
+        # Deltas stored before an upgrade still apply to the re-keyed corefile
+        base = loads_corefile(dumps_corefile(legacy), lazy=True)
+        self.assertNotIn(".", base.objects)
+        self.assertListEqual(base.find_zones("."), [".:53"])
+        loaded = loads_corefile_delta(delta, base)
+        self.assertListEqual(list(loaded.objects), ["example.io:53", ".:53"])
+        self.assertEqual(loaded.objects[".:53"], CoreDNSZone("."))
+
+    def test_hoststable_round_trip(self):
+        table = HostsTable.parse("10.0.0.1 a b c\nfd00::1 d\n")
+        data = dumps_hoststable(table, COMPRESSION_NONE)
+
+        self.assertEqual(data.count(b'"10.0.0.1"'), 1)
+        self.assertEqual(loads_hoststable(data), table)
+        self.assertEqual(decode_hoststable(encode_hoststable(table)), table)
+
+    def test_script_round_trip(self):
+        operations = Parser.compile([
+            'add_plugin name=forward args=". 10.0.0.1" zone=.',
+            "remove_plugin name=acl index=1 zone=.",
+            "reset"
+        ])
+        data = dumps_script(operations, COMPRESSION_NONE)
+
+        self.assertEqual(data.count(b'"zone"'), 1)
+        self.assertListEqual(loads_script(data), operations)
+        self.assertListEqual(decode_script(encode_script(operations)), operations)
+        self.assertEqual(loads_script(data)[1].params["index"], 1)
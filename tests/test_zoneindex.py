@@ -0,0 +1,60 @@
+import unittest
+
+from zoneindex import (
+    ZoneIndex,
+    name_labels
+)
+
+
+class TestZoneIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = ZoneIndex([
+            (".:53", "."),
+            ("example.io:53", "example.io"),
+            ("tls://example.io:853", "example.io"),
+            ("bar.example.io:53", "bar.example.io."),
+            ("other.io:53", "Other.IO")
+        ])
+
+    def test_name_labels(self):
+        self.assertListEqual(name_labels("Foo.Example.io."), ["io", "example", "foo"])
+        self.assertListEqual(name_labels("."), [])
+        self.assertListEqual(name_labels(""), [])
+
+    def test_matches(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertListEqual(
+            self.index.matches("foo.bar.example.io"),
+            [["bar.example.io:53"], ["example.io:53", "tls://example.io:853"], [".:53"]]
+        )
+        self.assertListEqual(self.index.longest_match("a.other.io."), ["other.io:53"])
+        self.assertListEqual(self.index.longest_match("example.com"), [".:53"])
+        self.assertListEqual(self.index.longest_match("xexample.io"), [".:53"])
+        self.assertListEqual(
+            self.index.get("example.io"),
+            ["example.io:53", "tls://example.io:853"]
+        )
+        self.assertListEqual(self.index.get("io"), [])
+
+    def test_subzones(self):
+        self.assertListEqual(sorted(self.index.subzones("io")), [
+            "bar.example.io:53", "example.io:53", "other.io:53", "tls://example.io:853"
+        ])
+        self.assertListEqual(self.index.subzones("bar.example.io"), [])
+        self.assertListEqual(self.index.subzones("missing.io"), [])
+
+    def test_add_remove(self):
+        self.index.add("example.io:53", "example.io")
+        self.assertEqual(len(self.index), 5)
+
+        self.assertTrue(self.index.remove("bar.example.io:53", "bar.example.io"))
+        self.assertFalse(self.index.remove("bar.example.io:53", "bar.example.io"))
+        self.assertFalse(self.index.remove("missing.io:53", "a.missing.io"))
+        self.assertListEqual(self.index.longest_match("foo.bar.example.io"), [
+            "example.io:53", "tls://example.io:853"
+        ])
+
+        # Nodes that lead to no zone are dropped
+        self.assertTrue(self.index.remove("other.io:53", "other.io"))
+        self.assertNotIn("other", self.index._root.children["io"].children)
+        self.assertEqual(len(self.index), 3)